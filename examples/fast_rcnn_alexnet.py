@@ -109,6 +109,8 @@ args.batch_size = 32
 n_mb = None
 img_per_batch = args.batch_size
 rois_per_img = 64
+# processes decoding the images of the upcoming minibatches
+num_workers = 4
 frcn_fine_tune = False
 learning_rate_scale = 1.0/10
 
@@ -120,7 +122,8 @@ be = gen_backend(**extract_valid_args(args, gen_backend))
 
 # setup training dataset
 train_set = PASCALVOC('trainval', '2007', path=args.data_dir, output_type=0,
-                      n_mb=n_mb, img_per_batch=img_per_batch, rois_per_img=rois_per_img)
+                      n_mb=n_mb, img_per_batch=img_per_batch, rois_per_img=rois_per_img,
+                      num_workers=num_workers)
 
 # setup layers
 
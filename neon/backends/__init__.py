@@ -31,21 +31,23 @@ from neon.backends.util.check_gpu import get_device_count
 def gen_backend(backend='cpu', rng_seed=None, datatype=np.float32,
                 batch_size=0, stochastic_round=False, device_id=0,
                 max_devices=get_device_count(), compat_mode=None,
-                deterministic_update=False, deterministic=True):
+                deterministic_update=False, deterministic=True, num_threads=None,
+                num_procs=2):
     """
     Construct and return a backend instance of the appropriate type based on
     the arguments given. With no parameters, a single CPU core, float32
     backend is returned.
 
     Arguments:
-        backend (string, optional): 'cpu' or 'gpu'.
+        backend (string, optional): 'cpu', 'mcpu' or 'gpu'.
         rng_seed (numeric, optional): Set this to a numeric value which can be used to seed the
                                       random number generator of the instantiated backend.
                                       Defaults to None, which doesn't explicitly seed (so each run
                                       will be different)
         dataype (dtype): Default tensor data type. CPU backend supports np.float64, np.float32 and
                          np.float16; GPU backend supports np.float32 and np.float16.
-        batch_size (int): Set the size the data batches.
+        batch_size (int): Set the size the data batches.  With the mcpu backend this is the
+                          size of the minibatch of all processes together.
         stochastic_round (int/bool, optional): Set this to True or an integer to implent
                                                stochastic rounding. If this is False rounding will
                                                be to nearest. If True will perform stochastic
@@ -61,6 +63,9 @@ def gen_backend(backend='cpu', rng_seed=None, datatype=np.float32,
                                      layer output sizes will match that of caffe as will
                                      the dropout layer implementation
         deterministic (bool, optional): if set to true, all operations will be done deterministically.
+        num_threads (int, optional): number of worker threads (and BLAS threads) used by the cpu
+                                     backend.  Defaults to None, which runs single threaded.
+        num_procs (int, optional): number of processes training together with the mcpu backend.
 
     Returns:
         Backend: newly constructed backend instance of the specifed type.
@@ -85,7 +90,12 @@ def gen_backend(backend='cpu', rng_seed=None, datatype=np.float32,
 
     if backend == 'cpu' or backend is None:
         from neon.backends.nervanacpu import NervanaCPU
-        be = NervanaCPU(rng_seed=rng_seed, default_dtype=datatype, compat_mode=compat_mode)
+        be = NervanaCPU(rng_seed=rng_seed, default_dtype=datatype, compat_mode=compat_mode,
+                        num_threads=num_threads)
+    elif backend == 'mcpu':
+        from neon.backends.nervanamcpu import NervanaMCPU
+        be = NervanaMCPU(num_procs=num_procs, rng_seed=rng_seed, default_dtype=datatype,
+                         compat_mode=compat_mode, num_threads=num_threads)
     elif backend == 'gpu' or backend == 'mgpu':
         gpuflag = False
         # check nvcc
@@ -121,12 +131,16 @@ def gen_backend(backend='cpu', rng_seed=None, datatype=np.float32,
         from argon.neon_backend.ar_backend import ArBackend
         be = ArBackend(rng_seed=rng_seed, default_dtype=datatype)
     else:
-        raise ValueError("backend must be one of ('cpu', 'gpu', 'mgpu')")
+        raise ValueError("backend must be one of ('cpu', 'mcpu', 'gpu', 'mgpu')")
 
     logger.info("Backend: {}, RNG seed: {}".format(backend, rng_seed))
 
+    # each process of a data parallel backend runs its share of the minibatch
+    if batch_size % be.num_procs != 0:
+        raise ValueError("batch_size %d is not a multiple of the %d processes" %
+                         (batch_size, be.num_procs))
     NervanaObject.be = be
-    be.bsz = batch_size
+    be.bsz = batch_size // be.num_procs
     return be
 
 
@@ -135,7 +149,9 @@ def cleanup_backend():
         return;
     be = NervanaObject.be
     from neon.backends.nervanacpu import NervanaCPU
-    if type(be) is not NervanaCPU:
+    if isinstance(be, NervanaCPU):
+        be.cleanup()
+    else:
         from neon.backends.nervanagpu import NervanaGPU
         try:
             if type(be) is NervanaGPU:
@@ -443,6 +443,11 @@ class Backend(object):
         self.bsz = None
         self._min_dims = 2
 
+        # position among the processes training the same model, see
+        # data_shard and allreduce
+        self.rank = 0
+        self.num_procs = 1
+
         if compat_mode is not None:
             if compat_mode == 'caffe':
                 self.set_caffe_compat()
@@ -551,6 +556,32 @@ class Backend(object):
         """
         return None
 
+    def data_shard(self, ndata):
+        """
+        For backends training with several processes, the examples of a
+        training set that this process iterates over (see
+        NervanaDataIterator.shard).
+
+        Arguments:
+            ndata (int): number of examples of the dataset
+
+        Returns:
+            slice: examples of the dataset held by this process, all of them
+                   by default
+        """
+        return slice(None)
+
+    def allreduce(self, tensors):
+        """
+        For backends training with several processes, replace in place each
+        tensor by its average over the processes.  Optimizers call this on the
+        gradients before updating the parameters.  Does nothing by default.
+
+        Arguments:
+            tensors (list): Tensors of the same shapes in every process
+        """
+        pass
+
     def revert_tensor(self, tensor):
         """
         Reverts a tensor to its original state after being distributed by
@@ -926,6 +957,23 @@ class Backend(object):
         """
         raise NotImplementedError()
 
+    def compound_dot_int8(self, A, B, C, w_scale, x_scale, beta=0.0):
+        """
+        Quantized matrix product for inference:
+        C = (w_scale * x_scale) * (A * Bq) + beta * C
+        where Bq is B rounded to int8 values with the step x_scale, and the
+        products of the int8 values are accumulated in int32.
+
+        Arguments:
+            A (Tensor): int8 left-hand side operand (weights)
+            B (Tensor): right-hand side operand (inputs)
+            C (Tensor): output operand
+            w_scale (Tensor): quantization step of each row of A, shape (K, 1)
+            x_scale (float): quantization step of B
+            beta (float, optional): scale C term before sum
+        """
+        raise NotImplementedError()
+
     def batched_dot(self, A, B, C, alpha=1.0, beta=0.0, relu=False):
         """
         Perform one of the following operations:
@@ -1782,6 +1830,25 @@ class Backend(object):
         """
         raise NotImplementedError()
 
+    def fprop_conv_int8(self, layer, I, F, O, w_scale, x_scale, beta=0.0):
+        """
+        Quantized forward propagation of a convolutional network layer for
+        inference.  The inputs are rounded to int8 values with the step
+        x_scale and convolved with the int8 filters, the products being
+        accumulated in int32, then scaled by w_scale * x_scale.
+
+        Arguments:
+            layer: the conv layer as a parameter object
+            I (Tensor): inputs
+            F (Tensor): int8 weights (filters)
+            O (Tensor): outputs
+            w_scale (Tensor): quantization step of the filters of each output
+                              feature map, shape (K, 1)
+            x_scale (float): quantization step of the inputs
+            beta (float, optional): accumulation value into O
+        """
+        raise NotImplementedError()
+
     def bprop_conv(self, layer, F, E, grad_I, alpha=1.0, repeat=1):
         """
         Backward propagate the error through a convolutional network layer.
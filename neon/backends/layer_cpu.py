@@ -16,8 +16,13 @@
 CPU backend layers
 """
 import math
+import numpy as np
 from operator import mul
 
+# upper bound on the number of elements in a single im2col block, keeps the
+# lowered input matrix of large layers from blowing up host memory
+IM2COL_MAX_SIZE = 1 << 23
+
 
 def ceil_div(x, y):
     """
@@ -26,6 +31,53 @@ def ceil_div(x, y):
     return -(-x // y)
 
 
+def fprop_index(X, S, Y, padding, strides):
+    """
+    Input position read by filter tap s for output position y along a single
+    dimension.  Returns an (S, Y) array of positions and a mask of which of
+    them fall inside the (unpadded) input of size X.
+    """
+    idx = (np.arange(Y) * strides - padding)[np.newaxis, :] + np.arange(S)[:, np.newaxis]
+    return idx, (idx >= 0) & (idx < X)
+
+
+def bprop_index(X, S, Y, padding, strides):
+    """
+    Output position that receives input position x through filter tap s along
+    a single dimension.  Returns an (S, X) array of positions and a mask of
+    which taps actually connect to an output of size Y.
+    """
+    offset = np.arange(X)[np.newaxis, :] + padding - np.arange(S)[:, np.newaxis]
+    idx = offset // strides
+    return idx, (offset % strides == 0) & (idx >= 0) & (idx < Y)
+
+
+def gather_table(dims, sentinel):
+    """
+    Combine the per dimension (index, mask) pairs returned by fprop_index or
+    bprop_index into a single (taps, positions) table of flattened offsets,
+    e.g. (T*R*S, M*P*Q) for convolution.  Entries that are masked out in any
+    dimension are set to sentinel.
+
+    Arguments:
+        dims (list): (index, mask, size) triplets from the outermost to the
+                     innermost dimension, where size is the extent of the
+                     dimension being indexed into.
+        sentinel (int): offset used for out of bounds entries
+    """
+    ndims = len(dims)
+    idx, ok = 0, True
+    for axis, (dim_idx, dim_ok, size) in enumerate(dims):
+        shape = [1] * (2 * ndims)
+        shape[axis] = dim_idx.shape[0]
+        shape[axis + ndims] = dim_idx.shape[1]
+        idx = idx * size + dim_idx.reshape(shape)
+        ok = ok & dim_ok.reshape(shape)
+    table = np.where(ok, idx, sentinel).astype(np.intp)
+    taps = reduce(mul, table.shape[:ndims], 1)
+    return table.reshape((taps, -1))
+
+
 class ConvLayer(object):
 
     """
@@ -92,6 +144,42 @@ class ConvLayer(object):
         self.hSlice = [self.bprop_slice(h, R, P, pad_h, str_h) for h in range(H)]
         self.wSlice = [self.bprop_slice(w, S, Q, pad_w, str_w) for w in range(W)]
 
+        self.init_im2col()
+
+    def init_im2col(self):
+        """
+        Precompute the gather tables used by the im2col/GEMM convolution
+        kernels.
+
+        fprop_idx is a (T*R*S, M*P*Q) table of offsets into the flattened
+        D*H*W input pixels, with out of bounds (padding) taps pointing at
+        the extra zero pixel D*H*W.  bprop_idx is the (T*R*S, D*H*W) table of
+        offsets into the M*P*Q output pixels read by each input pixel through
+        each (flipped) filter tap, with M*P*Q as the zero pixel.  The block
+        sizes bound the number of pixels lowered into a single GEMM.
+        """
+        C, D, H, W, N = self.dimI
+        C, T, R, S, K = self.dimF
+        K, M, P, Q, N = self.dimO
+        pad_d, pad_h, pad_w = self.padding
+        str_d, str_h, str_w = self.strides
+
+        DHW = D * H * W
+        MPQ = M * P * Q
+        TRS = T * R * S
+
+        self.fprop_idx = gather_table(
+            [fprop_index(D, T, M, pad_d, str_d) + (D,),
+             fprop_index(H, R, P, pad_h, str_h) + (H,),
+             fprop_index(W, S, Q, pad_w, str_w) + (W,)], DHW)
+        self.bprop_idx = gather_table(
+            [bprop_index(D, T, M, pad_d, str_d) + (M,),
+             bprop_index(H, R, P, pad_h, str_h) + (P,),
+             bprop_index(W, S, Q, pad_w, str_w) + (Q,)], MPQ)
+
+        self.fprop_blk = max(1, min(MPQ, IM2COL_MAX_SIZE // (C * TRS * N)))
+        self.bprop_blk = max(1, min(DHW, IM2COL_MAX_SIZE // (K * TRS * N)))
+
     def fprop_slice(self, q, S, X, padding, strides):
         firstF = 0
         lastF = S - 1
@@ -198,6 +286,8 @@ class DeconvLayer(ConvLayer):
         self.pSlice = [self.fprop_slice(p, R, H, pad_h, str_h) for p in range(P)]
         self.qSlice = [self.fprop_slice(q, S, W, pad_w, str_w) for q in range(Q)]
 
+        self.init_im2col()
+
 
 class PoolLayer(object):
 
@@ -283,6 +373,39 @@ class PoolLayer(object):
         self.pSlice = [self.pool_slice(p, R, H, pad_h, str_h) for p in range(P)]
         self.qSlice = [self.pool_slice(q, S, W, pad_w, str_w) for q in range(Q)]
 
+        self.init_windows()
+
+    def init_windows(self):
+        """
+        Precompute the gather/scatter tables used by the vectorized CPU pooling
+        kernels.
+
+        pool_idx is a (J*T*R*S, K*M*P*Q) table of offsets into the flattened
+        C*D*H*W input, with taps falling in the padding pointing at the extra
+        pixel C*D*H*W.  For a given tap every window reads a distinct input
+        pixel, so scattering one tap at a time needs no atomic adds.
+        pool_slot maps each tap to its position within the clipped window
+        (the argmax convention), or -1 for padding taps, and pool_count holds
+        the number of valid taps per window.
+        """
+        C, D, H, W, N = self.dimI
+        J, T, R, S = self.JTRS
+        pad_c, pad_d, pad_h, pad_w = self.padding
+        str_c, str_d, str_h, str_w = self.strides
+
+        self.pool_idx = gather_table(
+            [fprop_index(C, J, self.K, pad_c, str_c) + (C,),
+             fprop_index(D, T, self.M, pad_d, str_d) + (D,),
+             fprop_index(H, R, self.P, pad_h, str_h) + (H,),
+             fprop_index(W, S, self.Q, pad_w, str_w) + (W,)], self.sizeI // N)
+
+        valid = self.pool_idx != self.sizeI // N
+        self.pool_slot = np.where(valid, np.cumsum(valid, axis=0) - 1, -1)
+        self.pool_count = valid.sum(axis=0)
+
+        taps, windows = self.pool_idx.shape
+        self.pool_blk = max(1, min(windows, IM2COL_MAX_SIZE // (taps * N)))
+
     def pool_slice(self, q, S, X, padding, strides):
         qs = q * strides - padding
         firstI = None
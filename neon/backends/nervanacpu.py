@@ -17,11 +17,16 @@ Our CPU based backend interface and tensor data structure. Our implementation
 wraps :mod:`numpy` ndarray and related operations
 """
 
+import ctypes
 import numpy as np
 import logging
+import os
+import threading
 import time
-from neon.backends.backend import Tensor, Backend, OpTreeNode, OpCollection
+from multiprocessing.pool import ThreadPool
+from neon.backends.backend import Tensor, Backend, OpTreeNode
 from neon.backends.layer_cpu import ConvLayer, DeconvLayer, PoolLayer
+from neon.backends.optree_cpu import OpTreePlan, split_key
 
 _none_slice = slice(None, None, None)
 
@@ -142,14 +147,23 @@ class CPUTensor(Tensor):
         to the total number of elements along that dimension.  As such a slice
         value of ':' allows one to select all elements along that dimension.
 
+        An integer numpy array key selects whole rows, as in numpy, e.g.
+        A[np.array([3, 1])] = B where B has two rows.
+
         Arguments:
-            key (int, slice, tuple): indices of each dimension's slice.
+            key (int, slice, tuple, numpy array): indices of each dimension's
+                                                  slice, or of the rows to set.
             value (numeric array, CPUTensor): values to be assigned to the
                                               extracted element subset.  If an
                                               array it should be the same shape
                                               as what key indexes (or be
                                               broadcastable as such).
         """
+        if isinstance(key, np.ndarray):
+            if isinstance(value, CPUTensor):
+                value = value._tensor
+            self._tensor[key] = value
+            return self
 
         self.__getitem__(key)._assign(value)
         return self
@@ -259,13 +273,15 @@ class CPUTensor(Tensor):
         """
         return self._tensor
 
-    def take(self, indices, axis=None):
+    def take(self, indices, axis=None, out=None):
         """
         Select a subset of elements from an array across an axis
 
         Arguments:
             indices (Tensor, numpy ndarray): indicies of elements to select
             axis (int): axis across which to select the values
+            out (Tensor, optional): contiguous tensor to gather the values
+                                    into, instead of a new one
 
         Returns:
             Tensor: Tensor with selected values
@@ -279,6 +295,9 @@ class CPUTensor(Tensor):
             indices = indices.squeeze()
         new_shape = list(self.shape)
         new_shape[axis] = indices.size
+        if out is not None:
+            np.take(self._tensor, indices, axis, out=out._tensor.reshape(new_shape))
+            return out
         return self.__class__(
             backend=self.backend,
             ary=self._tensor.take(indices, axis).reshape(new_shape),
@@ -431,6 +450,87 @@ class CustomNumpy:
         return np.argmin(x, axis=axis).reshape(new_shape)
 
 
+def _zero_pixel_pad(array, C, N):
+    """
+    Return a (C, pixels + 1, N) copy of a (C, ..., N) array with an extra
+    all zero pixel appended, so that the out of bounds entries of the im2col
+    gather tables read zeros.
+    """
+    array = array.reshape((C, -1, N))
+    padded = np.empty((C, array.shape[1] + 1, N), dtype=array.dtype)
+    padded[:, :-1, :] = array
+    padded[:, -1, :] = 0
+    return padded
+
+
+def _set_blas_threads(num_threads):
+    """
+    Set the number of threads used by the BLAS library loaded into this
+    process.  OpenBLAS and MKL are supported.
+
+    Returns:
+        bool: True if a supported BLAS library was found.
+    """
+    try:
+        with open('/proc/self/maps') as maps:
+            libs = set(line.split()[-1] for line in maps if '.so' in line)
+    except IOError:
+        return False
+
+    found = False
+    for path in libs:
+        name = os.path.basename(path).lower()
+        for tag, setter in (('openblas', 'openblas_set_num_threads'),
+                            ('mkl_rt', 'MKL_Set_Num_Threads')):
+            if tag in name:
+                try:
+                    getattr(ctypes.CDLL(path), setter)(num_threads)
+                    found = True
+                except (OSError, AttributeError):
+                    pass
+    return found
+
+
+def _accumulate(out, value, alpha, beta):
+    """
+    out <- alpha * value + beta * out, skipping the read of out when beta is 0.
+    """
+    if alpha != 1.0:
+        value *= alpha
+    if beta != 0:
+        out *= beta
+        out += value
+    else:
+        out[:] = value
+
+
+# float32 holds integers exactly up to 2 ** 24, so sums of up to this many
+# products of int8 values in [-127, 127]
+_INT8_DOT_BLOCK = 2 ** 24 // (127 * 127)
+
+
+def _quantize_int8(array, step):
+    """
+    Round an array to int8 multiples of step, clipped to [-127, 127].
+    """
+    q = np.rint(array * (1.0 / step))
+    np.clip(q, -127, 127, out=q)
+    return q.astype(np.int8)
+
+
+def _int8_dot(A, B):
+    """
+    Product of two int8 matrices, accumulated in int32.  numpy has no integer
+    GEMM, so the partial products over blocks of the inner dimension short
+    enough to be exact in float32 run on the float BLAS.
+    """
+    out = np.zeros((A.shape[0], B.shape[1]), dtype=np.int32)
+    for start in range(0, A.shape[1], _INT8_DOT_BLOCK):
+        blk = slice(start, start + _INT8_DOT_BLOCK)
+        out += np.dot(A[:, blk].astype(np.float32), B[blk].astype(np.float32)).astype(np.int32)
+    return out
+
+
 def _assign_right_to_left(left, right):
     left[:] = right
 
@@ -484,9 +584,15 @@ class NervanaCPU(Backend):
     Sets up a :mod:`numpy` based backend for matrix ops.  By default, we use
     32-bit element data types for any arrays constructed.
 
+    With num_threads greater than one, convolution, pooling, LRN, batch norm
+    and large elementwise op-trees are split over the batch or channel axis
+    and run on a persistent pool of worker threads, and the BLAS library is
+    set to use the same number of threads for matrix products.
+
     Attributes:
         default_dtype (dtype): default element data type.
         tensor_cls: underlying Tensor type. For CPU backend, it will be CPU tensor
+        num_threads (int): number of worker threads.
 
     See also:
         CPUTensor
@@ -497,7 +603,8 @@ class NervanaCPU(Backend):
                  default_dtype=np.float32,
                  hist_bins=64,
                  hist_offset=-48,
-                 compat_mode=None):
+                 compat_mode=None,
+                 num_threads=None):
 
         if default_dtype not in [np.float16, np.float32, np.float64]:
             logger.error('Default data type for nervanagpu '
@@ -530,6 +637,69 @@ class NervanaCPU(Backend):
         self.hist_idx = 0
         self.hist_map = dict()
 
+        # compiled op-tree plans, and the block size (in elements) used to run
+        # large elementwise op-trees in cache sized pieces (0 to disable)
+        self.optree_plans = dict()
+        self.ew_chunk_size = 1 << 16
+
+        # worker threads, numpy releases the GIL in the kernels they run
+        self.num_threads = 1 if num_threads is None else int(num_threads)
+        if self.num_threads < 1:
+            raise ValueError("num_threads must be at least 1")
+        self.thread_pool = None
+        self.thread_state = threading.local()
+        if self.num_threads > 1:
+            self.thread_pool = ThreadPool(self.num_threads)
+            if not _set_blas_threads(self.num_threads):
+                logger.warn("Could not set the BLAS thread count, set "
+                            "OMP_NUM_THREADS before starting instead")
+
+    def cleanup(self):
+        """
+        Shut down the worker threads.
+        """
+        if self.thread_pool is not None:
+            self.thread_pool.terminate()
+            self.thread_pool = None
+
+    def parallel_for(self, n, func):
+        """
+        Call func(start, stop) over contiguous pieces of range(n), one piece
+        per worker thread.  Runs func(0, n) inline when the backend is single
+        threaded or when called from a worker thread.
+
+        Arguments:
+            n (int): size of the range to split
+            func (function): called with the bounds of each piece, pieces
+                             must write to disjoint outputs
+        """
+        if (self.thread_pool is None or n < 2 or
+                getattr(self.thread_state, 'worker', False)):
+            func(0, n)
+            return
+
+        parts = min(self.num_threads, n)
+        bounds = [n * i // parts for i in range(parts + 1)]
+
+        def run(i):
+            self.thread_state.worker = True
+            func(bounds[i], bounds[i + 1])
+
+        self.thread_pool.map(run, range(parts))
+
+    def _gather_pixels(self, array, idx):
+        """
+        Return array[:, idx, :] for a (channels, pixels, N) array, gathered
+        over blocks of channels in parallel.
+        """
+        out = np.empty((array.shape[0],) + idx.shape + (array.shape[2],), dtype=array.dtype)
+
+        def gather(c0, c1):
+            np.take(array[c0:c1], idx, axis=1, out=out[c0:c1], mode='clip')
+
+        self.parallel_for(array.shape[0], gather)
+        return out
+
     def gen_rng(self, seed=None):
         self.rng = np.random.RandomState(seed)
         self.init_rng_state = self.rng_get_state()
@@ -561,6 +731,10 @@ class NervanaCPU(Backend):
 
     def execute(self, optree):
         """
+        Evaluate an op-tree.  Each op-tree structure is compiled once into an
+        OpTreePlan that is cached by intrinsic key and evaluates into reused
+        scratch buffers and the assignment target.
+
         Arguments:
             optree: (OpTreeNode): the OpTreeNode object that represents all
                                     the operations
@@ -590,37 +764,13 @@ class NervanaCPU(Backend):
 
             return array_output
 
-        # get post order stack
-        postfix_stack = optree.traverse(list())
-
-        # init compute stack
-        compute_stack = []
-
-        # iterate through postfix stack to compute result
-        for p in postfix_stack:
-            if isinstance(p, dict):
-                # TODO add rand and onehot here
-                if p['op'] in OpCollection.unary_ops:
-                    left = compute_stack.pop()
-                    compute_stack.append(numpy_call_dict[p['op']](left))
-                elif p['op'] in OpCollection.binary_ops:
-                    right = compute_stack.pop()
-                    left = compute_stack.pop()
-                    compute_stack.append(numpy_call_dict[p['op']](left, right))
-                elif p['op'] in OpCollection.reduction_ops:
-                    left = compute_stack.pop()
-                    compute_stack.append(numpy_call_dict[p['op']](p, left))
-                elif p['op'] in OpCollection.zero_operand_ops:
-                    compute_stack.append(numpy_call_dict[p['op']](None))
-                else:
-                    raise NotImplementedError
-            elif isinstance(p, CPUTensor):
-                compute_stack.append(p._tensor)
-            else:
-                compute_stack.append(p)
+        key, arrays, consts = split_key(optree)
+        plan = self.optree_plans.get(key)
+        if plan is None:
+            plan = self.optree_plans[key] = OpTreePlan(key, arrays, consts, numpy_call_dict)
+        plan(arrays, consts, self.ew_chunk_size, self.parallel_for)
 
-        assert len(compute_stack) == 1
-        return postfix_stack[0]
+        return optree[1]
 
     def empty(self, shape, dtype=None, name=None, persist_values=True,
               parallel=False, distributed=False):
@@ -934,6 +1084,31 @@ class NervanaCPU(Backend):
             self.rng.uniform(size=out._tensor.shape) < keepthresh,
             dtype=out._tensor.dtype)
 
+    def compound_dot_int8(self, A, B, C, w_scale, x_scale, beta=0.0):
+        """
+        Quantized matrix product for inference:
+        C = (w_scale * x_scale) * (A * Bq) + beta * C
+        where Bq is B rounded to int8 values with the step x_scale, and the
+        products of the int8 values are accumulated in int32.
+
+        Arguments:
+            A (CPUTensor): int8 weights (K, N)
+            B (CPUTensor): inputs (N, M)
+            C (CPUTensor): output (K, M)
+            w_scale (CPUTensor): quantization step of each row of A, (K, 1)
+            x_scale (float): quantization step of B
+            beta (float): scale C term before sum
+        """
+        assert A.dtype == np.int8
+        assert A.shape[0] == C.shape[0]
+        assert B.shape[1] == C.shape[1]
+        assert A.shape[1] == B.shape[0]
+
+        acc = _int8_dot(A._tensor, _quantize_int8(B._tensor, x_scale))
+        scale = w_scale._tensor * np.float32(x_scale)
+        _accumulate(C._tensor, np.multiply(acc, scale, dtype=np.float32), 1.0, beta)
+        return C
+
     def conv_layer(self, dtype,
                    N, C, K,
                    D=1, H=1, W=1,
@@ -974,6 +1149,11 @@ class NervanaCPU(Backend):
         Forward propagate the inputs of a convolutional network layer to
         produce output
 
+        The inputs are lowered with the layer's precomputed im2col tables and
+        the whole minibatch is convolved with one GEMM per block of output
+        pixels.  With worker threads, the gathers are split over the input
+        channels and the GEMMs run on the threaded BLAS.
+
         Arguments:
             layer: the conv layer as a parameter object
             I (CPUTensor): inputs
@@ -988,40 +1168,70 @@ class NervanaCPU(Backend):
         assert layer.sizeF == F.size
         assert layer.sizeO == O.size
 
-        M, P, Q = layer.MPQ
         C, D, H, W, N = layer.dimI
         C, T, R, S, K = layer.dimF
         K, M, P, Q, N = layer.dimO
 
-        pad_d, pad_h, pad_w = layer.padding
-        str_d, str_h, str_w = layer.strides
+        array_I = _zero_pixel_pad(I.get(), C, N)
+        array_F = F.get().reshape((-1, K)).T
+        array_O = O.get().reshape((K, -1, N))
 
-        array_I = I.get().reshape(layer.dimI)
-        array_F = F.get().reshape(layer.dimF)
-        array_O = O.get().reshape(layer.dimO)
+        for start in range(0, M * P * Q, layer.fprop_blk):
+            stop = min(start + layer.fprop_blk, M * P * Q)
+            cols = self._gather_pixels(array_I, layer.fprop_idx[:, start:stop])
+            out = np.dot(array_F, cols.reshape((C * T * R * S, -1)))
+            _accumulate(array_O[:, start:stop, :], out.reshape((K, -1, N)), alpha, beta)
 
-        for m in range(M):
-            sliceT, sliceD, _ = layer.mSlice[m]
+        if bsum is not None:
+            bsum[:] = array_O.sum((1, 2))
 
-            for p in range(P):
-                sliceR, sliceH, _ = layer.pSlice[p]
+    def fprop_conv_int8(self, layer, I, F, O, w_scale, x_scale, beta=0.0):
+        """
+        Quantized forward propagation of a convolutional network layer for
+        inference.  The inputs are rounded to int8 values with the step
+        x_scale, then lowered as in fprop_conv, so the gathers move a quarter
+        of the bytes, and convolved with the int8 filters, the products being
+        accumulated in int32.
 
-                for q in range(Q):
-                    sliceS, sliceW, _ = layer.qSlice[q]
+        Arguments:
+            layer: the conv layer as a parameter object
+            I (CPUTensor): inputs
+            F (CPUTensor): int8 weights (filters)
+            O (CPUTensor): outputs
+            w_scale (CPUTensor): quantization step of the filters of each
+                                 output feature map, (K, 1)
+            x_scale (float): quantization step of the inputs
+            beta (float): accumulation value into O
+        """
+        assert layer.sizeI == I.size
+        assert layer.sizeF == F.size
+        assert layer.sizeO == O.size
+        assert F.dtype == np.int8
 
-                    slicedF = array_F[:, sliceT, sliceR, sliceS, :].reshape((-1, K))
-                    slicedI = array_I[:, sliceD, sliceH, sliceW, :].reshape((-1, N))
+        C, D, H, W, N = layer.dimI
+        C, T, R, S, K = layer.dimF
+        K, M, P, Q, N = layer.dimO
 
-                    array_O[:, m, p, q, :] = beta * array_O[:, m, p, q, :] + alpha * \
-                        np.dot(slicedF.T,  slicedI)
+        array_I = _zero_pixel_pad(_quantize_int8(I.get(), x_scale), C, N)
+        array_F = F.get().reshape((-1, K)).T
+        array_O = O.get().reshape((K, -1, N))
+        scale = (w_scale.get() * np.float32(x_scale)).reshape((K, 1, 1))
 
-        if bsum is not None:
-            bsum[:] = array_O.sum((1, 2, 3, 4))
+        for start in range(0, M * P * Q, layer.fprop_blk):
+            stop = min(start + layer.fprop_blk, M * P * Q)
+            cols = self._gather_pixels(array_I, layer.fprop_idx[:, start:stop])
+            acc = _int8_dot(array_F, cols.reshape((C * T * R * S, -1)))
+            _accumulate(array_O[:, start:stop, :],
+                        np.multiply(acc.reshape((K, -1, N)), scale, dtype=np.float32), 1.0, beta)
 
     def bprop_conv(self, layer, F, E, grad_I, alpha=1.0, relu=False, bsum=None, beta=0.0):
         """
         Backward propagate the error through a convolutional network layer.
 
+        Each input pixel gathers the errors it contributed to through the
+        layer's precomputed bprop table, so grad_I is produced by one GEMM per
+        block of input pixels without any scatter.
+
         Arguments:
             layer: the conv layer as a parameter object
             F (CPUTensor): the weights (filters)
@@ -1036,48 +1246,20 @@ class NervanaCPU(Backend):
         assert layer.sizeO == E.size
         assert layer.sizeI == grad_I.size
 
-        M, P, Q = layer.MPQ
         C, D, H, W, N = layer.dimI
         C, T, R, S, K = layer.dimF
         K, M, P, Q, N = layer.dimO
 
-        pad_d, pad_h, pad_w = layer.padding
-        str_d, str_h, str_w = layer.strides
-
-        array_F = F.get().reshape(layer.dimF)
-        array_E = E.get().reshape(layer.dimO)
-        array_grad_I = grad_I.get().reshape(layer.dimI)
-
-        array_F = np.transpose(array_F, (4, 1, 2, 3, 0)).copy()
-
-        for d in range(D):
-            sliceT, sliceM = layer.dSlice[d]
-
-            for h in range(H):
-                sliceR, sliceP = layer.hSlice[h]
-
-                for w in range(W):
-                    sliceS, sliceQ = layer.wSlice[w]
-
-                    sliceTRS = np.array([
-                        t * R * S + r * S + s
-                        for t in sliceT
-                        for r in sliceR
-                        for s in sliceS], dtype=np.intp)
-
-                    sliceMPQ = np.array([
-                        m * P * Q + p * Q + q
-                        for m in sliceM
-                        for p in sliceP
-                        for q in sliceQ], dtype=np.intp)
+        array_F = F.get().reshape((C, -1, K)).transpose((0, 2, 1)).reshape((C, -1))
+        array_E = _zero_pixel_pad(E.get(), K, N)
+        array_grad_I = grad_I.get().reshape((C, -1, N))
 
-                    slicedF = array_F.reshape(
-                        (K, -1, C))[:, sliceTRS, :].reshape((-1, C))
-                    slicedE = array_E.reshape(
-                        (K, -1, N))[:, sliceMPQ, :].reshape((-1, N))
+        for start in range(0, D * H * W, layer.bprop_blk):
+            stop = min(start + layer.bprop_blk, D * H * W)
+            cols = self._gather_pixels(array_E, layer.bprop_idx[:, start:stop])
+            out = np.dot(array_F, cols.reshape((K * T * R * S, -1)))
+            _accumulate(array_grad_I[:, start:stop, :], out.reshape((C, -1, N)), alpha, beta)
 
-                    array_grad_I[:, d, h, w, :] = beta * array_grad_I[:, d, h, w, :] + alpha * \
-                        np.dot(slicedF.T, slicedE)
         # If this is the forward pass for deconv, compute bsum here
         if bsum is not None:
             bsum[:] = self.sum(grad_I.reshape(K, -1), 1)
@@ -1101,27 +1283,18 @@ class NervanaCPU(Backend):
         C, T, R, S, K = layer.dimF
         K, M, P, Q, N = layer.dimO
 
-        pad_d, pad_h, pad_w = layer.padding
-        str_d, str_h, str_w = layer.strides
-
-        array_I = I.get().reshape(layer.dimI)
-        array_E = E.get().reshape(layer.dimO)
-        array_U = U.get().reshape(layer.dimF)
+        array_I = _zero_pixel_pad(I.get(), C, N)
+        array_E = E.get().reshape((K, -1, N))
+        array_U = U.get().reshape((-1, K))
         array_U.fill(0.)
 
-        for m in range(M):
-            sliceT, sliceD, tlen = layer.mSlice[m]
-
-            for p in range(P):
-                sliceR, sliceH, rlen = layer.pSlice[p]
-
-                for q in range(Q):
-                    sliceS, sliceW, slen = layer.qSlice[q]
-
-                    slicedI = array_I[:, sliceD, sliceH, sliceW, :].reshape((-1, N))
-                    slicedE = array_E[:, m, p, q, :]
-                    array_U[:, sliceT, sliceR, sliceS, :] += alpha * np.dot(
-                        slicedI, slicedE.T).reshape((C, tlen, rlen, slen, K))
+        for start in range(0, M * P * Q, layer.fprop_blk):
+            stop = min(start + layer.fprop_blk, M * P * Q)
+            cols = self._gather_pixels(array_I, layer.fprop_idx[:, start:stop])
+            array_U += np.dot(cols.reshape((C * T * R * S, -1)),
+                              array_E[:, start:stop, :].reshape((K, -1)).T)
+        if alpha != 1.0:
+            array_U *= alpha
 
     def deconv_layer(self, dtype,
                      N, C, K,
@@ -1189,6 +1362,9 @@ class NervanaCPU(Backend):
         """
         Forward propagate pooling layer.
 
+        The channel window sums are taken one tap at a time through the
+        layer's pooling index table.
+
         Arguments:
             layer (PoolLayer): The pool layer object, different backends have
                                different pool layers.
@@ -1202,30 +1378,26 @@ class NervanaCPU(Backend):
         assert layer.sizeI == I.size
         assert layer.sizeO == O.size
 
-        J, T, R, S = layer.JTRS
-        C, D, H, W, N = layer.dimI
-        K, M, P, Q, N = layer.dimO
-        pad_c, pad_d, pad_h, pad_w = layer.padding
-        str_c, str_d, str_h, str_w = layer.strides
+        J = layer.JTRS[0]
+        N = layer.N
 
-        array_I = I.get().reshape(layer.dimI)
-        array_O = O._tensor.reshape(layer.dimO)  # _tensor to write to
+        array_I = I.get().reshape((-1, N))
+        array_O = O._tensor.reshape((-1, N))  # _tensor to write to
         # although we can calculate directly into O, keeping denom around is useful for bprop
-        array_d = denom._tensor.reshape(layer.dimO)  # _tensor to write to
-
-        for k in range(K):
-            sliceC, _ = layer.kSlice[k]
-            _ascale = ascale / J
-            for m in range(M):
-                sliceD, _ = layer.mSlice[m]
-                for p in range(P):
-                    sliceH, _ = layer.pSlice[p]
-                    for q in range(Q):
-                        sliceW, _ = layer.qSlice[q]
-                        sliceI = array_I[sliceC, sliceD, sliceH, sliceW, :].reshape(-1, N)
-                        array_d[k, m, p, q, :] = 1 + _ascale * np.sum(np.square(sliceI), axis=0)
-
-        array_O[:] = array_I * np.power(array_d, -bpower)  # elementwise divide by denominator
+        array_d = denom._tensor.reshape((-1, N))  # _tensor to write to
+
+        def lrn(n0, n1):
+            # squares with an extra zero row read by the padding taps
+            sqr = np.zeros((array_I.shape[0] + 1, n1 - n0), dtype=array_I.dtype)
+            np.square(array_I[:, n0:n1], out=sqr[:-1])
+            window_sum = sqr[layer.pool_idx[0]]
+            for idx in layer.pool_idx[1:]:
+                window_sum += sqr[idx]
+            array_d[:, n0:n1] = 1 + (ascale / J) * window_sum
+            # elementwise divide by denominator
+            array_O[:, n0:n1] = array_I[:, n0:n1] * np.power(array_d[:, n0:n1], -bpower)
+
+        self.parallel_for(N, lrn)
 
     def bprop_lrn(self, layer, I, O, E, delta, denom, alpha=None, beta=None, ascale=1, bpower=1):
         """
@@ -1246,35 +1418,26 @@ class NervanaCPU(Backend):
         assert layer.sizeO == E.size
         assert layer.sizeI == delta.size
 
-        J, T, R, S = layer.JTRS
-        C, D, H, W, N = layer.dimI
-        K, M, P, Q, N = layer.dimO
-        pad_c, pad_d, pad_h, pad_w = layer.padding
-        str_c, str_d, str_h, str_w = layer.strides
-
-        array_I = I.get().reshape(layer.dimI)
-        array_E = E.get().reshape(layer.dimO)
-        array_O = O.get().reshape(layer.dimO)
-        array_delta = delta._tensor.reshape(layer.dimI)  # write to
-        array_denom = denom.get().reshape(layer.dimO)
-
-        for k in range(K):
-            sliceC, _ = layer.kSlice[k]
-            for m in range(M):
-                sliceD, _ = layer.mSlice[m]
-                for p in range(P):
-                    sliceH, _ = layer.pSlice[p]
-                    for q in range(Q):
-                        sliceW, _ = layer.qSlice[q]
-
-                        _O = array_O[sliceC, sliceD, sliceH, sliceW, :].reshape(-1, N)
-                        _E = array_E[sliceC, sliceD, sliceH, sliceW, :].reshape(-1, N)
-                        _den = array_denom[sliceC, sliceD, sliceH, sliceW, :].reshape(-1, N)
-                        # temporarily store part of the derivative in here
-                        array_delta[k, m, p, q, :] = np.sum(_O * _E * _den, axis=0)
-
-        array_delta[:] = -2 * bpower * ascale * array_delta * array_I + (
-            array_E * np.power(array_denom, -bpower))
+        N = layer.N
+
+        array_I = I.get().reshape((-1, N))
+        array_E = E.get().reshape((-1, N))
+        array_O = O.get().reshape((-1, N))
+        array_delta = delta._tensor.reshape((-1, N))  # write to
+        array_denom = denom.get().reshape((-1, N))
+
+        def lrn(n0, n1):
+            cols = slice(n0, n1)
+            prod = np.zeros((array_O.shape[0] + 1, n1 - n0), dtype=array_O.dtype)
+            np.multiply(array_O[:, cols], array_E[:, cols], out=prod[:-1])
+            prod[:-1] *= array_denom[:, cols]
+            window_sum = prod[layer.pool_idx[0]]
+            for idx in layer.pool_idx[1:]:
+                window_sum += prod[idx]
+            array_delta[:, cols] = -2 * bpower * ascale * window_sum * array_I[:, cols] + (
+                array_E[:, cols] * np.power(array_denom[:, cols], -bpower))
+
+        self.parallel_for(N, lrn)
 
     def pool_layer(self, dtype,
                    op, N, C,
@@ -1321,6 +1484,9 @@ class NervanaCPU(Backend):
         """
         Forward propagate pooling layer.
 
+        The pooling windows are gathered in blocks through the layer's
+        precomputed index table and reduced with whole-tensor operations.
+
         Arguments:
             layer (PoolLayer): The pool layer object, different backends have
                                different pool layers.
@@ -1335,45 +1501,48 @@ class NervanaCPU(Backend):
             assert layer.sizeO == argmax.size
         op = layer.op
 
-        J, T, R, S = layer.JTRS
         C, D, H, W, N = layer.dimI
         K, M, P, Q, N = layer.dimO
-        pad_c, pad_d, pad_h, pad_w = layer.padding
-        str_c, str_d, str_h, str_w = layer.strides
 
-        array_I = I.get().reshape(layer.dimI)
-        array_O = O.get().reshape(layer.dimO)
+        # padding taps read the extra pixel, which must never win a max
+        array_I = np.empty((C * D * H * W + 1, N), dtype=I.dtype)
+        array_I[:-1] = I.get().reshape((-1, N))
+        array_I[-1] = -np.inf if op == "max" else 0
+        array_O = O.get().reshape((-1, N))
         if op == "max":
-            array_argmax = argmax.get().reshape(layer.dimO)
-
-        for k in range(K):
-            sliceC, _ = layer.kSlice[k]
-
-            for m in range(M):
-                sliceD, _ = layer.mSlice[m]
-
-                for p in range(P):
-                    sliceH, _ = layer.pSlice[p]
-
-                    for q in range(Q):
-                        sliceW, _ = layer.qSlice[q]
+            array_argmax = argmax.get().reshape((-1, N))
+
+        if op not in ("max", "avg", "l2"):
+            raise NotImplementedError
+
+        def pool(n0, n1):
+            cols = slice(n0, n1)
+            for start in range(0, K * M * P * Q, layer.pool_blk):
+                stop = min(start + layer.pool_blk, K * M * P * Q)
+                windows = array_I[:, cols][layer.pool_idx[:, start:stop]]
+                if op == "max":
+                    tap = np.argmax(windows, axis=0)
+                    slot = layer.pool_slot[:, start:stop]
+                    array_argmax[start:stop, cols] = \
+                        slot[tap, np.arange(stop - start)[:, np.newaxis]]
+                    pooled = np.max(windows, axis=0)
+                elif op == "avg":
+                    pooled = np.sum(windows, axis=0) / \
+                        layer.pool_count[start:stop, np.newaxis].astype(windows.dtype)
+                else:
+                    pooled = np.sqrt(np.sum(np.square(windows), axis=0))
+                _accumulate(array_O[start:stop, cols], pooled, 1.0, beta)
 
-                        sliceI = array_I[sliceC, sliceD, sliceH, sliceW, :].reshape(-1, N)
-                        if op == "max":
-                            array_argmax[k, m, p, q, :] = np.argmax(sliceI, axis=0)
-                            array_O[k, m, p, q, :] = array_O[k, m, p, q, :] * beta + \
-                                np.max(sliceI, axis=0)
-                        elif op == "avg":
-                            array_O[k, m, p, q, :] = array_O[k, m, p, q, :] * beta + \
-                                np.mean(sliceI, axis=0)
-                        elif op == "l2":
-                            array_O[k, m, p, q, :] = array_O[k, m, p, q, :] * beta + \
-                                np.sqrt(np.sum(np.square(sliceI), axis=0))
+        self.parallel_for(N, pool)
 
     def bprop_pool(self, layer, I, O, argmax=None, alpha=1.0, beta=0.0):
         """
         Backward propagate pooling layer.
 
+        The errors are scattered back one window tap at a time; for a fixed
+        tap all windows map to distinct input pixels so each tap is a single
+        indexed add over the whole tensor.
+
         Arguments:
             layer (PoolLayer): The pool layer object. Different backends have
                                different pool layers.
@@ -1390,42 +1559,28 @@ class NervanaCPU(Backend):
             assert layer.sizeO == argmax.size
         op = layer.op
 
-        J, T, R, S = layer.JTRS
         C, D, H, W, N = layer.dimI
-        K, M, P, Q, N = layer.dimO
-        pad_c, pad_d, pad_h, pad_w = layer.padding
-        str_c, str_d, str_h, str_w = layer.strides
 
-        array_E = I.get().reshape(layer.dimO)
-        array_E[:] = array_E * alpha
-        array_delta = O.get().reshape(layer.dimI)
-        array_delta[:] = array_delta * beta
+        array_E = I.get().reshape((-1, N)) * alpha
+        array_delta = O.get().reshape((-1, N))
         if op == "max":
-            array_argmax = argmax.get().reshape(layer.dimO)
-
-        for k in range(K):
-            sliceC, clen = layer.kSlice[k]
-
-            for m in range(M):
-                sliceD, dlen = layer.mSlice[m]
-
-                for p in range(P):
-                    sliceH, hlen = layer.pSlice[p]
-
-                    for q in range(Q):
-                        sliceW, wlen = layer.qSlice[q]
+            array_argmax = argmax.get().reshape((-1, N))
+        elif op == "avg":
+            array_E /= layer.pool_count[:, np.newaxis].astype(array_E.dtype)
+        else:
+            raise NotImplementedError
+
+        def unpool(n0, n1):
+            cols = slice(n0, n1)
+            grad = np.zeros((C * D * H * W + 1, n1 - n0), dtype=array_delta.dtype)
+            for idx, slot in zip(layer.pool_idx, layer.pool_slot):
+                if op == "max":
+                    grad[idx] += array_E[:, cols] * (array_argmax[:, cols] == slot[:, np.newaxis])
+                else:
+                    grad[idx] += array_E[:, cols]
+            _accumulate(array_delta[:, cols], grad[:-1], 1.0, beta)
 
-                        patch_in = (sliceC, sliceD, sliceH, sliceW, slice(None))
-                        patch_out = (k, m, p, q, slice(None))
-                        sliceB = array_delta[patch_in].reshape((-1, N))
-                        if op == "max":
-                            max_n = array_argmax[patch_out]
-                            sliceB[max_n, range(N)] += array_E[patch_out]
-                        elif op == "avg":
-                            sliceB += array_E[patch_out] * (1.0 / sliceB.shape[0])
-                        else:
-                            raise NotImplementedError
-                        array_delta[patch_in] = sliceB.reshape((clen, dlen, hlen, wlen, N))
+        self.parallel_for(N, unpool)
 
     def _roipooling_slice(self, h, stride, H, roi_offset):
         """
@@ -1577,15 +1732,20 @@ class NervanaCPU(Backend):
             eps (float): constant for numerical stability
             rho (float): exponential window averaging constant
         """
-        xvar[:] = self.var(x, axis=1)
-        xsum[:] = xsum / x.shape[1]  # reuse xsum instead of computing xmean
-        xhat = (x - xsum) / self.sqrt(xvar + eps)
+        y = y.reshape(x.shape)
+
+        def bn(c0, c1):
+            _x, _xsum, _xvar = x[c0:c1], xsum[c0:c1], xvar[c0:c1]
+            _xvar[:] = self.var(_x, axis=1)
+            _xsum[:] = _xsum / x.shape[1]  # reuse xsum instead of computing xmean
+            xhat = (_x - _xsum) / self.sqrt(_xvar + eps)
 
-        gmean[:] = gmean * rho + (1.0 - rho) * xsum
-        gvar[:] = gvar * rho + (1.0 - rho) * xvar
+            gmean[c0:c1] = gmean[c0:c1] * rho + (1.0 - rho) * _xsum
+            gvar[c0:c1] = gvar[c0:c1] * rho + (1.0 - rho) * _xvar
 
-        outputs = y.reshape(xhat.shape)
-        outputs[:] = xhat * gamma + beta
+            y[c0:c1] = xhat * gamma[c0:c1] + beta[c0:c1]
+
+        self.parallel_for(x.shape[0], bn)
 
     def compound_bprop_bn(self, delta, grad_gamma, grad_beta, x, xsum, xvar,
                           gamma, eps):
@@ -1603,16 +1763,25 @@ class NervanaCPU(Backend):
             gamma (Tensor): scale parameter
             eps (float): constant for numerical stability
         """
-        xhat = (x - xsum) / self.sqrt(xvar + eps)
-        grad_gamma[:] = self.sum(xhat * delta, axis=1)
-        grad_beta[:] = self.sum(delta, axis=1)
-        xtmp = (xhat * grad_gamma + grad_beta) / float(x.shape[1])
-        delta[:] = gamma * (delta - xtmp) / self.sqrt(xvar + eps)
+        def bn(c0, c1):
+            _delta, _grad_gamma, _grad_beta = delta[c0:c1], grad_gamma[c0:c1], grad_beta[c0:c1]
+            _xvar = xvar[c0:c1]
+            xhat = (x[c0:c1] - xsum[c0:c1]) / self.sqrt(_xvar + eps)
+            _grad_gamma[:] = self.sum(xhat * _delta, axis=1)
+            _grad_beta[:] = self.sum(_delta, axis=1)
+            xtmp = (xhat * _grad_gamma + _grad_beta) / float(x.shape[1])
+            _delta[:] = gamma[c0:c1] * (_delta - xtmp) / self.sqrt(_xvar + eps)
+
+        self.parallel_for(x.shape[0], bn)
 
     def compound_bprop_lut(self, nin, inputs, error, error_t, dW, pad_idx, alpha=1.0, beta=0):
         """
         Backward propagate lookup table layer.
 
+        Only the rows of the word ids present in the inputs are written, and
+        they are recorded in the sparse_rows attribute of dW so optimizers
+        can update just those rows.
+
         Arguments:
             nin (integer): Number of input word_ids.
             inputs (Tensor): Input tensor.
@@ -1624,17 +1793,21 @@ class NervanaCPU(Backend):
             beta (float):
         """
         wrd_ids = inputs.get()[0]
-        unqidx, inv = np.unique(wrd_ids, return_inverse=True)
-        groups = [np.where(inv == i) for i in range(len(unqidx))]
 
-        for (wrd_id, group) in zip(unqidx, groups):
-            if wrd_id != pad_idx:
-                dW[wrd_id, :] = self.sum(error.take(group[0], axis=1), axis=1)
-        """
-        alternative bprop
-        for (j, wrd_id) in enumerate(wrd_ids):
-            dW[:, wrd_id] = dW[:, wrd_id] + error[:, j]
-        """
+        # sorted segment sums of the error columns of each word id
+        order = np.argsort(wrd_ids, kind='mergesort')
+        sorted_ids = wrd_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        unqidx = sorted_ids[starts]
+        sums = np.add.reduceat(error.get().T.take(order, axis=0), starts, axis=0)
+
+        if pad_idx is not None:
+            keep = unqidx != pad_idx
+            unqidx, sums = unqidx[keep], sums[keep]
+
+        dW.get()[unqidx] = sums
+        # every other row of dW is left at zero, see LookupTable.bprop
+        dW.sparse_rows = unqidx.astype(np.intp)
 
     def _hist_tensor(self, tag):
         """
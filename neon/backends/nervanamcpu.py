@@ -0,0 +1,248 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Synchronous data parallel training on several CPU processes of one host.
+"""
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+from neon.backends.nervanacpu import NervanaCPU
+
+logger = logging.getLogger(__name__)
+
+
+class _Barrier(object):
+
+    """
+    Reusable barrier of a fixed number of processes, made of two turnstiles.
+    Created before the processes are forked.
+
+    Arguments:
+        nprocs (int): number of processes meeting at the barrier
+    """
+
+    def __init__(self, nprocs):
+        self.nprocs = nprocs
+        self.count = multiprocessing.Value('i', 0)
+        self.aborted = multiprocessing.Value('i', 0)
+        self.turnstiles = (multiprocessing.Semaphore(0), multiprocessing.Semaphore(0))
+
+    def abort(self):
+        """
+        Make the processes waiting at the barrier raise, for a process that
+        will not reach it.
+        """
+        self.aborted.value = 1
+
+    def _pass(self, step, last, turnstile):
+        with self.count.get_lock():
+            self.count.value += step
+            if self.count.value == last:
+                for i in range(self.nprocs):
+                    turnstile.release()
+        while not turnstile.acquire(True, 1.0):
+            if self.aborted.value:
+                raise RuntimeError("A process of the mcpu backend has stopped")
+
+    def wait(self):
+        self._pass(1, self.nprocs, self.turnstiles[0])
+        self._pass(-1, 0, self.turnstiles[1])
+
+
+class NervanaMCPU(NervanaCPU):
+
+    """
+    Data parallel version of the numpy backend.  The process creating the
+    backend forks num_procs - 1 copies of itself, and every process runs the
+    rest of the program on its own share of the training data: the batch size
+    of each process is that of the minibatch divided by num_procs, Model.fit
+    restricts the training set to the examples of the process (see
+    data_shard, ArrayIterator supports it, other iterators raise), and the
+    gradients are averaged over the processes before every optimizer step
+    (see allreduce), so all processes hold the same parameters.
+
+    The process with rank 0 is the one that created the backend, it keeps its
+    output and is the only one to write model and callback files.  The others
+    discard their standard output and informational logging.  As every
+    process runs the rest of the program, the backend is generated once.
+
+    Every process starts from the same weights, a seed is drawn before the
+    fork when rng_seed is None.  Batch norm statistics and dropout masks are
+    those of the share of the data of each process.  Evaluation and inference
+    sets are not split, every process goes through all of their examples.
+
+    Arguments:
+        num_procs (int): number of processes, one per core or socket
+        rng_seed, default_dtype, compat_mode, num_threads: see NervanaCPU,
+            num_threads applies to every process
+
+    Attributes:
+        rank (int): index of this process, 0 to num_procs - 1
+        num_procs (int): number of processes
+    """
+
+    def __init__(self,
+                 num_procs=2,
+                 rng_seed=None,
+                 default_dtype=np.float32,
+                 compat_mode=None,
+                 num_threads=None):
+        num_procs = int(num_procs)
+        if num_procs < 1:
+            raise ValueError("num_procs must be at least 1")
+
+        # shared state, set up before the fork (and before the worker threads
+        # of NervanaCPU, which would not survive it)
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self.shm_dir = tempfile.mkdtemp(prefix='neon_mcpu_', dir=shm)
+        self.barrier = _Barrier(num_procs)
+
+        # the processes seed their generators alike, so they initialize the
+        # parameters the same way
+        if rng_seed is None:
+            rng_seed = np.random.RandomState().randint(2**31)
+
+        rank = 0
+        self.children = []
+        for r in range(1, num_procs):
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                rank = r
+                self.children = []
+                break
+            self.children.append(pid)
+
+        if rank != 0:
+            sys.stdout = open(os.devnull, 'w')
+            logging.disable(logging.INFO)
+
+        super(NervanaMCPU, self).__init__(rng_seed=rng_seed, default_dtype=default_dtype,
+                                          compat_mode=compat_mode, num_threads=num_threads)
+        self.rank = rank
+        self.num_procs = num_procs
+
+        # reduction buffer: a header with the size each process reduces, the
+        # result, then one slot per process
+        self.reduce_size = 0
+        self.reduce_header = None
+        self.reduce_buf = None
+        self.reduce_file = os.path.join(self.shm_dir, 'allreduce')
+
+        logger.info("Initialized NervanaMCPU with %d processes", num_procs)
+
+    def cleanup(self):
+        """
+        Shut down the worker threads, wait for the other processes and remove
+        the shared memory.
+        """
+        super(NervanaMCPU, self).cleanup()
+        self.barrier.abort()
+        self.reduce_header = None
+        self.reduce_buf = None
+        if self.rank == 0:
+            for pid in self.children:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+            self.children = []
+            shutil.rmtree(self.shm_dir, ignore_errors=True)
+
+    def data_shard(self, ndata):
+        """
+        Examples rank, rank + num_procs, rank + 2 * num_procs, ... of the
+        dataset, so that the minibatches of the processes together hold the
+        examples of the minibatch of a single process run.  The examples left
+        over by the division by num_procs are dropped.
+        """
+        return slice(self.rank, ndata - ndata % self.num_procs, self.num_procs)
+
+    def _reduce_buffer(self, size):
+        """
+        View of the shared buffer holding (num_procs + 1) * size elements,
+        after the header of num_procs sizes.  The buffer only grows, and by the
+        same steps in every process as they reduce the same tensors.  The
+        mapping lives as long as the arrays viewing it.
+        """
+        if size > self.reduce_size:
+            header_bytes = self.num_procs * np.dtype(np.int64).itemsize
+            nbytes = header_bytes + (self.num_procs + 1) * size * \
+                np.dtype(self.default_dtype).itemsize
+            fd = os.open(self.reduce_file, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < nbytes:
+                    os.ftruncate(fd, nbytes)
+                shared = mmap.mmap(fd, nbytes)
+            finally:
+                os.close(fd)
+            self.reduce_header = np.frombuffer(shared, dtype=np.int64, count=self.num_procs)
+            self.reduce_buf = np.frombuffer(shared, dtype=self.default_dtype,
+                                            offset=header_bytes)
+            self.reduce_size = size
+        return self.reduce_buf[:(self.num_procs + 1) * self.reduce_size]
+
+    def allreduce(self, tensors):
+        """
+        Replace the tensors by their average over the processes.  Each process
+        copies its tensors to its slot of the shared buffer and sums a piece
+        of the slots, between two barriers.  Raises RuntimeError in every
+        process when the processes do not reduce tensors of the same sizes.
+
+        Row sparse gradients (see Optimizer.sparse_rows) become dense, as the
+        processes wrote different rows.
+
+        Arguments:
+            tensors (list): tensors of the same shapes in every process
+        """
+        if self.num_procs == 1 or len(tensors) == 0:
+            return
+        total = sum(t.size for t in tensors)
+        buf = self._reduce_buffer(total)
+        cap = self.reduce_size
+
+        # the result comes first, so a later call writing its slot never
+        # overlaps a result another process is still reading
+        slot = buf[(self.rank + 1) * cap:(self.rank + 1) * cap + total]
+        offset = 0
+        for t in tensors:
+            slot[offset:offset + t.size] = t._tensor.reshape(-1)
+            offset += t.size
+        self.reduce_header[self.rank] = total
+        self.barrier.wait()
+
+        if np.any(self.reduce_header != total):
+            raise RuntimeError("The processes of the mcpu backend reduce different tensors, "
+                               "of sizes %s" % list(self.reduce_header))
+        start = total * self.rank // self.num_procs
+        end = total * (self.rank + 1) // self.num_procs
+        slots = buf[cap:].reshape((self.num_procs, cap))
+        np.sum(slots[:, start:end], axis=0, out=buf[start:end])
+        buf[start:end] *= 1.0 / self.num_procs
+        self.barrier.wait()
+
+        offset = 0
+        for t in tensors:
+            t._tensor[...] = buf[offset:offset + t.size].reshape(t.shape)
+            offset += t.size
+            if getattr(t, 'sparse_rows', None) is not None:
+                t.sparse_rows = None
@@ -0,0 +1,292 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Op-tree compiler for the CPU backend.
+
+An op-tree is lowered once per intrinsic key into a flat plan of numpy calls
+that write into preallocated scratch buffers (and, for the last operation,
+straight into the assignment target) using ufunc ``out=`` arguments.  Plans
+are cached, so steady state execution does not allocate for elementwise
+op-trees.  Purely elementwise plans over large tensors can also be run in row
+blocks to keep the working set in cache, and those blocks can be spread over
+worker threads.
+"""
+import threading
+
+import numpy as np
+
+
+def _safelog(x, out):
+    np.maximum(x, np.exp(-50.), out)
+    return np.log(out, out)
+
+
+def _sig(x, out):
+    np.negative(x, out)
+    np.exp(out, out)
+    np.add(out, 1., out)
+    return np.reciprocal(out, out)
+
+
+def _sig2(x, out):
+    np.negative(x, out)
+    np.exp2(out, out)
+    np.add(out, 1., out)
+    return np.reciprocal(out, out)
+
+
+# elementwise ops that can write into a given output buffer
+ew_out_funcs = {
+    # unary ops
+    "neg": np.negative,
+    "abs": np.abs,
+    "sgn": np.sign,
+    "sqrt": np.sqrt,
+    "sqr": np.square,
+    "exp": np.exp,
+    "log": np.log,
+    "safelog": _safelog,
+    "exp2": np.exp2,
+    "log2": np.log2,
+    "sig": _sig,
+    "sig2": _sig2,
+    "tanh": np.tanh,
+    # binary ops
+    "add": np.add,
+    "sub": np.subtract,
+    "mul": np.multiply,
+    "div": np.true_divide,
+    "eq": np.equal,
+    "ne": np.not_equal,
+    "lt": np.less,
+    "le": np.less_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+    "pow": np.power,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+}
+
+unary_arity = {"neg", "abs", "sgn", "sqrt", "sqr", "exp", "log", "safelog",
+               "exp2", "log2", "sig", "sig2", "tanh", "tanh2", "transpose",
+               "finite"}
+reduction_ops = {"sum", "max", "min", "argmax", "argmin"}
+
+
+class _Const(object):
+    """
+    Placeholder standing in for a numeric constant in an op-tree key, so that
+    e.g. a changing learning rate does not create a new plan every step.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __eq__(self, other):
+        return isinstance(other, _Const) and other.kind is self.kind
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.kind)
+
+
+def split_key(optree):
+    """
+    Build the plan cache key of an op-tree from its intrinsic key.
+
+    Returns:
+        (key, arrays, consts): the key has numeric constants replaced by
+        placeholders and is extended with the tensor dtypes, arrays are the
+        tensors' host arrays in intrinsic index order (the assignment target
+        first) and consts are the numeric constants in post order.
+    """
+    stack, _, index_tensor_map = optree.intrinsic_key_maps()
+    consts = []
+    key = []
+    for s in stack:
+        if isinstance(s, (int, long, float, np.number)) and not isinstance(s, bool):
+            consts.append(s)
+            key.append(_Const(type(s)))
+        else:
+            key.append(s)
+    arrays = [index_tensor_map[i]._tensor for i in range(len(index_tensor_map))]
+    key.append(tuple((a.shape, a.dtype) for a in arrays))
+    return tuple(key), arrays, consts
+
+
+class OpTreePlan(object):
+    """
+    Compiled form of one op-tree structure.
+
+    Registers hold, in order, the tensor operands, the numeric constants and
+    the intermediate values.  Each instruction is a (function, argument
+    registers, output register, in_place) tuple.  In-place functions receive
+    the scratch buffer backing their output register as last argument, other
+    (reduction, dot, transpose) functions return a newly allocated result.
+    Scratch buffers are shared between values whose lifetimes do not overlap.
+
+    Arguments:
+        key (tuple): key returned by split_key
+        arrays (list): host arrays of the tensors the plan is compiled for
+        consts (list): numeric constants of the op-tree
+        call_dict (dict): numpy implementations of every op
+    """
+    def __init__(self, key, arrays, consts, call_dict):
+        self.num_arrays = len(arrays)
+        self.first_value = len(arrays) + len(consts)
+        self.instructions = []
+        self.buffer_specs = []
+        self.storage = {}
+        self.buffers = {}
+        self.elementwise = True
+
+        samples = [np.zeros(a.shape, a.dtype) for a in arrays] + list(consts)
+        free_buffers = []
+        compute_stack = []
+        const_reg = len(arrays)
+
+        for s in key[:-1]:
+            if isinstance(s, _Const):
+                compute_stack.append(const_reg)
+                const_reg += 1
+                continue
+            if isinstance(s, tuple) and not isinstance(s[0], str):
+                compute_stack.append(s[0])
+                continue
+
+            op = s if isinstance(s, str) else s[0]
+            if op == "assign":
+                self.result = compute_stack.pop()
+                break
+            if op not in call_dict:
+                raise NotImplementedError("%s is not supported by the CPU backend" % op)
+
+            if op in unary_arity or op in reduction_ops:
+                args = [compute_stack.pop()]
+            else:
+                right = compute_stack.pop()
+                args = [compute_stack.pop(), right]
+
+            # the operands die here, so their buffers can hold the result,
+            # except under a transpose which returns a view of its operand
+            if op != "transpose":
+                for a in args:
+                    if a in self.storage:
+                        free_buffers.append(self.storage[a])
+
+            reg = len(samples)
+            with np.errstate(all='ignore'):
+                if op in ew_out_funcs:
+                    value = call_dict[op](*[samples[a] for a in args])
+                    spec = (np.shape(value), value.dtype)
+                    for buf in free_buffers:
+                        if self.buffer_specs[buf] == spec:
+                            free_buffers.remove(buf)
+                            break
+                    else:
+                        buf = len(self.buffer_specs)
+                        self.buffer_specs.append(spec)
+                    self.storage[reg] = buf
+                    self.instructions.append((ew_out_funcs[op], args, reg, True))
+                else:
+                    func = call_dict[op]
+                    if op in reduction_ops:
+                        func = _reduction(func, s[1])
+                    value = func(*[samples[a] for a in args])
+                    self.elementwise = False
+                    self.instructions.append((func, args, reg, False))
+            samples.append(value)
+            compute_stack.append(reg)
+
+        # the last instruction can write straight into the assignment target
+        target = arrays[0]
+        self.direct = (len(self.instructions) > 0 and self.instructions[-1][3] and
+                       "transpose" not in key and
+                       self.instructions[-1][2] == self.result and
+                       self.buffer_specs[self.storage[self.result]] ==
+                       (target.shape, target.dtype))
+        self.chunkable = (self.direct and self.elementwise and target.ndim == 2 and
+                          all(a.ndim == 2 and a.shape[0] in (1, target.shape[0])
+                              for a in arrays))
+        self.num_regs = len(samples)
+
+    def __call__(self, arrays, consts, chunk_size=0, parallel_for=None):
+        """
+        Execute the plan.
+
+        Arguments:
+            arrays (list): host arrays of the tensors, the target first
+            consts (list): numeric constants
+            chunk_size (int): if non zero, purely elementwise plans with
+                              targets larger than this many elements are run
+                              over blocks of rows of about this size
+            parallel_for (function): if given, used as
+                                     parallel_for(num_blocks, func) to spread
+                                     the row blocks over worker threads
+        """
+        target = arrays[0]
+        direct = self.direct and not any(a is not target and np.may_share_memory(a, target)
+                                         for a in arrays[1:])
+        if direct and self.chunkable and chunk_size and target.size > chunk_size:
+            rows = target.shape[0]
+            step = max(1, chunk_size // target.shape[1])
+            starts = range(0, rows, step)
+
+            def run_blocks(first, last):
+                for start in starts[first:last]:
+                    stop = min(start + step, rows)
+                    self._run([a[start:stop] if a.shape[0] == rows else a for a in arrays],
+                              consts, direct, (rows, stop - start))
+
+            if parallel_for is None:
+                run_blocks(0, len(starts))
+            else:
+                parallel_for(len(starts), run_blocks)
+        else:
+            regs = self._run(arrays, consts, direct)
+            if not direct:
+                target[...] = regs[self.result]
+
+    def _buffer(self, buf, block=None):
+        """
+        Scratch buffer buf, cut down to block = (rows, block_rows) when the
+        plan runs over row blocks.  Each thread gets its own buffers.
+        """
+        shape, dtype = self.buffer_specs[buf]
+        if block is not None and len(shape) == 2 and shape[0] == block[0]:
+            shape = (block[1], shape[1])
+        key = (buf, shape, threading.current_thread().ident)
+        ary = self.buffers.get(key)
+        if ary is None:
+            ary = self.buffers[key] = np.empty(shape, dtype)
+        return ary
+
+    def _run(self, arrays, consts, direct, block=None):
+        regs = list(arrays) + list(consts) + [None] * (self.num_regs - self.first_value)
+        for func, args, out, in_place in self.instructions:
+            if not in_place:
+                regs[out] = func(*[regs[a] for a in args])
+            elif out == self.result and direct:
+                regs[out] = func(*([regs[a] for a in args] + [arrays[0]]))
+            else:
+                regs[out] = func(*([regs[a] for a in args] +
+                                   [self._buffer(self.storage[out], block)]))
+        return regs
+
+
+def _reduction(func, axis):
+    op_dict = {'axis': axis}
+    return lambda left: func(op_dict, left)
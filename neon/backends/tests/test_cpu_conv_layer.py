@@ -0,0 +1,143 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+# pylint: skip-file
+
+"""
+To test the NervanaCPU im2col convolution kernels against a direct numpy
+implementation, including padding, strides and blocked GEMMs.
+"""
+import itertools as itt
+import numpy as np
+from operator import mul
+
+from neon.backends import layer_cpu
+from neon.backends.nervanacpu import NervanaCPU
+
+
+def slicable(dim, pad=0):
+    dim0 = reduce(mul, dim[:-1], 1) + pad
+    return (dim0, dim[-1])
+
+
+def pixel_indices(conv, mt, pr, qs):
+
+    T, R, S = conv.TRS
+    D, H, W = conv.DHW
+    C = conv.C
+    HW = H * W
+    DHW = D * H * W
+    imax = C * DHW
+
+    idx = []
+    for c in range(C):
+        ci = c * DHW
+
+        for t in range(T):
+            z = mt + t
+            zi = ci + z * HW
+            zb = z >= 0 and z < D
+
+            for r in range(R):
+                y = pr + r
+                yi = zi + y * W
+                yb = zb and y >= 0 and y < H
+
+                for s in range(S):
+                    x = qs + s
+                    if yb and x >= 0 and x < W:
+                        xi = yi + x
+                    else:
+                        xi = imax  # out of bounds
+
+                    idx.append(xi)
+    return idx
+
+
+def reference_conv(conv, cpuI, cpuF, cpuE):
+
+    dimO = conv.dimO
+    M, P, Q = conv.MPQ
+    pad_d, pad_h, pad_w = conv.padding
+    str_d, str_h, str_w = conv.strides
+
+    cpuO = np.zeros(dimO, dtype=np.float32)
+    cpuB = np.zeros(cpuI.shape, dtype=np.float32)
+    cpuU = np.zeros(cpuF.shape, dtype=np.float32)
+
+    for m in range(M):
+        mt = m * str_d - pad_d
+        for p in range(P):
+            pr = p * str_h - pad_h
+            for q in range(Q):
+                qs = q * str_w - pad_w
+                idx = pixel_indices(conv, mt, pr, qs)
+                cpuO[:, m, p, q, :] = np.dot(cpuF.T, cpuI[idx, :])
+                np.add.at(cpuB, idx, np.dot(cpuF, cpuE[:, m, p, q, :]))
+                cpuU += np.dot(cpuI[idx, :], cpuE[:, m, p, q, :].T)
+
+    return cpuO, cpuB[:-1, :], cpuU
+
+
+def pytest_generate_tests(metafunc):
+
+    N_C_K = [(8, 3, 4), (16, 5, 8)]
+    D_H_W_T_R_S = [(1, 7, 7, 1, 3, 3), (3, 5, 6, 2, 3, 2)]
+    pad_str = [(0, 1), (1, 1), (1, 2), (2, 3)]
+    max_size = [layer_cpu.IM2COL_MAX_SIZE, 256]
+
+    if 'fargs_tests' in metafunc.fixturenames:
+        fargs = itt.product(N_C_K, D_H_W_T_R_S, pad_str, max_size)
+        metafunc.parametrize("fargs_tests", fargs)
+
+
+def test_cpu_conv_layer(fargs_tests, monkeypatch):
+
+    (N, C, K), (D, H, W, T, R, S), (pad, strides), max_size = fargs_tests
+    pad_d = min(pad, T - 1)
+    str_d = min(strides, T) if T > 1 else 1
+
+    monkeypatch.setattr(layer_cpu, 'IM2COL_MAX_SIZE', max_size)
+
+    nc = NervanaCPU()
+    conv = nc.conv_layer(np.float32, N, C, K, D, H, W, T, R, S,
+                         pad_d, pad, pad, str_d, strides, strides)
+
+    cpuI = np.random.uniform(-0.8, 0.8, slicable(conv.dimI, 1)).astype(np.float32)
+    cpuF = np.random.uniform(0.0, 0.3, slicable(conv.dimF)).astype(np.float32)
+    cpuE = np.random.uniform(-0.2, 0.2, conv.dimO).astype(np.float32)
+    cpuI[-1, :] = 0.0
+
+    beI = nc.array(cpuI[:-1, :].reshape(conv.dimI))
+    beF = nc.array(cpuF.reshape(conv.dimF))
+    beE = nc.array(cpuE)
+
+    beO = nc.zeros(conv.dimO)
+    nc.fprop_conv(conv, beI, beF, beO)
+    beB = nc.zeros(conv.dimI)
+    nc.bprop_conv(conv, beF, beE, beB)
+    beU = nc.zeros(conv.dimF)
+    nc.update_conv(conv, beI, beE, beU)
+
+    cpuO, cpuB, cpuU = reference_conv(conv, cpuI, cpuF, cpuE)
+
+    assert np.allclose(beO.get(), cpuO, rtol=0, atol=1e-5)
+    assert np.allclose(beB.get().reshape(cpuB.shape), cpuB, rtol=0, atol=1e-5)
+    assert np.allclose(beU.get().reshape(cpuU.shape), cpuU, rtol=0, atol=1e-5)
+
+    # accumulate into the existing outputs
+    nc.fprop_conv(conv, beI, beF, beO, alpha=2.0, beta=1.0)
+    assert np.allclose(beO.get(), 3 * cpuO, rtol=0, atol=1e-5)
+    nc.bprop_conv(conv, beF, beE, beB, alpha=0.5, beta=1.0)
+    assert np.allclose(beB.get().reshape(cpuB.shape), 1.5 * cpuB, rtol=0, atol=1e-5)
@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+# pylint: skip-file
+
+"""
+Test the compiled op-tree plans of the CPU backend against numpy.
+"""
+import numpy as np
+
+from neon.backends.nervanacpu import NervanaCPU
+
+
+def make_tensors(be, shape, count):
+    arys = [np.random.uniform(0.5, 1.5, shape).astype(np.float32) for i in range(count)]
+    return arys, [be.array(a) for a in arys]
+
+
+def test_gdm_update_plan():
+    be = NervanaCPU()
+    be.ew_chunk_size = 0
+    (v, g, p), (vel, grad, param) = make_tensors(be, (64, 32), 3)
+
+    for lr in (0.1, 0.01):
+        vel[:] = vel * 0.9 - lr * (0.5 * grad + 0.0005 * param)
+        param[:] = param + vel
+        v = v * 0.9 - lr * (0.5 * g + 0.0005 * p)
+        p = p + v
+        assert np.allclose(vel.get(), v, rtol=0, atol=1e-6)
+        assert np.allclose(param.get(), p, rtol=0, atol=1e-6)
+
+    # the changing learning rate reuses the same two plans
+    assert len(be.optree_plans) == 2
+    for plan in be.optree_plans.values():
+        assert plan.direct
+
+
+def test_chunked_broadcast():
+    be = NervanaCPU()
+    be.ew_chunk_size = 100
+    (x, y), (bx, by) = make_tensors(be, (50, 16), 2)
+    b = np.random.uniform(size=(50, 1)).astype(np.float32)
+    r = np.random.uniform(size=(1, 16)).astype(np.float32)
+    bb, br = be.array(b), be.array(r)
+    out = be.empty((50, 16))
+
+    out[:] = be.sig(bx * by + bb) - be.sqrt(by) / br + be.safelog(bx)
+    ref = 1. / (1. + np.exp(-(x * y + b))) - np.sqrt(y) / r + np.log(x)
+    assert np.allclose(out.get(), ref, rtol=0, atol=1e-5)
+
+    # target used as an operand
+    bx[:] = bx * bx + bx
+    assert np.allclose(bx.get(), x * x + x, rtol=0, atol=1e-5)
+
+
+def test_aliased_target():
+    be = NervanaCPU()
+    (x,), (bx,) = make_tensors(be, (8, 8), 1)
+    bx[1:] = bx[:-1] * 2 + 1
+    x[1:] = x[:-1] * 2 + 1
+    assert np.allclose(bx.get(), x, rtol=0, atol=1e-6)
+
+    bx[:] = bx.T + bx
+    x[:] = x.T + x
+    assert np.allclose(bx.get(), x, rtol=0, atol=1e-6)
+
+
+def test_reduction_mix():
+    be = NervanaCPU()
+    (x, y), (bx, by) = make_tensors(be, (10, 6), 2)
+    out = be.empty((10, 6))
+    out[:] = bx - be.max(bx, axis=1) + be.sum(by * by, axis=0) * 2
+    ref = x - x.max(axis=1, keepdims=True) + (y * y).sum(axis=0, keepdims=True) * 2
+    assert np.allclose(out.get(), ref, rtol=0, atol=1e-5)
+
+    cmp = be.empty((10, 6))
+    cmp[:] = bx > by
+    assert np.array_equal(cmp.get(), (x > y).astype(np.float32))
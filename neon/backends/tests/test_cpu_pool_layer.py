@@ -0,0 +1,155 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+# pylint: skip-file
+
+"""
+To test the vectorized NervanaCPU pooling kernels against numpy, including
+channel pooling, padding and overlapping windows.
+"""
+import itertools as itt
+import numpy as np
+from operator import mul
+
+from neon.backends import layer_cpu
+from neon.backends.nervanacpu import NervanaCPU
+
+
+def sliceable(dim, pad=0):
+    dim0 = reduce(mul, dim[:-1], 1) + pad
+    return (dim0, dim[-1])
+
+
+def pixel_indices(pool, kj, mt, pr, qs):
+
+    C = pool.C
+    J, T, R, S = pool.JTRS
+    D, H, W = pool.DHW
+    HW = H * W
+    DHW = D * H * W
+    idx = []
+
+    for j in range(J):
+        c = kj + j
+        ci = c * DHW
+        cb = c >= 0 and c < C
+
+        for t in range(T):
+            z = mt + t
+            zi = ci + z * HW
+            zb = cb and z >= 0 and z < D
+
+            for r in range(R):
+                y = pr + r
+                yi = zi + y * W
+                yb = zb and y >= 0 and y < H
+
+                for s in range(S):
+                    x = qs + s
+                    if yb and x >= 0 and x < W:
+                        xi = yi + x
+                        idx.append(xi)
+    return idx
+
+
+def run_numpy_pool(cpuI, cpuE, be_layer):
+
+    op = be_layer.op
+    K = be_layer.K
+    N = be_layer.N
+    M, P, Q = be_layer.MPQ
+    pad_j, pad_d, pad_h, pad_w = be_layer.padding
+    str_j, str_d, str_h, str_w = be_layer.strides
+
+    cpuO = np.empty(be_layer.dimO, dtype=np.float32)
+    cpuA = np.empty(be_layer.dimO, dtype=np.uint8)
+    cpuB = np.zeros(cpuI.shape, dtype=np.float32)
+
+    for k in range(K):
+        kj = k * str_j - pad_j
+        for m in range(M):
+            mt = m * str_d - pad_d
+            for p in range(P):
+                pr = p * str_h - pad_h
+                for q in range(Q):
+                    qs = q * str_w - pad_w
+
+                    idx = pixel_indices(be_layer, kj, mt, pr, qs)
+
+                    if op == "max":
+                        cpuO[k, m, p, q, :] = np.max(cpuI[idx, :], axis=0)
+                        b_idx = np.argmax(cpuI[idx, :], axis=0)
+                        cpuA[k, m, p, q, :] = b_idx
+                        for n in range(N):
+                            cpuB[idx[b_idx[n]], n] += cpuE[k, m, p, q, n]
+                    elif op == "avg":
+                        cpuO[k, m, p, q, :] = np.mean(cpuI[idx, :], axis=0)
+                        cpuB[idx, :] += cpuE[k, m, p, q, :] * (1.0 / len(idx))
+                    elif op == "l2":
+                        cpuO[k, m, p, q, :] = np.sqrt(np.sum(cpuI[idx, :] ** 2, axis=0))
+
+    return cpuO, cpuA, cpuB
+
+
+def pytest_generate_tests(metafunc):
+    if 'poolargs' in metafunc.fixturenames:
+        op_list = ["avg", "max", "l2"]
+        # (C, H, W), (J, R, S), (pad_c, pad_h, pad_w), (str_c, str_h, str_w)
+        geometry = [((8, 9, 9), (1, 3, 3), (0, 0, 0), (1, 2, 2)),
+                    ((8, 9, 9), (1, 3, 3), (0, 1, 1), (1, 2, 2)),
+                    ((8, 8, 8), (2, 2, 2), (0, 0, 0), (2, 2, 2)),
+                    ((9, 6, 7), (3, 3, 2), (1, 1, 0), (2, 1, 1))]
+        max_size = [layer_cpu.IM2COL_MAX_SIZE, 128]
+        fargs = itt.product(op_list, geometry, max_size)
+        metafunc.parametrize('poolargs', fargs)
+
+
+def test_cpu_pool_layer(poolargs, monkeypatch):
+
+    op, ((C, H, W), (J, R, S), pad, strides), max_size = poolargs
+    N = 16
+
+    monkeypatch.setattr(layer_cpu, 'IM2COL_MAX_SIZE', max_size)
+
+    nc = NervanaCPU()
+    pool = nc.pool_layer(np.float32, op, N, C, 1, H, W, J, 1, R, S,
+                         pad[0], 0, pad[1], pad[2],
+                         strides[0], 1, strides[1], strides[2])
+
+    cpuI = np.random.uniform(-1.0, 1.0, sliceable(pool.dimI)).astype(np.float32)
+    cpuE = np.random.uniform(-0.2, 0.2, pool.dimO).astype(np.float32)
+
+    beI = nc.array(cpuI.reshape(pool.dimI))
+    beE = nc.array(cpuE)
+    beO = nc.zeros(pool.dimO)
+    beA = nc.zeros(pool.dimO, dtype=np.uint8)
+    beB = nc.zeros(pool.dimI)
+
+    cpuO, cpuA, cpuB = run_numpy_pool(cpuI, cpuE, pool)
+
+    nc.fprop_pool(pool, beI, beO, beA)
+    assert np.allclose(beO.get(), cpuO, rtol=0, atol=1e-5)
+
+    if op == "l2":
+        return
+
+    nc.bprop_pool(pool, beE, beB, beA)
+    assert np.allclose(beB.get().reshape(cpuB.shape), cpuB, rtol=0, atol=1e-5)
+    if op == "max":
+        assert np.array_equal(beA.get(), cpuA)
+
+    # accumulation into existing outputs leaves the errors untouched
+    nc.bprop_pool(pool, beE, beB, beA, alpha=2.0, beta=1.0)
+    assert np.allclose(beB.get().reshape(cpuB.shape), 3 * cpuB, rtol=0, atol=1e-5)
+    assert np.array_equal(beE.get(), cpuE)
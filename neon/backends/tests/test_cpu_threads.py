@@ -0,0 +1,119 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+# pylint: skip-file
+
+"""
+To test that the multi-threaded NervanaCPU kernels match the single threaded
+ones.
+"""
+import numpy as np
+
+from neon.backends.nervanacpu import NervanaCPU
+
+
+def pytest_generate_tests(metafunc):
+
+    if 'num_threads' in metafunc.fixturenames:
+        metafunc.parametrize("num_threads", [2, 3])
+
+
+def run_kernels(be, inputs):
+    cpuI, cpuF, cpuE, cpuX, cpuA, cpuB = inputs
+    N, C, K = 8, 6, 4
+    results = []
+
+    conv = be.conv_layer(np.float32, N, C, K, 1, 7, 7, 1, 3, 3, 0, 1, 1, 1, 1, 1)
+    beI = be.array(cpuI)
+    beO = be.zeros(conv.dimO)
+    be.fprop_conv(conv, beI, be.array(cpuF), beO)
+    beB = be.zeros(conv.dimI)
+    be.bprop_conv(conv, be.array(cpuF), be.array(cpuE), beB)
+    beU = be.zeros(conv.dimF)
+    be.update_conv(conv, beI, be.array(cpuE), beU)
+    results += [beO.get(), beB.get(), beU.get()]
+
+    pool = be.pool_layer(np.float32, "max", N, C, 1, 7, 7, 1, 1, 3, 3, 0, 0, 1, 1, 1, 1, 2, 2)
+    beP = be.zeros(pool.dimO)
+    argmax = be.zeros(pool.dimO, dtype=np.uint8)
+    be.fprop_pool(pool, beI, beP, argmax)
+    beD = be.zeros(pool.dimI)
+    be.bprop_pool(pool, beP, beD, argmax)
+    results += [beP.get(), argmax.get(), beD.get()]
+
+    lrn = be.lrn_layer(np.float32, N, C, 1, 7, 7, 3)
+    beL = be.zeros(lrn.dimO)
+    denom = be.zeros(lrn.dimO)
+    be.fprop_lrn(lrn, beI, beL, denom, 1.0, 1.0, 0.5, 0.75)
+    beLD = be.zeros(lrn.dimI)
+    be.bprop_lrn(lrn, beI, beL, be.array(cpuI), beLD, denom, 1.0, 1.0, 0.5, 0.75)
+    results += [beL.get(), denom.get(), beLD.get()]
+
+    beX = be.array(cpuX)
+    xsum = be.array(cpuX.sum(axis=1, keepdims=True))
+    xvar, gmean, gvar = be.zeros((C, 1)), be.zeros((C, 1)), be.ones((C, 1))
+    gamma, beta = be.ones((C, 1)), be.zeros((C, 1))
+    beY = be.zeros(cpuX.shape)
+    be.compound_fprop_bn(beX, xsum, xvar, gmean, gvar, gamma, beta, beY, 1e-3, 0.9)
+    delta = be.array(cpuX[::-1].copy())
+    grad_gamma, grad_beta = be.zeros((C, 1)), be.zeros((C, 1))
+    be.compound_bprop_bn(delta, grad_gamma, grad_beta, beX, xsum, xvar, gamma, 1e-3)
+    results += [beY.get(), xvar.get(), gmean.get(), delta.get(), grad_gamma.get()]
+
+    beA, beBias = be.array(cpuA), be.array(cpuB)
+    out = be.empty(cpuA.shape)
+    out[:] = be.sig(beA * 2.0 + beBias) - be.sqrt(be.absolute(beA))
+    results += [out.get()]
+    return results
+
+
+def test_cpu_threads(num_threads):
+
+    N, C, K = 8, 6, 4
+    inputs = [np.random.uniform(-1, 1, (C * 49, N)),
+              np.random.uniform(-1, 1, (C * 9, K)),
+              np.random.uniform(-1, 1, (K * 49, N)),
+              np.random.uniform(-1, 1, (C, 40)),
+              np.random.uniform(-1, 1, (600, 300)),
+              np.random.uniform(-1, 1, (1, 300))]
+    inputs = [x.astype(np.float32) for x in inputs]
+
+    single = NervanaCPU()
+    threaded = NervanaCPU(num_threads=num_threads)
+    threaded.ew_chunk_size = 1 << 12
+    try:
+        expected = run_kernels(single, inputs)
+        results = run_kernels(threaded, inputs)
+    finally:
+        threaded.cleanup()
+
+    for x, y in zip(expected, results):
+        assert np.allclose(x, y, rtol=0, atol=1e-5)
+
+
+def test_parallel_for():
+
+    be = NervanaCPU(num_threads=4)
+    try:
+        covered = np.zeros(10, dtype=np.int32)
+
+        def mark(start, stop):
+            covered[start:stop] += 1
+            # nested calls run inline on the worker thread
+            be.parallel_for(stop - start, lambda a, b: None)
+
+        be.parallel_for(10, mark)
+        assert (covered == 1).all()
+    finally:
+        be.cleanup()
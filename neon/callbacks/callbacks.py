@@ -12,13 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ----------------------------------------------------------------------------
-from collections import deque
+from collections import deque, OrderedDict
 import h5py
 import inspect
 import logging
 import numpy as np
 import os
 import sys
+import threading
 import time
 from timeit import default_timer
 import weakref
@@ -26,9 +27,42 @@ import weakref
 from neon import NervanaObject
 from neon.data import NervanaDataIterator, Ticker
 from neon.util.persist import load_obj, save_obj, load_class
+from neon.util.profiler import Profiler
 from neon.layers import Convolution
 logger = logging.getLogger(__name__)
 
+# callbacks holding per-minibatch data back in buffers, by callback_data file
+_buffering_callbacks = weakref.WeakKeyDictionary()
+
+
+def flush_callback_data(callback_data):
+    """
+    Write out the per-minibatch data that callbacks are holding in buffers.
+    Done at the end of every epoch, and needed before reading per-minibatch
+    data another callback wrote during the current epoch.
+
+    Arguments:
+        callback_data (HDF5 dataset): shared data between callbacks
+    """
+    for c in _buffering_callbacks.get(callback_data, []):
+        c.flush(callback_data)
+
+
+def latest_train_cost(callback_data, index):
+    """
+    Running average training cost of the latest minibatch, for display.  The
+    cost is taken from the buffer of the TrainCostCallback, so that nothing is
+    written out between the ends of the chunks.
+
+    Arguments:
+        callback_data (HDF5 dataset): shared data between callbacks
+        index (int): index of the latest minibatch in the cost/train dataset
+    """
+    for c in _buffering_callbacks.get(callback_data, []):
+        if isinstance(c, TrainCostCallback):
+            return c.latest_cost()
+    return callback_data['cost/train'][index]
+
 
 class Callbacks(NervanaObject):
 
@@ -79,7 +113,8 @@ class Callbacks(NervanaObject):
         self.callbacks = list()
         self.epoch_marker = 0
         self.output_file = output_file
-        if output_file is None:
+        # only the first process of a data parallel backend writes the file
+        if output_file is None or self.be.rank != 0:
             if hasattr(self, 'callback_data'):
                 del self.callback_data
             # self.name sould give a unique filename
@@ -233,6 +268,7 @@ class Callbacks(NervanaObject):
         """
         Call all registered callbacks' on_train_end functions
         """
+        flush_callback_data(self.callback_data)
         for c in self.callbacks:
             c.on_train_end(self.callback_data, self.model())
 
@@ -256,6 +292,8 @@ class Callbacks(NervanaObject):
         Arguments:
             epoch (int): index of epoch that is ending
         """
+        flush_callback_data(self.callback_data)
+        self.run_evals(epoch)
         for c in self.callbacks:
             if c.should_fire(self.callback_data, self.model(), epoch, c.epoch_freq):
                 c.on_epoch_end(self.callback_data, self.model(), epoch)
@@ -266,6 +304,28 @@ class Callbacks(NervanaObject):
         self.callback_data['time_markers'].attrs['minibatches_complete'] = self.epoch_marker
         self.callback_data.flush()
 
+    def run_evals(self, epoch):
+        """
+        Run a single inference pass over each evaluation set used by the
+        evaluation callbacks firing this epoch, feeding the outputs to all of
+        them.
+
+        Arguments:
+            epoch (int): index of epoch that is ending
+        """
+        eval_sets = []
+        consumers = {}
+        for c in self.callbacks:
+            if (isinstance(c, EvalCallback) and
+                    c.should_fire(self.callback_data, self.model(), epoch, c.epoch_freq)):
+                if id(c.eval_set) not in consumers:
+                    eval_sets.append(c.eval_set)
+                    consumers[id(c.eval_set)] = []
+                consumers[id(c.eval_set)].append(c)
+
+        for eval_set in eval_sets:
+            EvalCallback.evaluate(self.model(), eval_set, consumers[id(eval_set)], epoch)
+
     def on_minibatch_begin(self, epoch, minibatch):
         """
         Call all registered callbacks' on_minibatch_begin functions
@@ -444,6 +504,14 @@ class SerializeModelCallback(Callback):
     """
     Callback for serializing the state of the model.
 
+    Checkpoints are written to a temporary file that is renamed over the
+    destination once complete, so an interrupted write never leaves a
+    truncated checkpoint behind.  With async_save the parameters and
+    optimizer states are copied into host staging buffers, which are reused
+    from one checkpoint to the next, and the file is written by a background
+    thread while training continues.  Only one checkpoint is written at a
+    time, the next one waits for the previous write to finish.
+
     Arguments:
         save_path (str): where to save the model dataset
         epoch_freq (int, optional): how often (in epochs) to serialize the
@@ -452,26 +520,141 @@ class SerializeModelCallback(Callback):
         history (int, optional): number of checkpoint files to retain, newest
                                  files up to this count are retained.  filename
                                  for the check point files will be
-                                 <save_path>_<epoch>.
+                                 <save_path>_<epoch>, or
+                                 <save_path>_<epoch>_<minibatch> for the
+                                 checkpoints taken within an epoch.
+        async_save (bool, optional): write the checkpoints on a background
+                                     thread.  Defaults to False.
+        minibatch_freq (int, optional): also serialize the model every this
+                                        many minibatches of an epoch.  Defaults
+                                        to None (only at the end of epochs).
     """
 
-    def __init__(self, save_path, epoch_freq=1, history=1):
-        super(SerializeModelCallback, self).__init__(epoch_freq=epoch_freq)
+    def __init__(self, save_path, epoch_freq=1, history=1, async_save=False,
+                 minibatch_freq=None):
+        super(SerializeModelCallback, self).__init__(epoch_freq=epoch_freq,
+                                                     minibatch_freq=minibatch_freq)
         self.save_path = save_path
         self.history = history
+        self.async_save = async_save
         self.checkpoint_files = deque()
+        self.staging = []
+        self.writer = None
+        self.write_error = None
 
     def on_epoch_end(self, callback_data, model, epoch):
+        self.checkpoint(model, epoch)
+
+    def on_minibatch_end(self, callback_data, model, epoch, minibatch):
+        self.checkpoint(model, epoch, minibatch)
+
+    def on_train_end(self, callback_data, model):
+        self.wait()
+
+    def checkpoint(self, model, epoch, minibatch=None):
+        """
+        Serialize the model, to save_path or, if history > 1, to a file
+        named after the epoch (and minibatch).
+
+        Arguments:
+            model (Model): model object
+            epoch (int): index of current epoch
+            minibatch (int, optional): index of the minibatch that just ended,
+                                       None at the end of an epoch
+        """
+        # only the first process of a data parallel backend writes the files
+        if self.be.rank != 0:
+            return
         if self.history > 1:
-            self.save_history(epoch, model)
+            self.save_history(epoch, model, minibatch)
         else:
-            save_obj(model.serialize(keep_states=True), self.save_path)
+            self.save(model.serialize(keep_states=True), self.save_path)
 
-    def save_history(self, epoch, model):
+    def save(self, pdict, save_path, on_saved=None):
+        """
+        Write a serialized model, in the background if async_save is set.
+
+        Arguments:
+            pdict (dict): model dictionary from Model.serialize
+            save_path (str): file to write
+            on_saved (function, optional): called once the file is in place
+        """
+        self.wait()
+        if not self.async_save:
+            self._write(pdict, save_path, on_saved)
+            return
+        pdict = self._stage(pdict, [0])
+        self.writer = threading.Thread(target=self._write_async,
+                                       args=(pdict, save_path, on_saved))
+        self.writer.daemon = True
+        self.writer.start()
+
+    def wait(self):
+        """
+        Wait for the checkpoint being written in the background, if any.
+        """
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.write_error is not None:
+            err, self.write_error = self.write_error, None
+            raise err
+
+    def _stage(self, obj, count):
+        """
+        Copy the arrays in obj into the staging buffers, in order, (re)allocating
+        the buffers that do not match.  The model's tensors can then change
+        while the copy is written.
+        """
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+            slot = count[0]
+            count[0] += 1
+            if slot == len(self.staging):
+                self.staging.append(None)
+            buf = self.staging[slot]
+            if buf is None or buf.shape != obj.shape or buf.dtype != obj.dtype:
+                buf = self.staging[slot] = np.empty_like(obj)
+            buf[...] = obj
+            return buf
+        if isinstance(obj, dict):
+            return dict((k, self._stage(v, count)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)) and obj.__class__ in (list, tuple):
+            return obj.__class__(self._stage(v, count) for v in obj)
+        return obj
+
+    def _write_async(self, pdict, save_path, on_saved):
+        try:
+            self._write(pdict, save_path, on_saved)
+        except Exception as e:
+            logger.error('Could not write checkpoint %s: %s', save_path, e)
+            self.write_error = e
+
+    def _write(self, pdict, save_path, on_saved):
+        # write next to the destination, keeping the extension which selects
+        # the file format, and move the complete file into place
+        path_split = os.path.splitext(save_path)
+        tmp_path = '%s.tmp%s' % path_split
+        save_obj(pdict, tmp_path)
+        os.rename(tmp_path, save_path)
+        logger.info('saved checkpoint %s', save_path)
+        if on_saved is not None:
+            on_saved()
+
+    def save_history(self, epoch, model, minibatch=None):
         # if history > 1, this function will save the last N checkpoints
         # where N is equal to self.history.  The files will have the form
         # of save_path with the epoch added to the filename before the ext
+        path_split = os.path.splitext(self.save_path)
+        if minibatch is None:
+            save_path = '%s_%d%s' % (path_split[0], epoch, path_split[1])
+        else:
+            save_path = '%s_%d_%d%s' % (path_split[0], epoch, minibatch, path_split[1])
+        self.save(model.serialize(keep_states=True), save_path,
+                  on_saved=lambda: self.rotate_history(save_path))
 
+    def rotate_history(self, save_path):
+        # runs once save_path is in place (in the writer thread when saving
+        # asynchronously), so a failed write never costs an older checkpoint
         if len(self.checkpoint_files) > self.history:
             # remove oldest checkpoint file when max count have been saved
             fn = self.checkpoint_files.popleft()
@@ -481,12 +664,11 @@ class SerializeModelCallback(Callback):
             except OSError:
                 logger.warn('Could not delete old checkpoint file %s' % fn)
 
-        path_split = os.path.splitext(self.save_path)
-        save_path = '%s_%d%s' % (path_split[0], epoch, path_split[1])
         # add the current file to the deque
         self.checkpoint_files.append(save_path)
-        save_obj(model.serialize(keep_states=True), save_path)
+        self.link_latest(save_path)
 
+    def link_latest(self, save_path):
         # maintain a symlink pointing to the latest model params
         try:
             if os.path.islink(self.save_path):
@@ -516,18 +698,62 @@ class RunTimerCallback(Callback):
         callback_data['time/train/end_time'].attrs['units'] = 'seconds'
 
 
+class ProfilerCallback(Callback):
+    """
+    Callback which profiles every layer, optimizer update and backend kernel
+    during training, see neon.util.profiler.Profiler.  At the end of each
+    epoch a JSON summary <output_prefix>_<epoch>.summary.json and, if trace
+    is set, a Chrome trace <output_prefix>_<epoch>.trace.json are written.
+
+    Arguments:
+        output_prefix (str): path prefix of the output files
+        kernels (bool, optional): also time the backend kernels
+        trace (bool, optional): write the Chrome trace of every call
+    """
+    def __init__(self, output_prefix, kernels=True, trace=True):
+        super(ProfilerCallback, self).__init__()
+        self.output_prefix = output_prefix
+        self.profiler = Profiler(self.be, kernels=kernels, trace=trace)
+
+    def on_train_begin(self, callback_data, model, epochs):
+        self.profiler.reset()
+        self.profiler.attach(model)
+
+    def on_epoch_end(self, callback_data, model, epoch):
+        prefix = '%s_%d' % (self.output_prefix, epoch)
+        self.profiler.save_summary(prefix + '.summary.json')
+        if self.profiler.trace:
+            self.profiler.save_trace(prefix + '.trace.json')
+        self.profiler.reset()
+
+    def on_train_end(self, callback_data, model):
+        self.profiler.detach()
+
+
 class TrainCostCallback(Callback):
     """
     Callback for computing average training cost periodically during training.
+
+    The cost of every minibatch is copied into a buffer on the device, which
+    is brought to the host and written to callback_data in chunks, rather
+    than synchronizing on every minibatch.
+
+    Arguments:
+        wsz (int, optional): number of minibatches the cost is averaged over
+        chunk_size (int, optional): number of minibatch costs buffered before
+                                    they are written out
     """
-    def __init__(self, wsz=10):
+    def __init__(self, wsz=10, chunk_size=256):
         super(TrainCostCallback, self).__init__(epoch_freq=1)
         self.wsz = wsz
+        self.chunk_size = chunk_size
 
     def on_train_begin(self, callback_data, model, epochs):
         # preallocate space for the number of minibatches in the whole run
         points = callback_data['config'].attrs['total_minibatches']
-        callback_data.create_dataset("cost/train", (points,))
+        callback_data.create_dataset("cost/train", (points,),
+                                     chunks=(max(1, min(points, self.chunk_size)),),
+                                     compression='gzip')
 
         # make sure our window size is less than or equal to total number of minibatches
         self.wsz = min(points, self.wsz)
@@ -536,14 +762,147 @@ class TrainCostCallback(Callback):
         # clue in the data reader to use the 'minibatch' time_markers
         callback_data['cost/train'].attrs['time_markers'] = 'minibatch'
 
+        self.cost_buf = self.be.zeros((1, self.chunk_size), dtype=np.float32)
+        self.buf_start, self.buf_len = 0, 0
+        self.last_cost = 0.0
+        _buffering_callbacks.setdefault(callback_data, []).append(self)
+
+    def on_epoch_begin(self, callback_data, model, epoch):
+        self.mbstart = int(callback_data['time_markers/minibatch'][epoch-1]) if epoch > 0 else 0
+
     def on_minibatch_end(self, callback_data, model, epoch, minibatch):
-        self.cost_history.append(model.cost.cost.get())
-        mean_cost = sum(self.cost_history) / len(self.cost_history)
-        mbstart = callback_data['time_markers/minibatch'][epoch-1] if epoch > 0 else 0
-        callback_data['cost/train'][mbstart + minibatch] = mean_cost
+        if self.buf_len == 0:
+            self.buf_start = self.mbstart + minibatch
+        self.cost_buf[:, self.buf_len] = model.cost.cost
+        self.buf_len += 1
+        if self.buf_len == self.chunk_size:
+            self.flush(callback_data)
+
+    def flush(self, callback_data):
+        """
+        Write out the buffered costs, averaged over the window.
+        """
+        if self.buf_len == 0:
+            return
+        costs = self.cost_buf.get()[0, :self.buf_len]
+        mean_costs = np.empty(self.buf_len, dtype=np.float32)
+        for i, cost in enumerate(costs):
+            self.cost_history.append(cost)
+            mean_costs[i] = sum(self.cost_history) / len(self.cost_history)
+        callback_data['cost/train'][self.buf_start:self.buf_start + self.buf_len] = mean_costs
+        self.last_cost = mean_costs[-1]
+        self.buf_len = 0
+
+    def latest_cost(self):
+        """
+        Running average cost of the latest minibatch, leaving the buffered
+        costs in place.
+        """
+        if self.buf_len == 0:
+            return self.last_cost
+        costs = list(self.cost_history) + list(self.cost_buf.get()[0, :self.buf_len])
+        window = costs[-self.wsz:]
+        return sum(window) / len(window)
 
 
-class LossCallback(Callback):
+class EvalCallback(Callback):
+
+    """
+    Base class for callbacks that evaluate the model on a dataset at the end
+    of an epoch.  The inference pass is shared: when run through Callbacks,
+    each evaluation set is iterated once per epoch and the outputs of every
+    minibatch are handed to all the evaluation callbacks using that set.
+
+    Derived classes implement eval_begin, eval_minibatch and eval_end.
+
+    Arguments:
+        eval_set (NervanaDataIterator): dataset to evaluate
+        epoch_freq (int, optional): how often (in epochs) to evaluate.
+                                    Defaults to every 1 epoch.
+    """
+
+    def __init__(self, eval_set, epoch_freq=1):
+        super(EvalCallback, self).__init__(epoch_freq=epoch_freq)
+        self.eval_set = eval_set
+        self.eval_epoch = None
+        self.eval_time = 0.
+
+    @staticmethod
+    def evaluate(model, eval_set, callbacks, epoch):
+        """
+        Run one inference pass over eval_set for a number of evaluation
+        callbacks.
+
+        Arguments:
+            model (Model): model object
+            eval_set (NervanaDataIterator): dataset to evaluate
+            callbacks (list): EvalCallbacks using eval_set
+            epoch (int): index of epoch that is ending
+        """
+        start = default_timer()
+        model.initialize(eval_set)
+        for c in callbacks:
+            c.eval_begin(model)
+
+        nprocessed = 0
+        eval_set.reset()
+        for x, t in eval_set:
+            x = model.fprop(x, inference=True)
+
+            # This logic is for handling partial batch sizes at the end of the dataset
+            nsteps = x.shape[1] / model.be.bsz if not isinstance(x, list) else \
+                x[0].shape[1] / model.be.bsz
+            bsz = min(eval_set.ndata - nprocessed, model.be.bsz)
+            for c in callbacks:
+                c.eval_minibatch(model, x, t, bsz, nsteps)
+            nprocessed += bsz
+
+        elapsed = default_timer() - start
+        for c in callbacks:
+            c.eval_epoch = epoch
+            c.eval_time = elapsed
+
+    def on_epoch_end(self, callback_data, model, epoch):
+        # evaluate unless already done in the shared pass of Callbacks
+        if self.eval_epoch != epoch:
+            self.evaluate(model, self.eval_set, [self], epoch)
+        self.eval_end(callback_data, model, epoch)
+
+    def eval_begin(self, model):
+        """
+        Called before the evaluation pass.
+
+        Arguments:
+            model (Model): model object
+        """
+        pass
+
+    def eval_minibatch(self, model, x, t, bsz, nsteps):
+        """
+        Called with the model outputs of every minibatch of the evaluation set.
+
+        Arguments:
+            model (Model): model object
+            x (Tensor): model outputs
+            t (Tensor): targets
+            bsz (int): number of valid examples in the minibatch
+            nsteps (int): number of time steps of each example
+        """
+        pass
+
+    def eval_end(self, callback_data, model, epoch):
+        """
+        Called after the evaluation pass, from on_epoch_end.
+
+        Arguments:
+            callback_data (HDF5 dataset): shared data between callbacks
+            model (Model): model object
+            epoch (int): index of epoch that is ending
+        """
+        pass
+
+
+class LossCallback(EvalCallback):
 
     """
     Callback for calculating the loss on a given dataset periodically during training.
@@ -555,8 +914,7 @@ class LossCallback(Callback):
     """
 
     def __init__(self, eval_set, epoch_freq=1):
-        super(LossCallback, self).__init__(epoch_freq=epoch_freq)
-        self.eval_set = eval_set
+        super(LossCallback, self).__init__(eval_set, epoch_freq=epoch_freq)
         self.loss = self.be.zeros((1, 1), dtype=np.float32)
 
     def on_train_begin(self, callback_data, model, epochs):
@@ -565,26 +923,23 @@ class LossCallback(Callback):
         callback_data["cost/loss"].attrs['time_markers'] = 'epoch_freq'
         callback_data["cost/loss"].attrs['epoch_freq'] = self.epoch_freq
 
-    def on_epoch_end(self, callback_data, model, epoch):
-        start_loss = default_timer()
-        nprocessed = 0
+    def eval_begin(self, model):
+        self.nprocessed = 0
         self.loss[:] = 0
-        self.eval_set.reset()
-        for x, t in self.eval_set:
-            x = model.fprop(x, inference=True)
-            bsz = min(self.eval_set.ndata - nprocessed, self.be.bsz)
-            model.cost.get_cost(x, t)
-            nsteps = x.shape[1] / self.be.bsz if not isinstance(x, list) else \
-                x[0].shape[1] / self.be.bsz
-            costbuf = model.cost.outputs[:, :bsz*nsteps]
-            nprocessed += bsz
-            self.loss[:] = self.loss + self.be.sum(costbuf, axis=1)/nsteps
-            mean_cost = float(self.loss.get() / nprocessed)
-        callback_data["time/loss"][epoch/self.epoch_freq] = (default_timer() - start_loss)
+
+    def eval_minibatch(self, model, x, t, bsz, nsteps):
+        model.cost.get_cost(x, t)
+        costbuf = model.cost.outputs[:, :bsz*nsteps]
+        self.nprocessed += bsz
+        self.loss[:] = self.loss + self.be.sum(costbuf, axis=1)/nsteps
+
+    def eval_end(self, callback_data, model, epoch):
+        mean_cost = float(self.loss.get() / self.nprocessed)
+        callback_data["time/loss"][epoch/self.epoch_freq] = self.eval_time
         callback_data["cost/loss"][epoch/self.epoch_freq] = mean_cost
 
 
-class MetricCallback(Callback):
+class MetricCallback(EvalCallback):
     """
     Callback for calculating a metric on a given dataset periodically during
     training.
@@ -596,8 +951,7 @@ class MetricCallback(Callback):
                                     Defaults to every 1 epoch.
     """
     def __init__(self, eval_set, metric, epoch_freq=1):
-        super(MetricCallback, self).__init__(epoch_freq=epoch_freq)
-        self.eval_set = eval_set
+        super(MetricCallback, self).__init__(eval_set, epoch_freq=epoch_freq)
         self.metric = metric
         self.metric_cnt = len(self.metric.metric_names)
         self.metric_desc = ", ".join(self.metric.metric_names)
@@ -610,17 +964,23 @@ class MetricCallback(Callback):
             callback_data[group_name].attrs['time_markers'] = 'epoch_freq'
             callback_data[group_name].attrs['epoch_freq'] = self.epoch_freq
 
-    def on_epoch_end(self, callback_data, model, epoch):
-        if (epoch + 1) % self.epoch_freq == 0:
-            self.eval_set.reset()
-            stats = model.eval(self.eval_set, metric=self.metric)
-            logger.info('%s: %s', self.metric_desc, ", ".join(map(str, stats.flatten())))
+    def eval_begin(self, model):
+        self.running_error = np.zeros((self.metric_cnt), dtype=np.float32)
+        self.nprocessed = 0
+
+    def eval_minibatch(self, model, x, t, bsz, nsteps):
+        self.running_error += self.metric(x, t, calcrange=slice(0, nsteps * bsz)) * nsteps * bsz
+        self.nprocessed += bsz * nsteps
+
+    def eval_end(self, callback_data, model, epoch):
+        stats = self.running_error / self.nprocessed
+        logger.info('%s: %s', self.metric_desc, ", ".join(map(str, stats.flatten())))
 
-            for ind, met in enumerate(self.metric.metric_names):
-                callback_data["metrics/%s" % met][epoch/self.epoch_freq] = stats[ind]
+        for ind, met in enumerate(self.metric.metric_names):
+            callback_data["metrics/%s" % met][epoch/self.epoch_freq] = stats[ind]
 
 
-class MultiLabelStatsCallback(Callback):
+class MultiLabelStatsCallback(EvalCallback):
 
     """
     Callback for calculating statistics on multi-label classification tasks.
@@ -639,38 +999,32 @@ class MultiLabelStatsCallback(Callback):
     """
 
     def __init__(self, eval_set, labels, metric, epoch_freq=1):
-        super(MultiLabelStatsCallback, self).__init__(epoch_freq=epoch_freq)
-        self.eval_set = eval_set
+        super(MultiLabelStatsCallback, self).__init__(eval_set, epoch_freq=epoch_freq)
         self.metric = metric
         self.labels = labels
         self.metric_desc = ", ".join(self.metric.metric_names)
 
-    def on_epoch_end(self, callback_data, model, epoch):
-        if (epoch + 1) % self.epoch_freq == 0:
-            self.eval_set.reset()
+    def eval_begin(self, model):
+        self.running_stats = np.zeros_like(self.metric.outputs.get(), dtype=np.float32)
+        self.nbatch = 0
 
-            running_stats = np.zeros_like(self.metric.outputs.get(), dtype=np.float32)
+    def eval_minibatch(self, model, x, t, bsz, nsteps):
+        self.metric(x, t)
+        self.running_stats += self.metric.outputs.get()
+        self.nbatch += 1
 
-            # Calculate the metric values
-            nbatch = 0
-            for x, t in self.eval_set:
-                x = model.fprop(x, inference=True)
+    def eval_end(self, callback_data, model, epoch):
+        running_stats = self.running_stats / self.nbatch
 
-                self.metric(x, t)
-                running_stats += self.metric.outputs.get()
-                nbatch += 1
+        # Print the statistics for all the labels
+        for i, label in enumerate(self.labels):
+            metric_text = "["
+            for k, metric in enumerate(self.metric.metric_names):
+                metric_text += "%s: %d%% " % (metric, running_stats[i][k]*100.0)
 
-            running_stats /= nbatch
-
-            # Print the statistics for all the labels
-            for i, label in enumerate(self.labels):
-                metric_text = "["
-                for k, metric in enumerate(self.metric.metric_names):
-                    metric_text += "%s: %d%% " % (metric, running_stats[i][k]*100.0)
-
-                metric_text += "] -> %s\n" % label
-                sys.stdout.write(metric_text.encode('utf-8'))
-                sys.stdout.flush()
+            metric_text += "] -> %s\n" % label
+            sys.stdout.write(metric_text.encode('utf-8'))
+            sys.stdout.flush()
 
 
 class HistCallback(Callback):
@@ -679,11 +1033,16 @@ class HistCallback(Callback):
     histograms once per minibatch or once per epoch using the plot_per_mini
     flag. Histograms are stored to the hdf5 output file and can be visualized
     using the nvis tool.
+
+    The histograms are computed into the backend's histogram buffer and only
+    brought to the host and written out when the buffer fills up, at the end
+    of every epoch, or every chunk_size minibatches.
     """
-    def __init__(self, plot_per_mini, filter_key):
+    def __init__(self, plot_per_mini, filter_key, chunk_size=256):
         super(HistCallback, self).__init__(epoch_freq=1, minibatch_freq=1)
         self.plot_per_mini = plot_per_mini
         self.filter = filter_key
+        self.chunk_size = chunk_size
 
     def on_train_begin(self, callback_data, model, epochs):
         self.minibatches = callback_data['config'].attrs['total_minibatches']
@@ -694,34 +1053,72 @@ class HistCallback(Callback):
         hist_grp.attrs['time_markers'] = 'minibatch' if self.plot_per_mini else 'epoch'
         hist_grp.attrs['time_steps'] = self.minibatches if self.plot_per_mini else epochs
 
+        # (timestamp, dataset name, histogram buffer row) not written out yet
+        self.pending = []
+        self.pending_steps = 0
+        _buffering_callbacks.setdefault(callback_data, []).append(self)
+
+    def on_epoch_begin(self, callback_data, model, epoch):
+        self.mbstart = int(callback_data['time_markers/minibatch'][epoch-1]) if epoch > 0 else 0
+
     def on_minibatch_end(self, callback_data, model, epoch, minibatch):
         if self.plot_per_mini:
-            prev_epochs_minibatches = 0
-            if epoch > 0:
-                prev_epochs_minibatches = callback_data['time_markers/minibatch'][epoch-1]
-
-            timestamp = prev_epochs_minibatches + minibatch
-            self._save_hist_data(callback_data, model, timestamp)
+            self._save_hist_data(callback_data, model, self.mbstart + minibatch)
 
     def on_epoch_end(self, callback_data, model, epoch):
         if not self.plot_per_mini:
             self._save_hist_data(callback_data, model, epoch)
+            self.flush(callback_data)
 
     def _save_hist_data(self, callback_data, model, timestamp):
+        tensors = []
         for l_i, l in enumerate(model.layers.layers):
             for item in self.filter:
                 if hasattr(l, item):
                     name = "%s_%d_%s" % (l.name, l_i, item)
                     if getattr(l, item):
-                        getattr(l, item).hist(name)
+                        tensors.append((name, getattr(l, item)))
+
+        if self.be.hist_idx + len(tensors) > self.be.hist_max:
+            self.flush(callback_data)
+        for name, tensor in tensors:
+            tag = "%s_%d" % (name, timestamp)
+            tensor.hist(tag)
+            self.pending.append((timestamp, name, self.be.hist_map[tag]))
 
+        self.pending_steps += 1
+        if self.pending_steps == self.chunk_size:
+            self.flush(callback_data)
+
+    def flush(self, callback_data):
+        """
+        Write out the buffered histograms.
+        """
+        if len(self.pending) == 0:
+            return
         hist_grp = callback_data['hist']
         points = hist_grp.attrs['time_steps']
         hdata, hmap = self.be.dump_hist_data()
         hdata = hdata.get()
-        for hname in hmap:
-            hist_dset = hist_grp.require_dataset(hname, shape=(64, points), dtype=hdata.dtype)
-            hist_dset[:, timestamp] = hdata[hmap[hname]].reshape((64,))
+
+        writes = OrderedDict()
+        for timestamp, hname, row in self.pending:
+            writes.setdefault(hname, ([], []))
+            writes[hname][0].append(timestamp)
+            writes[hname][1].append(row)
+        for hname, (timestamps, rows) in writes.items():
+            hist_dset = hist_grp.require_dataset(hname, shape=(self.be.hist_bins, points),
+                                                 dtype=hdata.dtype,
+                                                 chunks=(self.be.hist_bins,
+                                                         max(1, min(points, self.chunk_size))),
+                                                 compression='gzip')
+            if timestamps[-1] - timestamps[0] + 1 == len(timestamps):
+                hist_dset[:, timestamps[0]:timestamps[-1] + 1] = hdata[rows].T
+            else:
+                hist_dset[:, timestamps] = hdata[rows].T
+
+        self.pending = []
+        self.pending_steps = 0
 
 
 def get_progress_string(tag, epoch, minibatch, nbatches, cost, time,
@@ -768,7 +1165,7 @@ class ProgressBarCallback(Callback):
         if (now - self.last_update > self.update_thresh_s or mb_complete == self.nbatches):
             self.last_update = now
             mbstart = callback_data['time_markers/minibatch'][epoch-1] if epoch > 0 else 0
-            train_cost = callback_data['cost/train'][mbstart + minibatch]
+            train_cost = latest_train_cost(callback_data, mbstart + minibatch)
 
             progress_string = get_progress_string("Train", epoch, mb_complete, self.nbatches,
                                                   train_cost, now - self.start_epoch)
@@ -812,7 +1209,7 @@ class TrainLoggerCallback(Callback):
 
     def on_minibatch_end(self,  callback_data, model, epoch, minibatch):
         mbstart = callback_data['time_markers/minibatch'][epoch-1] if epoch > 0 else 0
-        train_cost = callback_data['cost/train'][mbstart + minibatch]
+        train_cost = latest_train_cost(callback_data, mbstart + minibatch)
         logger.info("Epoch %d Minibatch %d complete. Train cost: %f", epoch, minibatch, train_cost)
 
     def on_epoch_end(self, callback_data, model, epoch):
@@ -842,7 +1239,9 @@ class SaveBestStateCallback(Callback):
         if _eil:
             if _eil['cost'] < self.best_cost or self.best_cost is None:
                 # TODO: switch this to a general seralization op
-                save_obj(model.serialize(keep_states=True), self.best_path)
+                # only the first process of a data parallel backend writes the file
+                if self.be.rank == 0:
+                    save_obj(model.serialize(keep_states=True), self.best_path)
                 self.best_cost = _eil['cost']
 
 
@@ -13,12 +13,13 @@
 # limitations under the License.
 # ----------------------------------------------------------------------------
 
-from neon.data.dataiterator import NervanaDataIterator, DataIterator, ArrayIterator
+from neon.data.dataiterator import (NervanaDataIterator, DataIterator, ArrayIterator,
+                                   MemmapIterator, PrefetchIterator)
 from neon.data.datasets import Dataset
 from neon.data.dataloaders import (load_mnist, load_cifar10, load_babi, load_flickr8k,
                                    load_flickr30k, load_coco, load_i1kmeta, load_text,
                                    I1Kmeta, load_shakespeare)
-from neon.data.text import Text, Shakespeare, PTB, HutterPrize, IMDB
+from neon.data.text import Text, BucketIterator, Shakespeare, PTB, HutterPrize, IMDB
 from neon.data.batch_writer import BatchWriter, BatchWriterI1K
 from neon.data.imageloader import ImageLoader
 from neon.data.questionanswer import BABI, QA
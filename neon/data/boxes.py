@@ -0,0 +1,178 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Vectorized bounding box operations used to prepare ROI datasets.
+
+Boxes are arrays of shape (N, 4) holding 0-based inclusive pixel coordinates
+(x_min, y_min, x_max, y_max).
+"""
+import numpy as np
+
+BOX_EPS = 1e-14
+
+
+def box_areas(boxes):
+    """
+    Areas of boxes, shape (N,).
+    """
+    return (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+
+
+def bbox_overlaps(boxes, query):
+    """
+    Intersection over union of every pair of boxes from two lists.
+
+    Arguments:
+        boxes (ndarray): boxes, shape (N, 4)
+        query (ndarray): boxes, shape (K, 4)
+
+    Returns:
+        ndarray: overlaps, shape (N, K), zero for disjoint boxes
+    """
+    boxes = boxes.astype(np.float64, copy=False)
+    query = query.astype(np.float64, copy=False)
+
+    iw = (np.minimum(boxes[:, 2:3], query[:, 2]) -
+          np.maximum(boxes[:, 0:1], query[:, 0]) + 1)
+    ih = (np.minimum(boxes[:, 3:4], query[:, 3]) -
+          np.maximum(boxes[:, 1:2], query[:, 1]) + 1)
+    np.maximum(iw, 0, out=iw)
+    np.maximum(ih, 0, out=ih)
+    inter = iw * ih
+
+    union = box_areas(boxes)[:, np.newaxis] + box_areas(query) - inter
+    overlaps = np.zeros(inter.shape, dtype=np.float32)
+    np.divide(inter, union, out=overlaps, where=inter > 0, casting='unsafe')
+    return overlaps
+
+
+def bbox_transform(rois, gt_boxes):
+    """
+    Encode ground truth boxes as regression targets relative to the ROIs
+    they are matched with: the center shift scaled by the ROI size, and the
+    log of the size ratio.
+
+    Arguments:
+        rois (ndarray): proposed boxes, shape (N, 4)
+        gt_boxes (ndarray): matching ground truth boxes, shape (N, 4)
+
+    Returns:
+        ndarray: targets (dx, dy, dw, dh), shape (N, 4)
+    """
+    rois = rois.astype(np.float64, copy=False)
+    gt_boxes = gt_boxes.astype(np.float64, copy=False)
+
+    rp_size = rois[:, 2:4] - rois[:, 0:2] + BOX_EPS
+    rp_ctr = rois[:, 0:2] + 0.5 * rp_size
+    gt_size = gt_boxes[:, 2:4] - gt_boxes[:, 0:2] + BOX_EPS
+    gt_ctr = gt_boxes[:, 0:2] + 0.5 * gt_size
+
+    return np.hstack(((gt_ctr - rp_ctr) / rp_size, np.log(gt_size / rp_size)))
+
+
+def normalize_bbox_targets(targets, num_classes):
+    """
+    Normalize regression targets in place to zero mean and unit variance
+    per class, with the statistics taken over all of them at once.
+
+    Arguments:
+        targets (list): arrays of shape (N_i, 5) holding the class label
+                        followed by the 4 targets.  Rows of class 0
+                        (background) are left alone.
+        num_classes (int): number of classes, including the background
+
+    Returns:
+        tuple: per class means and standard deviations, shape (num_classes, 4)
+    """
+    if len(targets) == 0:
+        return np.zeros((num_classes, 4)), np.ones((num_classes, 4))
+    all_targets = np.vstack(targets)
+    labels = all_targets[:, 0].astype(np.int32)
+
+    counts = np.bincount(labels, minlength=num_classes)[:, np.newaxis] + BOX_EPS
+    sums = np.zeros((num_classes, 4))
+    squared_sums = np.zeros((num_classes, 4))
+    np.add.at(sums, labels, all_targets[:, 1:])
+    np.add.at(squared_sums, labels, all_targets[:, 1:] ** 2)
+    means = sums / counts
+    stds = np.sqrt(squared_sums / counts - means ** 2)
+
+    for t in targets:
+        cls = t[:, 0].astype(np.int32)
+        fg = np.where(cls > 0)[0]
+        t[fg, 1:] = (t[fg, 1:] - means[cls[fg]]) / stds[cls[fg]]
+    return means, stds
+
+
+def bbox_regression_labels(targets, num_classes):
+    """
+    Expand compact (label, dx, dy, dw, dh) targets into the 4 * num_classes
+    columns used by the network, only the columns of the label of a row are
+    set, along with a loss weight of 1.
+
+    Arguments:
+        targets (ndarray): shape (N, 5)
+        num_classes (int): number of classes, including the background
+
+    Returns:
+        tuple: regression targets and loss weights, both (N, 4 * num_classes)
+    """
+    n = targets.shape[0]
+    bbox_targets = np.zeros((n, 4 * num_classes), dtype=np.float32)
+    bbox_loss_weights = np.zeros(bbox_targets.shape, dtype=np.float32)
+    rows = np.where(targets[:, 0] > 0)[0]
+    cols = 4 * targets[rows, 0].astype(np.int32)[:, np.newaxis] + np.arange(4)
+    bbox_targets[rows[:, np.newaxis], cols] = targets[rows, 1:]
+    bbox_loss_weights[rows[:, np.newaxis], cols] = 1.
+    return bbox_targets, bbox_loss_weights
+
+
+def sample_fg_bg(overlaps, fg_thre, bg_thre_low, bg_thre_high, num_fg, num_rois,
+                 randomness=True):
+    """
+    Pick foreground and background ROIs by their best overlap with the
+    ground truth, without replacement.
+
+    Arguments:
+        overlaps (ndarray): best overlap of each ROI, shape (N,) or (N, 1)
+        fg_thre (float): lowest overlap of a foreground ROI
+        bg_thre_low (float): lowest overlap of a background ROI
+        bg_thre_high (float): overlap a background ROI stays below
+        num_fg (int): most foreground ROIs to pick
+        num_rois (int): most ROIs to pick in total, the ones left after the
+                        foreground are background
+        randomness (bool, optional): pick at random, otherwise pick the first
+                                     ones.  Defaults to True.
+
+    Returns:
+        tuple: indices of the picked ROIs, foreground first, and the number
+               of foreground ones
+    """
+    overlaps = overlaps.ravel()
+    fg_inds = np.where(overlaps >= fg_thre)[0]
+    num_fg = int(min(num_fg, fg_inds.size))
+    if randomness and fg_inds.size > 0:
+        fg_inds = np.random.choice(fg_inds, size=num_fg, replace=False)
+    else:
+        fg_inds = fg_inds[:num_fg]
+
+    bg_inds = np.where((overlaps < bg_thre_high) & (overlaps >= bg_thre_low))[0]
+    num_bg = int(min(num_rois - num_fg, bg_inds.size))
+    if randomness and bg_inds.size > 0:
+        bg_inds = np.random.choice(bg_inds, size=num_bg, replace=False)
+    else:
+        bg_inds = bg_inds[:num_bg]
+
+    return np.append(fg_inds, bg_inds).astype(np.int64), num_fg
@@ -16,9 +16,13 @@
 Defines basic input datatset types.
 """
 import logging
+import sys
+import threading
 import numpy as np
 
 from neon import NervanaObject
+from neon.backends.backend import Tensor
+from neon.util.compat import queue
 logger = logging.getLogger(__name__)
 
 
@@ -40,6 +44,16 @@ class NervanaDataIterator(NervanaObject):
     def __iter__(self):
         raise NotImplemented()
 
+    def shard(self):
+        """
+        Restrict the iterator to the examples of this process of a data
+        parallel backend (see Backend.data_shard).  Model.fit calls this on
+        the training set when the backend has several processes, iterators
+        that cannot split their data raise ValueError.
+        """
+        raise ValueError("%s cannot split its data between the processes of a data parallel "
+                         "backend" % self.__class__.__name__)
+
 
 class ArrayIterator(NervanaDataIterator):
 
@@ -49,12 +63,19 @@ class ArrayIterator(NervanaDataIterator):
     This may be used when the entire dataset is small enough to fit within memory.
     """
 
-    def __init__(self, X, y=None, nclass=None, lshape=None, make_onehot=True, name=None):
+    def __init__(self, X, y=None, nclass=None, lshape=None, make_onehot=True, name=None,
+                 shuffle=False, stratify=False, sample_weights=None):
         """
         Implements loading of given data into backend tensor objects. If the
         backend is specific to an accelarator device, the data is copied over
         to that device.
 
+        Examples can be visited in a different order every epoch, drawn with
+        the backend's random number generator.  Minibatches are then gathered
+        by index from the stored data, which is never permuted.  Training with
+        a data parallel backend restricts the iterator to the examples of the
+        process in the same way (see shard).
+
         Args:
             X (ndarray, shape: [# examples, feature size]): Input features within the
                 dataset.
@@ -69,11 +90,20 @@ class ArrayIterator(NervanaDataIterator):
             make_onehot (bool, optional): True if y is a label that has to be converted to one hot
                             False if y doesn't need to be converted to one hot
                             (e.g. in a CAE)
+            shuffle (bool, optional): Visit the examples in a random order every epoch.
+            stratify (bool, optional): Spread the examples of each class evenly over the
+                            epoch, so that every minibatch has about the class proportions of
+                            the dataset.  Requires class labels y.
+            sample_weights (ndarray or str, optional): Every epoch draws as many examples
+                            as the dataset holds, with replacement, with probabilities
+                            proportional to these per example weights.  'balanced' weights
+                            examples by the inverse frequency of their class.
 
         """
         # Treat singletons like list so that iteration follows same syntax
         super(ArrayIterator, self).__init__(name=name)
         X = X if isinstance(X, list) else [X]
+
         self.ndata = len(X[0])
         assert self.ndata >= self.be.bsz
         self.start = 0
@@ -110,6 +140,59 @@ class ArrayIterator(NervanaDataIterator):
             self.hbuf.append(self.ybuf)
             self.unpack_func.append(yfunc)
 
+        # epoch sampling, the host copy of the labels is only kept if needed
+        self.shuffle = shuffle
+        self.stratify = stratify
+        self.labels = None
+        if stratify and sample_weights is not None:
+            raise ValueError('Stratified sampling cannot be combined with sample_weights')
+        if stratify or isinstance(sample_weights, str):
+            if y is None:
+                raise AttributeError('Class labels are needed for stratified or balanced sampling')
+            self.labels = np.asarray(y).ravel().astype(np.intp)
+
+        self.sample_probs = None
+        if isinstance(sample_weights, str):
+            if sample_weights != 'balanced':
+                raise ValueError('Unknown sample_weights %s' % sample_weights)
+            sample_weights = 1.0 / np.bincount(self.labels)[self.labels]
+        if sample_weights is not None:
+            sample_weights = np.asarray(sample_weights, dtype=np.float64).ravel()
+            assert len(sample_weights) == self.ndata
+            self.sample_probs = sample_weights / sample_weights.sum()
+
+        self.order = None
+        self.shard_idx = None
+        self.idx_buf = None
+        if shuffle or stratify or sample_weights is not None:
+            self._alloc_take_bufs()
+
+    def _alloc_take_bufs(self):
+        self.idx_buf = self.be.zeros((self.be.bsz, 1), dtype=np.int32)
+        # the rows of each minibatch are gathered here before unpacking
+        self.take_bufs = [self.be.empty((self.be.bsz,) + dev.shape[1:], dtype=dev.dtype)
+                          for dev in self.dbuf]
+
+    def shard(self):
+        """
+        Restrict the iterator to the examples of this process of a data
+        parallel backend (see Backend.data_shard).  The data stays in place,
+        the minibatches are gathered from the examples of the process.
+        """
+        if self.be.num_procs == 1 or self.shard_idx is not None:
+            return
+        self.shard_idx = np.arange(self.ndata)[self.be.data_shard(self.ndata)]
+        self.ndata = len(self.shard_idx)
+        assert self.ndata >= self.be.bsz
+        self.start = 0
+        if self.labels is not None:
+            self.labels = self.labels[self.shard_idx]
+        if self.sample_probs is not None:
+            probs = self.sample_probs[self.shard_idx]
+            self.sample_probs = probs / probs.sum()
+        if self.idx_buf is None:
+            self._alloc_take_bufs()
+
     @property
     def nbatches(self):
         return -((self.start - self.ndata) // self.be.bsz)
@@ -123,6 +206,32 @@ class ArrayIterator(NervanaDataIterator):
         """
         self.start = 0
 
+    def epoch_order(self):
+        """
+        Draw the order in which the next epoch visits the examples.
+
+        Returns:
+            ndarray: example indices, or None for the stored order
+        """
+        rng = self.be.rng
+        if self.sample_probs is not None:
+            return rng.choice(self.ndata, self.ndata, p=self.sample_probs)
+        if self.stratify:
+            # place the k-th of the n examples of a class at (k + offset) / n
+            # and merge the classes by position
+            positions = np.empty(self.ndata)
+            for label in np.unique(self.labels):
+                members = np.flatnonzero(self.labels == label)
+                offset = 0.5
+                if self.shuffle:
+                    members = rng.permutation(members)
+                    offset = rng.uniform()
+                positions[members] = (np.arange(len(members)) + offset) / len(members)
+            return np.argsort(positions, kind='mergesort')
+        if self.shuffle:
+            return rng.permutation(self.ndata)
+        return None
+
     def __iter__(self):
         """
         Defines a generator that can be used to iterate over this dataset.
@@ -130,6 +239,10 @@ class ArrayIterator(NervanaDataIterator):
         Yields:
             tuple: The next minibatch which includes both features and labels.
         """
+        self.order = self.epoch_order()
+        if self.shard_idx is not None:
+            self.order = self.shard_idx if self.order is None else self.shard_idx[self.order]
+
         for i1 in range(self.start, self.ndata, self.be.bsz):
             bsz = min(self.be.bsz, self.ndata - i1)
             islice1, oslice1 = slice(0, bsz), slice(i1, i1 + bsz)
@@ -138,16 +251,192 @@ class ArrayIterator(NervanaDataIterator):
                 islice2, oslice2 = slice(bsz, None), slice(0, self.be.bsz - bsz)
                 self.start = self.be.bsz - bsz
 
-            for buf, dev, unpack_func in zip(self.hbuf, self.dbuf, self.unpack_func):
-                unpack_func(dev[oslice1], buf[:, islice1])
+            if self.order is not None:
+                # gather the rows of the minibatch straight from the stored data
+                idx = self.order[oslice1]
                 if oslice2:
-                    unpack_func(dev[oslice2], buf[:, islice2])
+                    idx = np.concatenate((idx, self.order[oslice2]))
+                self.idx_buf.set(idx.reshape((-1, 1)).astype(np.int32))
+                for buf, dev, take_buf, unpack_func in zip(self.hbuf, self.dbuf,
+                                                           self.take_bufs, self.unpack_func):
+                    unpack_func(self.be.take(dev, self.idx_buf, 0, out=take_buf), buf)
+            else:
+                for buf, dev, unpack_func in zip(self.hbuf, self.dbuf, self.unpack_func):
+                    unpack_func(dev[oslice1], buf[:, islice1])
+                    if oslice2:
+                        unpack_func(dev[oslice2], buf[:, islice2])
 
             inputs = self.Xbuf[0] if len(self.Xbuf) == 1 else self.Xbuf
             targets = self.ybuf if self.ybuf else inputs
             yield (inputs, targets)
 
 
+def _open_shards(data):
+    """
+    Return the list of shards of an array, a .npy file path or a list of
+    those, with files memory mapped read only.
+    """
+    shards = data if isinstance(data, list) else [data]
+    return [np.load(shard, mmap_mode='r') if isinstance(shard, str) else shard
+            for shard in shards]
+
+
+class MemmapIterator(NervanaDataIterator):
+
+    """
+    Out of core version of ArrayIterator.  The data is left in (memory mapped)
+    host arrays and read a block of minibatches at a time, so only one block
+    is resident in memory and nothing is loaded up front.  The dataset may be
+    split into shards along the example axis.  Minibatches wrap around the
+    end of the dataset like ArrayIterator.
+
+    Blocks can be visited in a random order each epoch, which keeps the reads
+    sequential within each block.
+    """
+
+    def __init__(self, X, y=None, nclass=None, lshape=None, make_onehot=True,
+                 block_batches=64, shuffle_blocks=False, name=None):
+        """
+        Args:
+            X (ndarray, str or list): Input features, shape [# examples, feature
+                size], given as an array (e.g. np.memmap), the path of a .npy
+                file, or a list of those holding consecutive examples.
+            y (ndarray, str or list, optional): Labels, given and sharded like
+                X, but the shards need not line up with those of X.
+                If absent, the input features themselves will be returned as
+                target values (AutoEncoder)
+            nclass (int, optional): The number of possible types of labels.
+            lshape (tuple, optional): Local shape for the input features
+                (e.g. height, width, channel for images)
+            make_onehot (bool, optional): True if y is a label that has to be
+                converted to one hot
+            block_batches (int, optional): Number of minibatches read at once.
+            shuffle_blocks (bool, optional): Visit the blocks in a random order
+                every epoch.
+        """
+        super(MemmapIterator, self).__init__(name=name)
+        self.X = _open_shards(X)
+        self.y = None if y is None else _open_shards(y)
+        self.ndata = sum(len(shard) for shard in self.X)
+        assert self.ndata >= self.be.bsz
+        if self.y is not None:
+            assert sum(len(shard) for shard in self.y) == self.ndata
+        self.start = 0
+        self.nclass = nclass
+        self.make_onehot = make_onehot
+
+        if make_onehot and nclass is None and y is not None:
+            raise AttributeError('Must provide number of classes when creating onehot labels')
+
+        nfeatures = self.X[0].shape[1]
+        self.shape = nfeatures if lshape is None else lshape
+        self.lshape = lshape
+
+        self.Xbuf = self.be.iobuf(nfeatures)
+        self.ybuf = None
+        if self.y is not None:
+            self.ybuf = self.be.iobuf(nclass if make_onehot else self.y[0].shape[1])
+
+        self.block_rows = block_batches * self.be.bsz
+        self.nblocks = -(-self.ndata // self.block_rows)
+        self.shuffle_blocks = shuffle_blocks
+        self.order = np.arange(self.nblocks)
+        self.block = None
+
+    @property
+    def nbatches(self):
+        return -((self.start - self.ndata) // self.be.bsz)
+
+    def reset(self):
+        """
+        For resetting the starting index of this dataset back to zero.
+        """
+        self.start = 0
+
+    def _rows(self, shards, start, stop):
+        """
+        Copy of the examples start to stop of a sharded array.
+        """
+        pieces = []
+        offset = 0
+        for shard in shards:
+            lo, hi = max(start - offset, 0), min(stop - offset, len(shard))
+            if lo < hi:
+                pieces.append(shard[lo:hi])
+            offset += len(shard)
+        return np.concatenate(pieces) if len(pieces) > 1 else np.array(pieces[0])
+
+    def _block(self, k):
+        """
+        The examples of the k-th block of the epoch, read on first use.
+        """
+        index = self.order[k]
+        if self.block is None or self.block[0] != index:
+            start = index * self.block_rows
+            stop = min(start + self.block_rows, self.ndata)
+            self.block = (index,
+                          self._rows(self.X, start, stop),
+                          None if self.y is None else self._rows(self.y, start, stop))
+        return self.block[1:]
+
+    def _read(self, start, stop):
+        """
+        Examples start to stop in this epoch's block order.
+        """
+        xs, ys = [], []
+        while start < stop:
+            k = np.searchsorted(self.block_ends, start, side='right')
+            block_start = self.block_ends[k - 1] if k > 0 else 0
+            lo, hi = start - block_start, min(stop, self.block_ends[k]) - block_start
+            x, y = self._block(k)
+            xs.append(x[lo:hi])
+            ys.append(None if y is None else y[lo:hi])
+            start += hi - lo
+        if len(xs) == 1:
+            return xs[0], ys[0]
+        return np.concatenate(xs), None if self.y is None else np.concatenate(ys)
+
+    def _load(self, x, y):
+        """
+        Copy a minibatch of examples to the backend buffers.
+        """
+        self.Xbuf.set(np.ascontiguousarray(x.reshape((len(x), -1)).T, dtype=self.Xbuf.dtype))
+        if y is None:
+            return
+        if self.make_onehot:
+            onehot = np.zeros(self.ybuf.shape, dtype=self.ybuf.dtype)
+            onehot[y.ravel().astype(np.intp), np.arange(len(y))] = 1
+            self.ybuf.set(onehot)
+        else:
+            self.ybuf.set(np.ascontiguousarray(y.reshape((len(y), -1)).T,
+                                               dtype=self.ybuf.dtype))
+
+    def __iter__(self):
+        """
+        Defines a generator that can be used to iterate over this dataset.
+
+        Yields:
+            tuple: The next minibatch which includes both features and labels.
+        """
+        if self.shuffle_blocks:
+            self.order = self.be.rng.permutation(self.nblocks)
+        sizes = np.minimum(self.block_rows, self.ndata - self.order * self.block_rows)
+        self.block_ends = np.cumsum(sizes)
+
+        for i1 in range(self.start, self.ndata, self.be.bsz):
+            bsz = min(self.be.bsz, self.ndata - i1)
+            x, y = self._read(i1, i1 + bsz)
+            if self.be.bsz > bsz:
+                x2, y2 = self._read(0, self.be.bsz - bsz)
+                x = np.concatenate((x, x2))
+                y = None if y is None else np.concatenate((y, y2))
+                self.start = self.be.bsz - bsz
+            self._load(x, y)
+
+            targets = self.ybuf if self.ybuf is not None else self.Xbuf
+            yield (self.Xbuf, targets)
+
+
 class DataIterator(ArrayIterator):
     """
     This class has been renamed to ArrayIterator and deprecated.
@@ -160,6 +449,123 @@ class DataIterator(ArrayIterator):
         super(DataIterator, self).__init__(*args, **kwargs)
 
 
+class PrefetchIterator(NervanaDataIterator):
+
+    """
+    Wraps any data iterator so that the following minibatches are prepared on
+    a worker thread while the current one is in use.
+
+    The worker runs the wrapped iterator and copies every minibatch it yields
+    into one of depth + 1 sets of buffers, since iterators generally reuse
+    their output buffers.  Training then overlaps with the host side slicing,
+    casting, transposing and one-hot conversion of the wrapped iterator.
+    Other attributes (shape, ndata, ...) are those of the wrapped iterator.
+    """
+
+    def __init__(self, dataset, depth=2, name=None):
+        """
+        Args:
+            dataset (NervanaDataIterator): iterator to prefetch from
+            depth (int, optional): number of minibatches to prepare ahead
+        """
+        super(PrefetchIterator, self).__init__(name=name)
+        assert depth >= 1, "depth must be at least 1"
+        self.dataset = dataset
+        self.depth = depth
+        self.slots = [None] * (depth + 1)
+
+    def __getattr__(self, attr):
+        # only called for attributes not found on the wrapper itself
+        if attr == 'dataset' or attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.dataset, attr)
+
+    @property
+    def nbatches(self):
+        return self.dataset.nbatches
+
+    def reset(self):
+        self.dataset.reset()
+
+    def shard(self):
+        self.dataset.shard()
+
+    def _copy(self, src, dst, memo):
+        """
+        Copy a minibatch (nested lists and tuples of tensors, arrays and other
+        values) into the buffers of dst, allocating them as needed.  Values
+        appearing several times in src, like the inputs returned as targets
+        by autoencoder datasets, are copied once.
+        """
+        if id(src) in memo:
+            return memo[id(src)]
+        if isinstance(src, (list, tuple)):
+            if not isinstance(dst, (list, tuple)) or len(dst) != len(src):
+                dst = [None] * len(src)
+            out = type(src)(self._copy(s, d, memo) for s, d in zip(src, dst))
+        elif isinstance(src, Tensor):
+            if not isinstance(dst, Tensor) or dst.shape != src.shape or dst.dtype != src.dtype:
+                dst = self.be.empty_like(src)
+            dst[:] = src
+            out = dst
+        elif isinstance(src, np.ndarray):
+            out = src.copy()
+        else:
+            out = src
+        memo[id(src)] = out
+        return out
+
+    def _fill(self, filled, free, stop):
+        """
+        Worker thread: run one epoch of the wrapped iterator into free slots.
+        """
+        ctx = getattr(self.be, 'ctx', None)
+        if ctx is not None:
+            ctx.push()
+        try:
+            for batch in self.dataset:
+                slot = free.get()
+                if stop.is_set():
+                    return
+                self.slots[slot] = self._copy(batch, self.slots[slot], {})
+                filled.put((slot, None))
+            filled.put((None, None))
+        except Exception:
+            filled.put((None, sys.exc_info()[1]))
+        finally:
+            if ctx is not None:
+                ctx.pop()
+
+    def __iter__(self):
+        """
+        Defines a generator that can be used to iterate over this dataset.
+
+        Yields:
+            The minibatches of the wrapped iterator.
+        """
+        filled, free, stop = queue.Queue(), queue.Queue(), threading.Event()
+        for slot in range(len(self.slots)):
+            free.put(slot)
+
+        worker = threading.Thread(target=self._fill, args=(filled, free, stop))
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                slot, error = filled.get()
+                if error is not None:
+                    raise error
+                if slot is None:
+                    break
+                yield self.slots[slot]
+                free.put(slot)
+        finally:
+            # stop the worker if the consumer quits early
+            stop.set()
+            free.put(None)
+            worker.join()
+
+
 if __name__ == '__main__':
     from neon.data import load_mnist
     (X_train, y_train), (X_test, y_test) = load_mnist()
@@ -2,8 +2,10 @@ from collections import Counter
 import numpy as np
 import os
 
+from neon import NervanaObject
 from neon.data.dataiterator import NervanaDataIterator
 from neon.data.datasets import Dataset
+from neon.layers import LSTM, MergeMultistream, StreamRunner
 
 
 class ImageCaption(NervanaDataIterator):
@@ -23,6 +25,7 @@ class ImageCaption(NervanaDataIterator):
 
     end_token = '.'
     image_size = 4096  # Hard code VVG feature size
+    max_predict_length = 21  # words kept in predicted sentences, including the first
 
     def __init__(self, path, max_images=-1):
         """
@@ -180,47 +183,60 @@ class ImageCaption(NervanaDataIterator):
             list containing sentences
         """
 
-        sents = []
-
         if not isinstance(prob, np.ndarray):
             prob = prob.get()
-        words = [self.index_to_vocab[x] for x in np.argmax(prob, axis=0).tolist()]
+        return self.index_to_sents(np.argmax(prob, axis=0).reshape((-1, self.be.bsz)))
+
+    def index_to_sents(self, indices):
+        """
+        Convert word indices to sentences.
+
+        Args:
+            indices (ndarray): Word indices of each sentence of batch.
+                               Of size (sentence_length, batch_size)
 
-        for sent_index in xrange(self.be.bsz):
+        Returns:
+            list containing sentences
+        """
+        sents = []
+        for sent_index in xrange(indices.shape[1]):
             sent = []
-            for i in xrange(self.max_sentence_length):
-                word = words[self.be.bsz * i + sent_index]
+            for i in xrange(indices.shape[0]):
+                word = self.index_to_vocab[int(indices[i, sent_index])]
                 sent.append(word)
-                if (i > 0 and word == self.end_token) or i >= 20:
+                if (i > 0 and word == self.end_token) or i >= self.max_predict_length - 1:
                     break
             sents.append(" ".join(sent))
 
         return sents
 
-    def predict(self, model):
+    def predict(self, model, beam_width=1):
         """
         Given a model, generate sentences from this dataset.
 
+        The sentences are generated one word at a time with a CaptionDecoder,
+        carrying the LSTM state from one word to the next.
+
         Args:
             model (Model): Image captioning model.
+            beam_width (int): Number of candidate sentences kept by the beam
+                              search.  1 picks the most likely word at each
+                              step.
 
         Returns:
             list, list containing predicted sentences and target sentences
         """
         sents = []
         targets = []
-        y = self.be.zeros(self.dev_X.shape)
+        decoder = CaptionDecoder(model, self.be.bsz, beam_width)
+        nsteps = min(self.max_sentence_length, self.max_predict_length)
         for mb_idx, (x, t) in enumerate(self):
-            y.fill(0)
-            # Repeatedly generate next word in sentence and choose max prob word each time.
-            for step in range(1, self.max_sentence_length+1):
-                prob = model.fprop((x[0], y), inference=True).get()[:, :-self.be.bsz].copy()
-                pred = np.argmax(prob, axis=0)
-                prob.fill(0)
-                for i in range(step * self.be.bsz):
-                    prob[pred[i], i] = 1
-                y[:] = prob
-            sents += self.prob_to_word(y)
+            if beam_width == 1:
+                indices = decoder.greedy(x[0], nsteps)
+            else:
+                indices = decoder.beam_search(x[0], nsteps,
+                                              self.vocab_to_index[self.end_token])
+            sents += self.index_to_sents(indices)
             # Test set, keep list of targets
             if isinstance(self, ImageCaptionTest):
                 targets += t[0]
@@ -298,6 +314,187 @@ class ImageCaption(NervanaDataIterator):
             yield out
 
 
+class CaptionDecoder(NervanaObject):
+    """
+    Generates sentences one word at a time with an image captioning model laid
+    out as in examples/image_caption.py: a MergeMultistream of an image path
+    and a sentence path feeding an LSTM (possibly through dropout), followed by
+    the layers producing the word probabilities.
+
+    Instead of running the model over the whole sentence generated so far for
+    every new word, the LSTM state is carried from one word to the next, so
+    generating a sentence is linear in its length.  The words are chosen on
+    the backend.
+
+    Args:
+        model (Model): Trained image captioning model.
+        nsents (int): Number of sentences generated at once.
+        beam_width (int): Number of beams per sentence for beam_search, greedy
+                          needs a beam width of 1.
+    """
+    BIG = 1e30
+
+    def __init__(self, model, nsents, beam_width=1):
+        layers = model.layers.layers
+        merge = layers[0]
+        lstm = [l for l in layers if isinstance(l, LSTM)]
+        if not isinstance(merge, MergeMultistream) or len(lstm) != 1:
+            raise ValueError("Expected a MergeMultistream followed by a single LSTM")
+        lstm = lstm[0]
+        self.image_layers, self.word_layers = [seq.layers for seq in merge.layers]
+        self.pre_layers = layers[1:layers.index(lstm)]
+        self.post_layers = layers[layers.index(lstm) + 1:]
+        self.lstm = lstm
+        self.nsents = nsents
+        self.beam_width = beam_width
+        self.ncols = ncols = nsents * beam_width
+
+        self.vocab_size = self.word_layers[0].nin
+        self.runner = StreamRunner(self.image_layers + self.word_layers + layers[1:])
+        self.state = lstm.init_step_state(ncols)
+        self.image = self.be.empty((self.image_layers[0].nin, ncols))
+        self.words = self.be.empty((1, ncols), dtype=np.int32)
+        self.onehot = self.be.empty((self.vocab_size, ncols))
+
+        if beam_width > 1:
+            self.cand = self.be.empty((beam_width * self.vocab_size, nsents))
+            self.mask = self.be.empty(self.cand.shape)
+            self.scores = self.be.empty((beam_width, nsents))
+            self.top_idx = self.be.empty((beam_width, nsents), dtype=np.int32)
+            self.top_val = self.be.empty((beam_width, nsents))
+            self.parents = self.be.empty((1, ncols), dtype=np.int32)
+            self.perm = self.be.empty((ncols, ncols))
+            self.permuted = self.be.empty((lstm.nout, ncols))
+
+    def fprop(self, layers, x):
+        """
+        Apply layers to a step of input.
+        """
+        return self.runner.fprop_layers(layers, x, {self.lstm: self.state})
+
+    def start(self, image):
+        """
+        Reset the LSTM state and feed the images as first step.
+
+        Args:
+            image (Tensor): image features of the batch, repeated for each beam
+
+        Returns:
+            Tensor: word probabilities (vocab_size, ncols)
+        """
+        for state in self.state:
+            state.fill(0)
+        return self.step(self.fprop(self.image_layers, image))
+
+    def step(self, x):
+        """
+        Feed the output of the image or sentence path through the LSTM.
+        """
+        return self.fprop(self.pre_layers + [self.lstm] + self.post_layers, x)
+
+    def next_word(self):
+        """
+        Feed the words in self.words as the next step.
+        """
+        self.onehot[:] = self.be.onehot(self.words, axis=0)
+        return self.step(self.fprop(self.word_layers, self.onehot))
+
+    def greedy(self, image, nsteps):
+        """
+        Generate sentences picking the most likely word at each step.
+
+        Args:
+            image (Tensor): image features (image_size, nsents)
+            nsteps (int): number of words to generate
+
+        Returns:
+            ndarray: word indices (nsteps, nsents)
+        """
+        indices = self.be.empty((nsteps, self.ncols), dtype=np.int32)
+        prob = self.start(image)
+        for step in range(nsteps):
+            self.be.argmax(prob, axis=0, out=self.words)
+            indices[step] = self.words
+            if step < nsteps - 1:
+                prob = self.next_word()
+        return indices.get()
+
+    def beam_search(self, image, nsteps, end_index):
+        """
+        Generate sentences with a beam search over their log probabilities.
+        The beams are laid out in blocks of columns, beam j of sentence s in
+        column j * nsents + s.  The top candidates are selected on the
+        backend, only their indices and scores are copied back to keep track
+        of the beams.
+
+        Args:
+            image (Tensor): image features (image_size, nsents)
+            nsteps (int): maximum number of words to generate
+            end_index (int): index of the end token.  A beam is finished when
+                             it produces it, after the first word.
+
+        Returns:
+            ndarray: word indices of the best beam of each sentence (nsteps, nsents)
+        """
+        nsents, beam_width, vocab = self.nsents, self.beam_width, self.vocab_size
+
+        # all the beams start from the same state, so only expand the first one
+        scores = np.full((beam_width, nsents), -self.BIG, dtype=np.float32)
+        scores[0] = 0
+        self.scores.set(scores)
+        for j in range(beam_width):
+            self.image[:, j * nsents:(j + 1) * nsents] = image
+
+        words, parents = [], []
+        best_score = np.full(nsents, -np.inf)
+        best_end = [None] * nsents
+        cols = np.arange(nsents)
+
+        prob = self.start(self.image)
+        for step in range(nsteps):
+            for j in range(beam_width):
+                self.cand[j * vocab:(j + 1) * vocab] = (
+                    self.be.safelog(prob[:, j * nsents:(j + 1) * nsents]) + self.scores[j])
+            for j in range(beam_width):
+                self.be.argmax(self.cand, axis=0, out=self.top_idx[j])
+                self.be.max(self.cand, axis=0, out=self.top_val[j])
+                self.mask[:] = self.be.onehot(self.top_idx[j], axis=0)
+                self.cand[:] = self.cand - self.mask * self.BIG
+            top_idx, scores = self.top_idx.get(), self.top_val.get()
+            parent, word = top_idx // vocab, top_idx % vocab
+            words.append(word)
+            parents.append(parent)
+
+            if step > 0:
+                for j, s in zip(*np.nonzero(word == end_index)):
+                    # skip the candidates of beams that were already dead
+                    if scores[j, s] > max(best_score[s], -self.BIG / 2):
+                        best_score[s], best_end[s] = scores[j, s], (step, j)
+                scores[word == end_index] = -self.BIG
+            # the scores of the live beams only decrease from here on
+            if np.all(best_score >= scores.max(axis=0)) or step == nsteps - 1:
+                break
+
+            self.scores.set(scores)
+            self.words.set(word.reshape((1, -1)))
+            self.parents.set((parent * nsents + cols).reshape((1, -1)))
+            self.perm[:] = self.be.onehot(self.parents, axis=0)
+            for state in self.state:
+                self.be.compound_dot(state, self.perm, self.permuted)
+                state[:] = self.permuted
+            prob = self.next_word()
+
+        indices = np.full((nsteps, nsents), end_index, dtype=np.int32)
+        for s in range(nsents):
+            if best_end[s] is None:
+                best_end[s] = (len(words) - 1, np.argmax(scores[:, s]))
+            last, j = best_end[s]
+            for step in range(last, -1, -1):
+                indices[step, s] = words[step][j, s]
+                j = parents[step][j, s]
+        return indices
+
+
 class ImageCaptionTest(ImageCaption):
     """
     This class loads in image and sentence features for testing.
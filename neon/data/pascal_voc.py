@@ -19,8 +19,12 @@ import numpy as np
 import os
 import xml.dom.minidom as minidom
 import tarfile
+from collections import deque
+from multiprocessing import Pool
 from PIL import Image
 
+from neon.data.boxes import (bbox_overlaps, bbox_transform, bbox_regression_labels,
+                             normalize_bbox_targets, sample_fg_bg)
 from neon.data.datasets import Dataset
 from neon.util.persist import save_obj
 from neon.util.persist import load_obj
@@ -57,6 +61,10 @@ FRCN_IMG_DIM_SWAP = (2, 0, 1)
 
 FRCN_EPS = 1e-14
 
+# bumped whenever the content of the ROI database changes, so that databases
+# cached on disk by older versions are rebuilt instead of loaded
+FRCN_ROI_DB_VERSION = 2
+
 dataset_meta = {
     'test-2007': dict(size=460032000,
                       file='VOCtest_06-Nov-2007.tar',
@@ -110,12 +118,24 @@ class PASCALVOC(Dataset):
         rois_per_img (Int, optional): how many rois to pool from each image
         rois_random_sample  (Bool, optional): randomly sample the ROIs. Default
                                                 to be true
+        num_workers (Int, optional): number of processes decoding and resizing
+                                     the images and sampling the ROIs of the
+                                     upcoming minibatches.  Defaults to 0,
+                                     which does it on the training thread.
+                                     With workers, the ROIs are sampled from
+                                     seeds drawn from np.random, so a run is
+                                     still reproducible, but differs from a
+                                     run without workers.
+        prefetch_depth (Int, optional): number of minibatches the workers may
+                                        prepare ahead of the current one.
+                                        Defaults to 2.
 
         """
 
     def __init__(self, image_set, year, path='.', add_flipped=False,
                  overlap_thre=None, output_type=0, n_mb=None, img_per_batch=None,
-                 rois_per_img=None, rois_random_sample=True, shuffle=False):
+                 rois_per_img=None, rois_random_sample=True, shuffle=False,
+                 num_workers=0, prefetch_depth=2):
         self.isRoiDB = True
         self.batch_index = 0
         self.year = year
@@ -132,11 +152,14 @@ class PASCALVOC(Dataset):
         self.rois_per_batch = self.rois_per_image * self.img_per_batch
         self.rois_random_sample = rois_random_sample
         self.shuffle = shuffle
-
-        self.cache_file_name = 'voc_{}_{}_flip_{}_ovlp_{}.pkl'.format(self.year,
-                                                                      self.image_set,
-                                                                      self.add_flipped,
-                                                                      self.overlap_thre)
+        self.num_workers = num_workers
+        self.prefetch_depth = prefetch_depth
+
+        self.cache_file_name = 'voc_{}_{}_flip_{}_ovlp_{}_v{}.pkl'.format(self.year,
+                                                                          self.image_set,
+                                                                          self.add_flipped,
+                                                                          self.overlap_thre,
+                                                                          FRCN_ROI_DB_VERSION)
         print 'prepare PASCAL VOC {} from year {}: add flipped image {} and overlap threshold {}'\
             .format(self.image_set, self.year, self.add_flipped, self.overlap_thre)
 
@@ -300,92 +323,119 @@ class PASCALVOC(Dataset):
         else:
             shuf_idx = self.be.rng.permutation(self.num_image_entries)
 
-        for self.batch_index in xrange(self.nbatches):
-            start = self.batch_index * self.img_per_batch
-            end = (self.batch_index + 1) * self.img_per_batch
-
-            db_inds = shuf_idx[start:end]
-
-            mb_db = [self.roi_db[i] for i in db_inds]
-
-            rois_mb = np.zeros((self.rois_per_batch, 5), dtype=np.float32)
-            labels_blob = np.zeros((self.rois_per_batch), dtype=np.int32)
-            bbox_targets_blob = np.zeros((self.rois_per_batch, 4 * self.num_classes),
-                                         dtype=np.float32)
-            bbox_loss_blob = np.zeros(
-                bbox_targets_blob.shape, dtype=np.float32)
-            self.img_np[:] = 0
-
-            for im_i, db in enumerate(mb_db):
-
-                # load and process the image using PIL
-                im = Image.open(db['img_file'])  # This is RGB order
-
-                im_shape = np.array(im.size, np.int32)
-                im_size_min = np.min(im_shape)
-                im_size_max = np.max(im_shape)
-                im_scale = float(FRCN_MIN_SCALE) / float(im_size_min)
-                # Prevent the biggest axis from being more than FRCN_MAX_SCALE
-                if np.round(im_scale * im_size_max) > FRCN_MAX_SCALE:
-                    im_scale = float(FRCN_MAX_SCALE) / float(im_size_max)
-                im_shape = (im_shape * im_scale).astype(int)
-                im = im.resize(im_shape, Image.LINEAR)
-
-                # load it to numpy and flip the channel RGB to BGR
-                im = np.array(im)[:, :, ::-1]
-                if db['flipped']:
-                    im = im[:, ::-1, :]
-                # Mean subtract and scale an image
-                im = im.astype(np.float32, copy=False)
-                im -= FRCN_PIXEL_MEANS
-
-                # Sample fore-ground and back-ground ROIs from the proposals and labels
-                labels, overlaps, im_rois, bbox_targets, bbox_loss \
-                    = _sample_fg_bg_rois(db, self.fg_rois_per_image, self.rois_per_image,
-                                         self.num_classes, self.rois_random_sample)
-
-                # Add to RoIs blob
-                rois = im_rois * im_scale
-                num_rois_this_image = rois.shape[0]
-                slice_i = slice(im_i * self.rois_per_image,
-                                im_i * self.rois_per_image + num_rois_this_image)
-                batch_ind = im_i * np.ones((num_rois_this_image, 1))
-                # add the corresponding image ind (within this batch) to the ROI data
-                rois_this_image = np.hstack((batch_ind, rois))
-
-                rois_mb[slice_i] = rois_this_image
-
-                # Add to labels, bbox targets, and bbox loss blobs
-                labels_blob[slice_i] = labels.ravel()
-                bbox_targets_blob[slice_i] = bbox_targets
-                bbox_loss_blob[slice_i] = bbox_loss
-
-                # write it to backend tensor
-                self.img_np[:, :im_shape[1], :im_shape[0], im_i] = im.transpose(FRCN_IMG_DIM_SWAP)
-
-            self.dev_X_img_chw.set(self.img_np)
-            self.dev_X_rois[:] = rois_mb
-            self.dev_y_labels_flat[:] = labels_blob.reshape(1, -1)
-            self.dev_y_labels[:] = self.be.onehot(
-                self.dev_y_labels_flat, axis=0)
-            self.dev_y_bbtargets[:] = bbox_targets_blob.T.astype(
-                np.float, order='C')
-            self.dev_y_bbmask[:] = bbox_loss_blob.T.astype(np.int32, order='C')
-
-            if self.output_type == 0:
-                X = (self.dev_X_img, self.dev_X_rois)
-                Y = (self.dev_y_labels, (self.dev_y_bbtargets, self.dev_y_bbmask))
-            elif self.output_type == 1:
-                X = (self.dev_X_img, self.dev_X_rois)
-                Y = self.dev_y_labels
-            elif self.output_type == 2:
-                X = self.dev_X_img
-                Y = self.dev_y_labels
-            else:
-                raise ValueError(
-                    'Do not support output_type to be {}'.format(self.output_type))
-
-            yield X, Y
+        # minibatches whose images are being loaded, in order
+        pending = deque()
+        pool = Pool(self.num_workers) if self.num_workers > 0 else None
+        try:
+            for self.batch_index in xrange(self.nbatches):
+                # with workers, keep the next prefetch_depth minibatches in flight
+                depth = self.prefetch_depth if pool is not None else 0
+                while len(pending) <= depth and \
+                        self.batch_index + len(pending) < self.nbatches:
+                    start = (self.batch_index + len(pending)) * self.img_per_batch
+                    db_inds = shuf_idx[start:start + self.img_per_batch]
+                    pending.append(self._load_images(db_inds, pool))
+
+                self._fill_minibatch(pending.popleft())
+                yield self._minibatch()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _load_images(self, db_inds, pool=None):
+        """
+        Start loading the images of a minibatch and sampling their ROIs.
+
+        Arguments:
+            db_inds (list): indices of the images in the ROI database
+            pool (Pool, optional): worker processes to load the images with,
+                                   they are loaded right away without one
+
+        Returns:
+            list: the results of _load_roi_image for each image, or the
+                  AsyncResults producing them
+        """
+        args = (self.fg_rois_per_image, self.rois_per_image, self.num_classes,
+                self.rois_random_sample)
+        if pool is None:
+            return [_load_roi_image(self.roi_db[i], *args) for i in db_inds]
+
+        # the seeds are drawn here so that the sampling does not depend on
+        # which worker handles an image
+        results = []
+        for i in db_inds:
+            seed = np.random.randint(2 ** 31) if self.rois_random_sample else None
+            results.append(pool.apply_async(_load_roi_image,
+                                            (self.roi_db[i],) + args + (seed,)))
+        return results
+
+    def _fill_minibatch(self, images):
+        """
+        Write the images, ROIs and targets of a minibatch to the backend buffers.
+
+        Arguments:
+            images (list): output of _load_images
+        """
+        rois_mb = np.zeros((self.rois_per_batch, 5), dtype=np.float32)
+        labels_blob = np.zeros((self.rois_per_batch), dtype=np.int32)
+        bbox_targets_blob = np.zeros((self.rois_per_batch, 4 * self.num_classes),
+                                     dtype=np.float32)
+        bbox_loss_blob = np.zeros(
+            bbox_targets_blob.shape, dtype=np.float32)
+        self.img_np[:] = 0
+
+        for im_i, result in enumerate(images):
+            if not isinstance(result, tuple):
+                result = result.get()
+            im, labels, rois, bbox_targets, bbox_loss = result
+
+            num_rois_this_image = rois.shape[0]
+            slice_i = slice(im_i * self.rois_per_image,
+                            im_i * self.rois_per_image + num_rois_this_image)
+            batch_ind = im_i * np.ones((num_rois_this_image, 1))
+            # add the corresponding image ind (within this batch) to the ROI data
+            rois_this_image = np.hstack((batch_ind, rois))
+
+            rois_mb[slice_i] = rois_this_image
+
+            # Add to labels, bbox targets, and bbox loss blobs
+            labels_blob[slice_i] = labels.ravel()
+            bbox_targets_blob[slice_i] = bbox_targets
+            bbox_loss_blob[slice_i] = bbox_loss
+
+            # write it to backend tensor, mean subtracted
+            img = self.img_np[:, :im.shape[0], :im.shape[1], im_i]
+            img[:] = im.transpose(FRCN_IMG_DIM_SWAP)
+            img -= FRCN_PIXEL_MEANS.reshape(3, 1, 1)
+
+        self.dev_X_img_chw.set(self.img_np)
+        self.dev_X_rois[:] = rois_mb
+        self.dev_y_labels_flat[:] = labels_blob.reshape(1, -1)
+        self.dev_y_labels[:] = self.be.onehot(
+            self.dev_y_labels_flat, axis=0)
+        self.dev_y_bbtargets[:] = bbox_targets_blob.T.astype(
+            np.float, order='C')
+        self.dev_y_bbmask[:] = bbox_loss_blob.T.astype(np.int32, order='C')
+
+    def _minibatch(self):
+        """
+        The backend buffers of the current minibatch, grouped for output_type.
+        """
+        if self.output_type == 0:
+            X = (self.dev_X_img, self.dev_X_rois)
+            Y = (self.dev_y_labels, (self.dev_y_bbtargets, self.dev_y_bbmask))
+        elif self.output_type == 1:
+            X = (self.dev_X_img, self.dev_X_rois)
+            Y = self.dev_y_labels
+        elif self.output_type == 2:
+            X = self.dev_X_img
+            Y = self.dev_y_labels
+        else:
+            raise ValueError(
+                'Do not support output_type to be {}'.format(self.output_type))
+
+        return X, Y
 
     def reset(self):
         """
@@ -529,11 +579,6 @@ class PASCALVOC(Dataset):
         assert len(self.roi_gt) == len(self.roi_ss) == self.num_images, \
             'ROIs from GT and SS do not match the dataset images'
 
-        # Compute values needed for means and stds
-        class_counts = np.zeros((self.num_classes, 1), ) + FRCN_EPS
-        sums = np.zeros((self.num_classes, 4))
-        squared_sums = np.zeros((self.num_classes, 4))
-
         roi_gt_ss = [None] * self.num_image_entries
         for i in xrange(self.num_images):
             roi_gt_ss[i] = {}
@@ -561,13 +606,6 @@ class PASCALVOC(Dataset):
 
             roi_gt_ss[i]['bb_targets'] = bb_targets
 
-            for cls in xrange(1, self.num_classes):
-                cls_inds = np.where(bb_targets[:, 0] == cls)[0]
-                if cls_inds.size > 0:
-                    class_counts[cls] += cls_inds.size
-                    sums[cls, :] += bb_targets[cls_inds, 1:].sum(axis=0)
-                    squared_sums[cls, :] += (bb_targets[cls_inds, 1:] ** 2).sum(axis=0)
-
             if self.add_flipped:
                 width = Image.open(image_file).size[0]
                 fliped_bb = roi_gt_ss[i]['bb'].copy()
@@ -575,7 +613,7 @@ class PASCALVOC(Dataset):
                     roi_gt_ss[i]['bb'][:, self._bb_xmax_idx] - 1
                 fliped_bb[:, self._bb_xmax_idx] = width - \
                     roi_gt_ss[i]['bb'][:, self._bb_xmin_idx] - 1
-                bb_targets_flipped = bb_targets
+                bb_targets_flipped = bb_targets.copy()
                 bb_targets_flipped[:, 1] *= -1
 
                 roi_gt_ss[i + self.num_images] = {
@@ -589,52 +627,15 @@ class PASCALVOC(Dataset):
                     'img_file': image_file,
                     'bb_targets': bb_targets_flipped
                 }
-                for cls in xrange(1, self.num_classes):
-                    cls_inds = np.where(bb_targets[:, 0] == cls)[0]
-                    if cls_inds.size > 0:
-                        class_counts[cls] += cls_inds.size
-                        sums[cls, :] += bb_targets_flipped[cls_inds, 1:].sum(axis=0)
-                        squared_sums[
-                            cls, :] += (bb_targets_flipped[cls_inds, 1:] ** 2).sum(axis=0)
-
-        means = sums / class_counts
-        stds = np.sqrt(squared_sums / class_counts - means ** 2)
-
-        # Normalize targets
-        for i in xrange(self.num_images):
-            targets = roi_gt_ss[i]['bb_targets']
-            for cls in xrange(1, self.num_classes):
-                cls_inds = np.where(targets[:, 0] == cls)[0]
-                roi_gt_ss[i]['bb_targets'][cls_inds, 1:] -= means[cls, :]
-                roi_gt_ss[i]['bb_targets'][cls_inds, 1:] /= stds[cls, :]
+
+        # Normalize targets with the per class means and stds of all entries
+        normalize_bbox_targets([db['bb_targets'] for db in roi_gt_ss], self.num_classes)
 
         return roi_gt_ss
 
     def _compute_bb_targets(self, gt_bb, rp_bb, labels):
 
-        rp_widths = rp_bb[:, 2] - rp_bb[:, 0] + FRCN_EPS
-        rp_heights = rp_bb[:, 3] - rp_bb[:, 1] + FRCN_EPS
-        rp_ctr_x = rp_bb[:, 0] + 0.5 * rp_widths
-        rp_ctr_y = rp_bb[:, 1] + 0.5 * rp_heights
-
-        gt_widths = gt_bb[:, 2] - gt_bb[:, 0] + FRCN_EPS
-        gt_heights = gt_bb[:, 3] - gt_bb[:, 1] + FRCN_EPS
-        gt_ctr_x = gt_bb[:, 0] + 0.5 * gt_widths
-        gt_ctr_y = gt_bb[:, 1] + 0.5 * gt_heights
-
-        targets_dx = (gt_ctr_x - rp_ctr_x) / rp_widths
-        targets_dy = (gt_ctr_y - rp_ctr_y) / rp_heights
-        targets_dw = np.log(gt_widths / rp_widths)
-        targets_dh = np.log(gt_heights / rp_heights)
-
-        targets = np.concatenate((labels[:, np.newaxis],
-                                  targets_dx[:, np.newaxis],
-                                  targets_dy[:, np.newaxis],
-                                  targets_dw[:, np.newaxis],
-                                  targets_dh[:, np.newaxis],
-                                  ), axis=1)
-
-        return targets
+        return np.hstack((labels[:, np.newaxis], bbox_transform(rp_bb, gt_bb)))
 
 
 def calculate_bb_overlap(rp, gt):
@@ -648,80 +649,70 @@ def calculate_bb_overlap(rp, gt):
         overlaps: a matrix of overlaps between 2 list, shape (R, G)
     """
     gt_dim = 1
-    R = rp.shape[0]
-    G = gt.shape[0]
-    overlaps = np.zeros((R, G), dtype=np.float32)
-
-    for g in range(G):
-        gt_box_area = float(
-            (gt[g, 2] - gt[g, 0] + 1) *
-            (gt[g, 3] - gt[g, 1] + 1)
-        )
-        for r in range(R):
-            iw = float(
-                min(rp[r, 2], gt[g, 2]) -
-                max(rp[r, 0], gt[g, 0]) + 1
-            )
-            if iw > 0:
-                ih = float(
-                    min(rp[r, 3], gt[g, 3]) -
-                    max(rp[r, 1], gt[g, 1]) + 1
-                )
-                if ih > 0:
-                    ua = float(
-                        (rp[r, 2] - rp[r, 0] + 1) *
-                        (rp[r, 3] - rp[r, 1] + 1) +
-                        gt_box_area - iw * ih
-                    )
-                    overlaps[r, g] = iw * ih / ua
+    overlaps = bbox_overlaps(rp, gt)
     return overlaps, gt_dim
 
 
+def _load_roi_image(db, fg_rois_per_image, rois_per_image, num_classes, randomness,
+                    seed=None):
+    """
+    Decode, rescale and flip the image of a ROI database entry and sample its
+    ROIs.  Defined at module level to run in worker processes.
+
+    Arguments:
+        db (dict): ROI database entry
+        seed (int, optional): seed of np.random for the sampling, the current
+                              state is used if None
+
+    Returns:
+        tuple: image (H, W, C) uint8 in BGR order, labels, ROIs rescaled with
+               the image, bbox targets and bbox loss weights
+    """
+    # load and process the image using PIL
+    im = Image.open(db['img_file'])  # This is RGB order
+
+    im_shape = np.array(im.size, np.int32)
+    im_size_min = np.min(im_shape)
+    im_size_max = np.max(im_shape)
+    im_scale = float(FRCN_MIN_SCALE) / float(im_size_min)
+    # Prevent the biggest axis from being more than FRCN_MAX_SCALE
+    if np.round(im_scale * im_size_max) > FRCN_MAX_SCALE:
+        im_scale = float(FRCN_MAX_SCALE) / float(im_size_max)
+    im_shape = (im_shape * im_scale).astype(int)
+    im = im.resize(im_shape, Image.LINEAR)
+
+    # load it to numpy and flip the channel RGB to BGR
+    im = np.array(im)[:, :, ::-1]
+    if db['flipped']:
+        im = im[:, ::-1, :]
+    im = np.ascontiguousarray(im)
+
+    if seed is not None:
+        np.random.seed(seed)
+    # Sample fore-ground and back-ground ROIs from the proposals and labels
+    labels, overlaps, im_rois, bbox_targets, bbox_loss \
+        = _sample_fg_bg_rois(db, fg_rois_per_image, rois_per_image, num_classes, randomness)
+
+    return im, labels, im_rois * im_scale, bbox_targets, bbox_loss
+
+
 def _sample_fg_bg_rois(roidb, fg_rois_per_image, rois_per_image, num_classes, randomness):
     """Generate a random sample of RoIs comprising foreground and background
     examples.
     """
-    # label = class RoI has max overlap with
-    labels = roidb['max_overlap_class']
-    overlaps = roidb['max_overlap_area']
-    rois = roidb['bb']
-
-    # Select foreground RoIs as those with >= FG_THRESH overlap
-    fg_inds = np.where(overlaps >= FRCN_FG_IOU_THRE)[0]
-
-    # Guard against the case when an image has fewer than fg_rois_per_image
-    # foreground RoIs
-    fg_rois_per_this_image = int(np.minimum(fg_rois_per_image, fg_inds.size))
-    # Sample foreground regions without replacement
-    if fg_inds.size > 0:
-        if randomness is True:
-            fg_inds = np.random.choice(fg_inds, size=fg_rois_per_this_image,
-                                       replace=False)
-        else:
-            fg_inds = fg_inds[range(fg_rois_per_this_image)]
-
-    # Select background RoIs as those within [FRCN_BG_IOU_THRE_LOW, FRCN_BG_IOU_THRE_HIGH)
-    bg_inds = np.where((overlaps < FRCN_BG_IOU_THRE_HIGH) & (overlaps >= FRCN_BG_IOU_THRE_LOW))[0]
-    # Compute number of background RoIs to take from this image (guarding
-    # against there being fewer than desired)
-    bg_rois_per_this_image = int(np.minimum(rois_per_image - fg_rois_per_this_image,
-                                            bg_inds.size))
-    # Sample foreground regions without replacement
-    if bg_inds.size > 0:
-        if randomness is True:
-            bg_inds = np.random.choice(bg_inds, size=bg_rois_per_this_image,
-                                       replace=False)
-        else:
-            bg_inds = bg_inds[range(bg_rois_per_this_image)]
+    keep_inds, fg_rois_per_this_image = sample_fg_bg(roidb['max_overlap_area'],
+                                                     FRCN_FG_IOU_THRE,
+                                                     FRCN_BG_IOU_THRE_LOW,
+                                                     FRCN_BG_IOU_THRE_HIGH,
+                                                     fg_rois_per_image, rois_per_image,
+                                                     randomness)
 
-    # The indices that we're selecting (both fg and bg)
-    keep_inds = np.append(fg_inds, bg_inds)
-    # Select sampled values from various arrays:
-    labels = labels[keep_inds]
+    # label = class RoI has max overlap with
+    labels = roidb['max_overlap_class'][keep_inds]
     # Clamp labels for the background RoIs to 0
     labels[fg_rois_per_this_image:] = 0
-    overlaps = overlaps[keep_inds]
-    rois = rois[keep_inds]
+    overlaps = roidb['max_overlap_area'][keep_inds]
+    rois = roidb['bb'][keep_inds]
 
     bbox_targets, bbox_loss_weights = \
         _get_bbox_regression_labels(roidb['bb_targets'][keep_inds, :],
@@ -742,17 +733,7 @@ def _get_bbox_regression_labels(bbox_target_data, num_classes):
         bbox_target_data (ndarray): N x 4K blob of regression targets
         bbox_loss_weights (ndarray): N x 4K blob of loss weights
     """
-    clss = bbox_target_data[:, 0]
-    bbox_targets = np.zeros((clss.size, 4 * num_classes), dtype=np.float32)
-    bbox_loss_weights = np.zeros(bbox_targets.shape, dtype=np.float32)
-    inds = np.where(clss > 0)[0]
-    for ind in inds:
-        cls = clss[ind]
-        start = 4 * cls
-        end = start + 4
-        bbox_targets[ind, start:end] = bbox_target_data[ind, 1:]
-        bbox_loss_weights[ind, start:end] = [1., 1., 1., 1.]
-    return bbox_targets, bbox_loss_weights
+    return bbox_regression_labels(bbox_target_data, num_classes)
 
 
 def load_data_from_xml_tag(element, tag):
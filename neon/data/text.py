@@ -218,6 +218,148 @@ class Text(NervanaDataIterator):
             yield self.dev_X, self.dev_y
 
 
+class BucketIterator(NervanaDataIterator):
+    """
+    Iterates over sequences of word ids of different lengths, grouped into
+    buckets of sequences of about the same length.  Every minibatch holds
+    sequences of one bucket, padded only up to the length of the bucket, so
+    that the recurrent layers run over fewer steps than with all sequences
+    padded to the longest one.
+
+    Models starting with a LookupTable switch to the number of steps of each
+    minibatch, see Sequential.set_steps.  They are initialized on this
+    iterator, for its longest bucket.
+    """
+
+    def __init__(self, sentences, y, nclass=None, buckets=4, sentence_length=None,
+                 make_onehot=True, shuffle=False, pad_val=0, name=None):
+        """
+        Args:
+            sentences (list): sequences of word ids
+            y (ndarray): label(s) of each sequence
+            nclass (int, optional): number of classes, for one hot labels
+            buckets (int or list, optional): number of buckets, splitting the sequences
+                into buckets of about the same size, or the lengths of the buckets
+            sentence_length (int, optional): longer sequences keep their last
+                sentence_length words.  Defaults to the length of the longest one.
+            make_onehot (bool, optional): convert the labels to one hot
+            shuffle (bool, optional): shuffle the sequences of each bucket and the
+                order of the minibatches every epoch
+            pad_val (int, optional): word id of the padding, added in front of the
+                sequences as with pad_sentences
+        """
+        super(BucketIterator, self).__init__(name=name)
+        if make_onehot and nclass is None:
+            raise AttributeError('Must provide number of classes when creating onehot labels')
+
+        lengths = np.array([len(sent) for sent in sentences])
+        if sentence_length is None:
+            sentence_length = lengths.max()
+        lengths = np.minimum(lengths, sentence_length)
+        if isinstance(buckets, int):
+            buckets = self.bucket_lengths(lengths, buckets)
+        self.buckets = np.union1d(np.minimum(buckets, sentence_length), [sentence_length])
+
+        self.ndata = len(sentences)
+        assert self.ndata >= self.be.bsz
+        self.nclass = nclass
+        self.shuffle = shuffle
+        self.shape = int(self.buckets[-1])
+        self.X = pad_sentences(sentences, sentence_length=self.shape, pad_val=pad_val)
+        self.y = np.asarray(y).reshape((self.ndata, -1))
+        # index of the smallest bucket holding each sequence
+        self.bucket_idx = np.searchsorted(self.buckets, lengths)
+        self.example_order = None
+
+        # one input buffer per bucket
+        self.dev_X = dict((nsteps, self.be.iobuf(int(nsteps))) for nsteps in self.buckets)
+        self.make_onehot = make_onehot
+        if make_onehot:
+            self.dev_lbl = self.be.iobuf(1, dtype=np.int32)
+            self.dev_y = self.be.iobuf(nclass)
+        else:
+            self.dev_y = self.be.iobuf(self.y.shape[1])
+
+    @staticmethod
+    def bucket_lengths(lengths, nbuckets):
+        """
+        Lengths of the buckets splitting sequences into nbuckets buckets of
+        about the same number of sequences (fewer for repeated lengths).
+
+        Args:
+            lengths (ndarray): length of each sequence
+            nbuckets (int): number of buckets
+
+        Returns:
+            ndarray : sorted lengths of the buckets, the last one the longest sequence
+        """
+        lengths = np.sort(lengths)
+        cuts = np.arange(1, nbuckets + 1) * len(lengths) // nbuckets - 1
+        return np.unique(lengths[cuts])
+
+    @property
+    def nbatches(self):
+        return -(-self.ndata // self.be.bsz)
+
+    def reset(self):
+        """
+        Every epoch starts with the first minibatch, nothing to reset.
+        """
+        pass
+
+    def batch_order(self):
+        """
+        Split the sequences into minibatches for an epoch.  The sequences are
+        ordered by bucket, the sequences of a bucket that do not fill a
+        minibatch going with the first ones of the next bucket, and the last
+        minibatch is completed with the first sequences.  With shuffle the
+        minibatches come in random order, but a completed last minibatch stays
+        last so that evaluation counts each sequence once.
+
+        Returns:
+            ndarray, ndarray : indices of the sequences of each minibatch
+                               (nbatches, batch_size), and the number of steps
+                               of each minibatch
+        """
+        if self.shuffle:
+            order = self.be.rng.permutation(self.ndata)
+            order = order[np.argsort(self.bucket_idx[order], kind='mergesort')]
+        else:
+            order = np.argsort(self.bucket_idx, kind='mergesort')
+        self.example_order = order
+
+        extra = self.nbatches * self.be.bsz - self.ndata
+        batches = np.concatenate((order, order[:extra])).reshape((self.nbatches, -1))
+        steps = self.buckets[self.bucket_idx[batches].max(axis=1)]
+        if self.shuffle:
+            nfull = self.nbatches - 1 if extra > 0 else self.nbatches
+            perm = self.be.rng.permutation(nfull)
+            batches[:nfull], steps[:nfull] = batches[perm], steps[perm]
+        return batches, steps
+
+    def __iter__(self):
+        """
+        Generator that can be used to iterate over this dataset.  Without
+        shuffle, the sequences come in the order of example_order.
+
+        Yields:
+            tuple : the word ids of the minibatch (nsteps, batch_size), for the
+                    number of steps of its bucket, and the labels
+        """
+        batches, steps = self.batch_order()
+        for idx, nsteps in zip(batches, steps):
+            X_batch = self.X[idx, -nsteps:].T.astype(np.float32, order='C')
+            self.dev_X[nsteps].set(X_batch)
+
+            if self.make_onehot:
+                self.dev_lbl.set(self.y[idx].reshape((1, -1)))
+                self.dev_y[:] = self.be.onehot(self.dev_lbl, axis=0)
+            else:
+                self.dev_y.set(self.y[idx].T.astype(np.float32, order='C'))
+
+            yield self.dev_X[nsteps], self.dev_y
+
+
 class Shakespeare(Dataset):
     def __init__(self, timesteps, path='.'):
         url = 'http://cs.stanford.edu/people/karpathy/char-rnn'
@@ -20,3 +20,5 @@ from neon.layers.recurrent import (Recurrent, LSTM, GRU, RecurrentSum, Recurrent
                                    BiRNN, BiLSTM, DeepBiRNN, DeepBiLSTM)
 from neon.layers.container import (Tree, Sequential, MergeMultistream, MergeBroadcast, Multicost,
                                    RoiPooling, MergeSum, SingleOutputTree)
+from neon.layers.stream import StreamRunner
+from neon.layers.quantized import QuantizedLinear, QuantizedConvolution, QuantizedLookupTable
@@ -16,9 +16,20 @@ import numpy as np
 from operator import add
 
 from neon import NervanaObject
-from neon.layers.layer import Layer, BranchNode, Dropout, DataTransform
+from neon.layers.layer import (Layer, BranchNode, Dropout, DataTransform, ColorNoise, Linear,
+                               Convolution, Deconvolution, Bias, Activation, Pooling, LRN,
+                               BatchNorm, LookupTable)
+from neon.layers.recurrent import Recurrent, RecurrentOutput
 from neon.util.persist import load_class
 
+# layers whose fprop can be rerun during bprop with the same results, without
+# side effects (no random masks, running statistics or recurrent state)
+recomputable_layers = (Linear, Convolution, Deconvolution, Bias, Activation, Pooling, LRN)
+
+# layers that can run over sequences of fewer steps than configured for, with
+# buffers for each number of steps (see Sequential.set_steps)
+sequence_layers = (LookupTable, Recurrent, RecurrentOutput)
+
 
 def flatten(item):
     if hasattr(item, '__iter__'):
@@ -46,6 +57,43 @@ class LayerContainer(Layer):
                 lto.append(l)
         return lto
 
+    def allocate_inference(self):
+        """
+        Allocate the layers for inference only.  No delta buffers are
+        allocated, and the activations are placed in as few shared buffers as
+        their live ranges during fprop allow (see ActivationPlan), so a chain
+        of layers only needs buffers for about its two largest activations.
+        The layers must have been configured.
+        """
+        plan = ActivationPlan(self)
+        buffers = [self.be.iobuf(size) for size in plan.buffer_sizes]
+        for act in plan.activations:
+            l = act.owner
+            l.outputs = self.be.iobuf(l.out_shape, shared=buffers[act.buffer],
+                                      parallelism=l.parallelism)
+        self.allocate()
+
+    def fold_batch_norm(self):
+        """
+        Fold the batch norm layers following Linear or Convolution layers in
+        the contained pathways (see Sequential.fold_batch_norm).
+
+        Returns:
+            int: number of batch norm layers folded
+        """
+        return sum(l.fold_batch_norm() for l in self.layers if isinstance(l, LayerContainer))
+
+    def release_outputs(self):
+        """
+        Drop the output buffers of the layers, so that they are allocated
+        again by the next allocate.
+        """
+        for l in self.layers:
+            if isinstance(l, LayerContainer):
+                l.release_outputs()
+            if l.owns_output:
+                l.outputs = None
+
     def nested_str(self, level=0):
         padstr = '\n' + '  '*level
         ss = '  ' * level + self.classnm + padstr
@@ -101,10 +149,28 @@ class Sequential(LayerContainer):
     Arguments:
         layers (list): List of objects which can be either a list of layers
                        (including layer containers).
+        recompute_segment (int or str, optional): if given, trade compute for
+                       memory during training: segments of up to this many
+                       groups of layers share scratch buffers for their outputs
+                       and are rerun forward during bprop, from the outputs
+                       kept by the group before them.  'auto' uses the square
+                       root of the number of groups that can be recomputed.
+                       A group is a layer owning its outputs with
+                       the layers working in place on them (bias, activation);
+                       groups with layers that cannot be rerun (dropout, batch
+                       norm, recurrent layers, containers, ...) always keep
+                       their outputs.
+
+    A container starting with a lookup table or a recurrent layer also runs
+    on sequences shorter than those it was configured for, see set_steps.
     """
-    def __init__(self, layers, name=None):
+    def __init__(self, layers, name=None, recompute_segment=None):
         super(Sequential, self).__init__(name)
 
+        self.recompute_segment = recompute_segment
+        self.segments = []
+        self.nsteps = None
+        self.step_states = None
         self.layers = [l for l in flatten(layers)]
         self._layers = filter(lambda x: type(x) not in (BranchNode,), self.layers)
         root = self._layers[0]
@@ -130,15 +196,213 @@ class Sequential(LayerContainer):
             prev_layer = l
         self.parallelism = in_obj.parallelism
         self.out_shape = in_obj.out_shape
+
+        # number of steps of the sequences the layers currently run on
+        self.step_states = None
+        root = self.layers[0]
+        if isinstance(root, LookupTable):
+            self.nsteps = root.nin
+        elif isinstance(root, Recurrent):
+            self.nsteps = root.nsteps
+        else:
+            self.nsteps = None
         return self
 
+    def input_steps(self, inputs):
+        """
+        Number of steps of the sequences of a minibatch for the root layer.
+        """
+        if isinstance(self.layers[0], LookupTable):
+            return inputs.shape[0]
+        return inputs.shape[1] // self.be.bsz
+
+    def set_steps(self, nsteps):
+        """
+        Run the layers working on sequences, from the root lookup table or
+        recurrent layer to the recurrent output layer collapsing the steps,
+        over sequences of nsteps steps.  The model must be configured for the
+        longest sequences.  fprop calls this when the length of the input
+        sequences changes, as with the minibatches of a BucketIterator.
+
+        The layers are configured and allocated again the first time a number
+        of steps is seen, and their buffers are kept, so switching between the
+        lengths of the buckets only swaps the buffers.  The weights are
+        shared.  Recurrent layers do not carry their state over a switch.
+
+        Arguments:
+            nsteps (int): number of steps of the sequences
+        """
+        if self.step_states is None:
+            nlayers = next((i + 1 for i, l in enumerate(self.layers)
+                            if isinstance(l, RecurrentOutput)), None)
+            if nlayers is None or not all(isinstance(l, sequence_layers)
+                                          for l in self.layers[:nlayers]):
+                raise ValueError("Changing the number of steps needs layers in %s "
+                                 "up to a recurrent output layer" %
+                                 str([c.__name__ for c in sequence_layers]))
+            self.step_layers = self.layers[:nlayers]
+            self.max_steps = self.nsteps
+            self.step_states = {self.nsteps: [dict() for l in self.step_layers]}
+        if nsteps > self.max_steps:
+            raise ValueError("Sequences of %d steps are longer than the %d steps the model "
+                             "was configured for" % (nsteps, self.max_steps))
+
+        # put away the buffers of the current length, the views built from
+        # the inputs and deltas of a minibatch are rebuilt
+        for l, state in zip(self.step_layers, self.step_states[self.nsteps]):
+            for k in state:
+                state[k] = l.__dict__[k]
+            for k in ('x', 'in_deltas'):
+                if k in l.__dict__:
+                    setattr(l, k, None)
+
+        if nsteps in self.step_states:
+            for l, state in zip(self.step_layers, self.step_states[nsteps]):
+                l.__dict__.update(state)
+        else:
+            self.allocate_steps(nsteps)
+        self.nsteps = nsteps
+
+    def allocate_steps(self, nsteps):
+        """
+        Configure and allocate the layers of set_steps for nsteps steps, and
+        record the attributes this changes as the state of that length.
+        """
+        befores = [dict(l.__dict__) for l in self.step_layers]
+        root = self.step_layers[0]
+        in_obj = nsteps if isinstance(root, LookupTable) else (root.in_shape[0], nsteps)
+        for l in self.step_layers:
+            for k in ('outputs', 'inputs', 'outputs_t', 'deltas'):
+                if k in l.__dict__:
+                    setattr(l, k, None)
+            in_obj = l.configure(in_obj)
+            l.allocate()
+        # the same alternation of the delta buffers as allocate_deltas
+        if getattr(self, 'deltas_order', None):
+            delta_buffers = list(self.deltas_order)
+            for l in self.step_layers:
+                l.set_deltas(delta_buffers)
+
+        states = [dict() for l in self.step_layers]
+        for i, (l, before) in enumerate(zip(self.step_layers, befores)):
+            for k, v in l.__dict__.items():
+                if k in ('x', 'in_deltas') or (k in before and before[k] is v):
+                    continue
+                states[i][k] = v
+                # the other lengths keep the value from before
+                for other in self.step_states.values():
+                    other[i].setdefault(k, before.get(k))
+        self.step_states[nsteps] = states
+
+    def fold_batch_norm(self):
+        """
+        Fold each batch norm layer directly following a Linear or Convolution
+        layer into the weights of that layer for inference, and replace it by
+        a bias layer working in place (see BatchNorm.fold).  This saves the
+        normalization pass over the activations, and its output buffer.  The
+        outputs are those of fprop with inference=True, as the global
+        statistics are folded.
+
+        Returns:
+            int: number of batch norm layers folded
+        """
+        nfolded = super(Sequential, self).fold_batch_norm()
+        layers = []
+        for l in self.layers:
+            prev = layers[-1] if layers else None
+            if type(l) is BatchNorm and type(prev) in (Linear, Convolution):
+                bias = l.fold(prev)
+                if getattr(l, 'in_shape', None) is not None:
+                    # already configured, link the bias in place of the batch norm
+                    bias.configure(prev)
+                    prev.set_next(bias)
+                    bias.set_next(l.next_layer)
+                    if l.next_layer is not None and l.next_layer.prev_layer is l:
+                        l.next_layer.prev_layer = bias
+                    bias.allocate()
+                l = bias
+                nfolded += 1
+            layers.append(l)
+
+        self.layers = layers
+        self._layers = filter(lambda x: type(x) not in (BranchNode,), self.layers)
+        return nfolded
+
     def allocate(self, shared_outputs=None):
         # get the layers that own their outputs
         alloc_layers = [l for l in self.layers if l.owns_output]
         alloc_layers[-1].allocate(shared_outputs)
+        if self.recompute_segment:
+            self.allocate_segments()
         for l in self.layers:
             l.allocate()
 
+    def plan_segments(self):
+        """
+        Split the layers into the segments recomputed during bprop.
+
+        Returns:
+            list: segments, each a list of groups of layers (an owning layer
+                  followed by the layers working in place on its outputs)
+        """
+        groups = []
+        for l in self.layers:
+            if not groups or l.owns_output:
+                groups.append([])
+            groups[-1].append(l)
+
+        def recomputable(group):
+            # layers summing their outputs for a following batch norm are not
+            # rerun, as the batch norm turns the sums into means in place
+            return (group[0].owns_output and
+                    getattr(group[0], 'batch_sum_shape', None) is None and
+                    all(isinstance(l, recomputable_layers) for l in group))
+
+        nrecompute = sum(1 for g in groups[:-1] if recomputable(g))
+        seglen = self.recompute_segment
+        if seglen == 'auto':
+            seglen = int(np.ceil(np.sqrt(nrecompute)))
+
+        # a recomputable group after a full segment keeps its outputs as a
+        # checkpoint, the last group always does since they are the outputs
+        segments, run = [], []
+        for group in groups[:-1]:
+            if recomputable(group) and len(run) < seglen:
+                run.append(group)
+            else:
+                if run:
+                    segments.append(run)
+                run = []
+        if run:
+            segments.append(run)
+        return segments
+
+    def allocate_segments(self):
+        """
+        Point the outputs of the recomputed layers into scratch buffers shared
+        by all the segments, the i-th group of each segment using the i-th
+        buffer.
+        """
+        self.segments = self.plan_segments()
+        if not self.segments:
+            return
+        owners = [[group[0] for group in seg] for seg in self.segments]
+        sizes = [max(np.prod(seg[i].out_shape) for seg in owners if i < len(seg))
+                 for i in range(max(len(seg) for seg in owners))]
+        self.scratch = [self.be.iobuf(size, parallelism=self.parallelism) for size in sizes]
+        for seg in owners:
+            for l, buf in zip(seg, self.scratch):
+                if l.outputs is None:
+                    l.outputs = self.be.iobuf(l.out_shape, shared=buf,
+                                              parallelism=l.parallelism)
+
+        # rerun each segment before the bprop of the layer reading its outputs
+        self.recompute_before = {}
+        for seg in self.segments:
+            last = seg[-1][-1]
+            self.recompute_before[self.layers[self.layers.index(last) + 1]] = \
+                [l for group in seg for l in group]
+
     def allocate_deltas(self, global_deltas=None):
         def needs_extra_delta(ll):
             return True if issubclass(ll.__class__, Broadcast) else False
@@ -155,6 +419,8 @@ class Sequential(LayerContainer):
         else:
             self.global_deltas = global_deltas
 
+        # order of the buffers before the layers alternate them
+        self.deltas_order = list(self.global_deltas) if self.global_deltas else None
         for l in self.layers:
             l.set_deltas(self.global_deltas)
 
@@ -162,6 +428,11 @@ class Sequential(LayerContainer):
         """
         TODO:  Handle final layers that don't own their own outputs (bias, activation)
         """
+        if self.nsteps is not None:
+            nsteps = self.input_steps(inputs)
+            if nsteps != self.nsteps:
+                self.set_steps(nsteps)
+
         x = inputs
         if inference:
             inference_revert_list = []
@@ -186,8 +457,23 @@ class Sequential(LayerContainer):
 
         return x
 
+    def recompute(self, layers):
+        """
+        Rerun fprop over a segment of layers, starting from the inputs its
+        first layer saw during fprop.
+        """
+        x = layers[0].inputs
+        for l in layers:
+            altered_tensor = l.be.distribute_data(x, l.parallelism)
+            if altered_tensor:
+                l.revert_list.append(altered_tensor)
+            x = l.fprop(x)
+
     def bprop(self, error, alpha=1.0, beta=0.0):
         for l in reversed(self._layers):
+            if self.segments and l in self.recompute_before:
+                self.recompute(self.recompute_before[l])
+
             altered_tensor = l.be.distribute_data(error, l.parallelism)
             if altered_tensor:
                 l.revert_list.append(altered_tensor)
@@ -657,6 +943,130 @@ class RoiPooling(Sequential):
         return terminals
 
 
+class _Activation(object):
+    """
+    An activation in an ActivationPlan: the layer (or merging container)
+    owning it, its size per example and the steps it is live for.
+    """
+    def __init__(self, owner, size, step):
+        self.owner = owner
+        self.size = size
+        self.start = self.end = step
+        self.buffer = None
+
+
+class ActivationPlan(object):
+    """
+    Liveness analysis of the activations of a configured layer container
+    during inference, used to share buffers between activations.
+
+    The layers are walked in the order fprop runs them, recording for every
+    layer that owns its output the step the output is written and the last
+    step it is read.  Layers working in place (bias, activation, branch
+    nodes, ...) extend the live range of their input, branch node outputs
+    are live until the branches of a Tree read them, the input of a merging
+    container until its last branch has read it, and the outputs of the
+    container until the end.  Activations with disjoint live ranges are then
+    greedily assigned the same buffer.
+
+    Recurrent layers carrying their state over to the next minibatch and
+    containers not handled here (e.g. RoiPooling) keep their own outputs.
+
+    Arguments:
+        container (LayerContainer): configured container to plan
+
+    Attributes:
+        activations (list): the shared activations, with the index of their
+                            buffer
+        buffer_sizes (list): size per example of each buffer
+    """
+    def __init__(self, container):
+        self.step = 0
+        self.activations = []
+        self.branches = {}
+
+        outputs = self.walk(container, None)
+        for act in outputs if isinstance(outputs, list) else [outputs]:
+            if act is not None:
+                act.end = float('inf')
+        self.assign()
+
+    def new(self, owner):
+        act = _Activation(owner, int(np.prod(owner.out_shape)), self.step)
+        self.activations.append(act)
+        return act
+
+    def use(self, act):
+        if act is not None:
+            act.end = max(act.end, self.step)
+
+    def walk(self, l, x, out=None):
+        """
+        Walk layer or container l, with input activation x.  If out is given,
+        l writes its output into it (the last layer of a branch of a merging
+        container).  Returns the output activation.
+        """
+        if isinstance(l, MergeMultistream):
+            # the branches read the inputs directly from the dataset
+            merged = out if out is not None else self.new(l)
+            for branch in l.layers:
+                self.walk_sequential(branch, None, merged)
+            return merged
+        if isinstance(l, Broadcast):
+            merged = out if out is not None else self.new(l)
+            for branch in l.layers:
+                self.walk_sequential(branch, x, merged)
+            return merged
+        if isinstance(l, SingleOutputTree):
+            # only the trunk is run for inference
+            return [self.walk_sequential(l.layers[0], x)]
+        if isinstance(l, Tree):
+            return ([self.walk_sequential(l.layers[0], x)] +
+                    [self.walk_sequential(b, None) for b in l.layers[1:]])
+        if type(l) is Sequential:
+            return self.walk_sequential(l, x, out)
+
+        if type(l) is BranchNode:
+            # remember the activation at the branch point for the branches
+            if x is None:
+                x = self.branches[l]
+            else:
+                self.branches[l] = x
+        self.use(x)
+        if isinstance(l, LayerContainer) or not getattr(l, 'reset_cells', True):
+            x = None  # allocated as usual
+        elif l.owns_output and type(l) is not ColorNoise:
+            x = out if out is not None else self.new(l)
+        self.step += 1
+        return x
+
+    def walk_sequential(self, seq, x, out=None):
+        last = [l for l in seq.layers if l.owns_output][-1] if out is not None else None
+        for l in seq.layers:
+            x = self.walk(l, x, out if l is last else None)
+        self.use(x)
+        return x
+
+    def assign(self):
+        """
+        Assign the activations to buffers, reusing the buffer whose size is
+        closest to that needed among those free over the live range.
+        """
+        self.buffer_sizes = []
+        busy_until = []
+        for act in sorted(self.activations, key=lambda a: a.start):
+            free = [b for b, end in enumerate(busy_until) if end < act.start]
+            if free:
+                act.buffer = min(free, key=lambda b: (self.buffer_sizes[b] < act.size,
+                                                      abs(self.buffer_sizes[b] - act.size)))
+                self.buffer_sizes[act.buffer] = max(self.buffer_sizes[act.buffer], act.size)
+                busy_until[act.buffer] = act.end
+            else:
+                act.buffer = len(self.buffer_sizes)
+                self.buffer_sizes.append(act.size)
+                busy_until.append(act.end)
+
+
 class Multicost(NervanaObject):
     """
     Class used to compute cost from a Tree container with multiple outputs.
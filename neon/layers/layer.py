@@ -18,6 +18,7 @@ import numpy as np
 from neon import NervanaObject
 from neon.backends import Autodiff
 from neon.backends.backend import Tensor
+from neon.initializers.initializer import Constant
 from neon.util.persist import load_class
 
 
@@ -410,8 +411,8 @@ class Pooling(Layer):
             self.out_shape = (K, M, P, Q) if len(self.in_shape) == 4 else (K, P, Q)
         return self
 
-    def set_deltas(self, delta_buffers):
-        super(Pooling, self).set_deltas(delta_buffers)
+    def allocate(self, shared_outputs=None):
+        super(Pooling, self).allocate(shared_outputs)
         if self.op == "max":
             self.argmax = self.be.empty(self.outputs.shape, dtype=np.uint8)
         else:
@@ -495,6 +496,17 @@ class ParameterLayer(Layer):
         """
         return ((self.W, self.dW), self.states)
 
+    def set_param_buffers(self, params):
+        """
+        Rebind the parameters, gradients and states to other tensors of the
+        same shapes, such as views of the buffers of an optimizer's
+        ParamArena.  Values are not copied.
+
+        Arguments:
+            params (tuple): ((W, dW), states), as returned by get_params
+        """
+        (self.W, self.dW), self.states = params
+
     def get_params_serialize(self, keep_states=True):
         return self.get_description(get_weights=True, keep_states=keep_states)
 
@@ -533,7 +545,7 @@ class ParameterLayer(Layer):
                 # this attr has already been allocated
                 # get set the values
                 attr.set(pdict['params'][key])
-            elif type(pdict['params'][key]) is np.ndarray:
+            elif isinstance(pdict['params'][key], np.ndarray):
                 setattr(self, key, self.be.array(pdict['params'][key], **self.get_param_attrs()))
             else:
                 setattr(self, key, pdict['params'][key])
@@ -1288,7 +1300,13 @@ class LookupTable(ParameterLayer):
 
     def bprop(self, error, alpha=1.0, beta=0):
         if self.update:
-            self.dW[:] = 0
+            # backends that produce a row sparse gradient only wrote the rows
+            # of the previous minibatch
+            rows = getattr(self.dW, 'sparse_rows', None)
+            if rows is None:
+                self.dW[:] = 0
+            else:
+                self.dW[rows] = 0
             self.be.compound_bprop_lut(self.nin, self.inputs, error, self.outputs_t,
                                        self.dW, self.pad_idx, alpha, beta)
 
@@ -1523,6 +1541,41 @@ class BatchNorm(Layer):
         self.y[:] = self.y * beta + xhat * self.gamma + self.beta
         return self.outputs
 
+    def fold(self, layer):
+        """
+        Fold the inference transformation into the weights of the Linear or
+        Convolution layer feeding this one: the weights of each output feature
+        are scaled by gamma / sqrt(gvar + eps), and the shift left over is
+        returned as a bias layer to use in place of this one.  The layer stops
+        computing batch sums, as nothing consumes them anymore.
+
+        Arguments:
+            layer (Linear, Convolution): layer with trained weights whose
+                                         outputs are normalized by this one
+
+        Returns:
+            Bias: layer adding beta - gmean * gamma / sqrt(gvar + eps)
+        """
+        if self.allparams is None or layer.W is None:
+            raise ValueError("Batch norm can only be folded with trained parameters")
+        scale = self.gamma.get() / np.sqrt(self.gvar.get() + self.eps)
+        shift = self.beta.get() - self.gmean.get() * scale
+
+        W = layer.W.get()
+        if isinstance(layer, Convolution):
+            W *= scale.T  # (C * R * S, K)
+            layer.convparams['bsum'] = False
+        else:
+            W *= scale  # (nout, nin)
+        layer.W.set(W)
+        layer.bsum = False
+        layer.batch_sum_shape = layer.batch_sum = None
+
+        bias = Bias(init=Constant(), name=layer.name + '_bias')
+        bias.parallelism = layer.parallelism
+        bias.set_params({'params': {'W': shift}})
+        return bias
+
     def bprop(self, error):
         """
         Compute gradients for learning gamma and beta as well as layer weights.
@@ -1538,6 +1591,18 @@ class BatchNorm(Layer):
     def get_params(self):
         return self.plist
 
+    def set_param_buffers(self, params):
+        """
+        Rebind beta, gamma, their gradients and states, see
+        ParameterLayer.set_param_buffers.
+        """
+        self.params = [p for (p, g), s in params]
+        self.grad_params = [g for (p, g), s in params]
+        self.states = [s for (p, g), s in params]
+        (self.beta, self.gamma) = self.params
+        (self.grad_beta, self.grad_gamma) = self.grad_params
+        self.allparams = self.params + self.inf_params
+
     def get_params_serialize(self, keep_states=True):
         return self.get_description(get_weights=True, keep_states=keep_states)
 
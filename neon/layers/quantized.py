@@ -0,0 +1,232 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Int8 quantized versions of the Linear, Convolution and LookupTable layers, for
+inference.  See Model.quantize.
+"""
+import numpy as np
+
+from neon import get_args
+from neon.layers.layer import Linear, Convolution, LookupTable
+from neon.util.persist import load_class
+
+
+class QuantizedLayer(object):
+
+    """
+    Mixin of the layers running with int8 weights, quantized symmetrically
+    with one step per output feature (w_scale), for inference only.
+
+    A layer built from float weights runs as the float layer until quantize
+    is called, recording the largest input magnitude it sees, so that running
+    the model on a few minibatches calibrates the step the inputs are rounded
+    to int8 with (x_scale).
+
+    Attributes:
+        feature_axis (int): axis of the weights holding the output features
+        quantize_inputs (bool): whether the inputs are rounded to int8
+    """
+    feature_axis = 0
+    quantize_inputs = True
+    w_scale = None
+    x_max = 0.0
+
+    def __init__(self, *args, **kwargs):
+        super(QuantizedLayer, self).__init__(*args, **kwargs)
+        # not trained by the optimizers
+        self.has_params = False
+
+    @property
+    def quantized(self):
+        return self.w_scale is not None
+
+    def calibrate(self, inputs):
+        """
+        Record the largest input magnitude, before quantization.
+        """
+        if self.quantize_inputs:
+            self.x_max = max(self.x_max, float(np.abs(inputs.get()).max()))
+
+    def quantize(self):
+        """
+        Round the float weights to int8 and set the input step from the
+        calibration.  The float weights are released.
+        """
+        if self.quantized:
+            return
+        W = self.W.get()
+        w_max = np.abs(W).max(axis=1 - self.feature_axis, keepdims=True)
+        w_scale = np.where(w_max > 0, w_max / 127., 1.).astype(np.float32)
+        Wq = np.clip(np.rint(W / w_scale), -127, 127)
+        self.W = self.be.array(Wq, dtype=np.int8)
+        self.w_scale = self.be.array(w_scale.reshape((-1, 1)))
+        self.dW = None
+        if self.quantize_inputs and self.x_scale is None:
+            self.x_scale = self.x_max / 127. if self.x_max > 0 else 1.
+
+    def set_params(self, pdict):
+        params = pdict['params']
+        if 'w_scale' in params:
+            self.W = self.be.array(params['W'], dtype=np.int8)
+            self.w_scale = self.be.array(params['w_scale'])
+        else:
+            # float weights, to calibrate and quantize
+            super(QuantizedLayer, self).set_params(pdict)
+
+    def get_description(self, get_weights=False, keep_states=True):
+        serial_dict = super(QuantizedLayer, self).get_description()
+        if get_weights:
+            serial_dict['params'] = {'W': self.W.get()}
+            if self.quantized:
+                serial_dict['params']['w_scale'] = self.w_scale.get()
+        return serial_dict
+
+    def bprop(self, error, alpha=1.0, beta=0.0):
+        raise ValueError("Quantized layer %s is for inference only" % self.name)
+
+
+class QuantizedLinear(QuantizedLayer, Linear):
+
+    """
+    Linear layer with int8 weights.  The inputs are rounded to int8 with the
+    step x_scale, and the products accumulated in int32.
+
+    Arguments:
+        nout (int, tuple): Desired size or shape of layer output
+        x_scale (float, optional): quantization step of the inputs, set by
+                                   calibration when None
+        name (str, optional): Layer name. Defaults to "QuantizedLinearLayer"
+    """
+
+    def __init__(self, nout, x_scale=None, name=None):
+        super(QuantizedLinear, self).__init__(nout, init=None, name=name)
+        self.x_scale = x_scale
+
+    def fprop(self, inputs, inference=False, beta=0.0):
+        if not self.quantized:
+            self.calibrate(inputs)
+            return super(QuantizedLinear, self).fprop(inputs, inference, beta)
+        self.inputs = inputs
+        self.be.compound_dot_int8(self.W, inputs, self.outputs, self.w_scale, self.x_scale,
+                                  beta=beta)
+        return self.outputs
+
+
+class QuantizedConvolution(QuantizedLayer, Convolution):
+
+    """
+    Convolution layer with int8 filters.  The inputs are rounded to int8 with
+    the step x_scale, and the products accumulated in int32.
+
+    Arguments:
+        fshape (tuple(int)): three dimensional shape of convolution window
+        strides (int, dict, optional): strides to apply convolution window over
+        padding (int, dict, optional): padding to apply to edges of input
+        x_scale (float, optional): quantization step of the inputs, set by
+                                   calibration when None
+        name (str, optional): layer name. Defaults to "QuantizedConvolutionLayer"
+    """
+    feature_axis = 1  # (C * R * S, K)
+
+    def __init__(self, fshape, strides={}, padding={}, x_scale=None, name=None,
+                 parallelism="Data"):
+        super(QuantizedConvolution, self).__init__(fshape, strides, padding, init=None,
+                                                   name=name, parallelism=parallelism)
+        self.x_scale = x_scale
+
+    def fprop(self, inputs, inference=False, beta=0.0):
+        if not self.quantized:
+            self.calibrate(inputs)
+            return super(QuantizedConvolution, self).fprop(inputs, inference, beta)
+        self.inputs = inputs
+        self.be.fprop_conv_int8(self.nglayer, inputs, self.W, self.outputs, self.w_scale,
+                                self.x_scale, beta=beta)
+        return self.outputs
+
+
+class QuantizedLookupTable(QuantizedLayer, LookupTable):
+
+    """
+    LookupTable layer with int8 embeddings, with one step per word.
+
+    Arguments:
+        vocab_size (int) : Number of words in the vocabulary
+        embedding_dim (int) : Size of the word embedding
+        pad_idx (int, optional): index of the padding word
+        name (str, optional): Layer name. Defaults to "QuantizedLookupTableLayer"
+    """
+    quantize_inputs = False
+
+    def __init__(self, vocab_size, embedding_dim, pad_idx=None, name=None):
+        super(QuantizedLookupTable, self).__init__(vocab_size, embedding_dim, init=None,
+                                                   update=False, pad_idx=pad_idx, name=name)
+
+    def allocate(self, shared_outputs=None):
+        # no gradient to set up
+        super(LookupTable, self).allocate(shared_outputs)
+        if self.inputs is None:
+            self.inputs = self.be.zeros((1, self.nin * self.be.bsz), dtype=np.int32)
+        if self.outputs_t is None:
+            self.outputs_t = self.be.empty_like(self.outputs.T)
+
+    def fprop(self, inputs, inference=False):
+        if not self.quantized:
+            return super(QuantizedLookupTable, self).fprop(inputs, inference)
+        self.inputs[:] = inputs.reshape(self.inputs.shape)
+        self.outputs_t[:] = self.W.take(self.inputs, axis=0)
+        self.outputs_t[:] = self.outputs_t * self.w_scale.take(self.inputs, axis=0)
+        self.outputs[:] = self.outputs_t.T
+        return self.outputs
+
+
+quantized_classes = {Linear: QuantizedLinear,
+                     Convolution: QuantizedConvolution,
+                     LookupTable: QuantizedLookupTable}
+
+
+def quantize_description(pdict):
+    """
+    Rewrite in place the description of a layer or container, with its
+    weights, to use the quantized layers in place of the float ones.
+
+    Arguments:
+        pdict (dict): description from get_description(get_weights=True)
+
+    Returns:
+        int: number of layers replaced
+    """
+    if pdict.get('container'):
+        return sum(quantize_description(l) for l in pdict['config']['layers'])
+    qcls = quantized_classes.get(load_class(pdict['type']))
+    if qcls is None:
+        return 0
+    args = get_args(qcls.__init__)
+    pdict['type'] = qcls.__module__ + '.' + qcls.__name__
+    pdict['config'] = {k: v for k, v in pdict['config'].items() if k in args}
+    pdict.pop('states', None)
+    return 1
+
+
+def quantized_layers(container):
+    """
+    Quantized layers of a container and of the containers it holds.
+    """
+    layers = []
+    for l in container.layers:
+        if hasattr(l, 'layers'):
+            layers += quantized_layers(l)
+        elif isinstance(l, QuantizedLayer):
+            layers.append(l)
+    return layers
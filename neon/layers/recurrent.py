@@ -69,6 +69,7 @@ class Recurrent(ParameterLayer):
         self.ngates = 1
         self.reset_cells = reset_cells
         self.init_inner = init_inner
+        self.step_buffers = dict()
 
     def configure(self, in_obj):
         super(Recurrent, self).configure(in_obj)
@@ -83,6 +84,9 @@ class Recurrent(ParameterLayer):
         super(Recurrent, self).allocate(shared_outputs)
         self.h = get_steps(self.outputs, self.out_shape)
         self.h_prev = self.h[-1:] + self.h[:-1]
+        # copy of the state carried over from the previous minibatch, since the
+        # hoisted input projection overwrites the whole output buffer
+        self.h_init = self.be.iobuf(self.nout)
         # State deltas
         self.h_delta = get_steps(self.be.iobuf(self.out_shape), self.out_shape)
         self.bufs_to_reset = [self.outputs]
@@ -159,6 +163,11 @@ class Recurrent(ParameterLayer):
         self.dW_recur = self.dW[nin:-1].reshape(self.W_recur.shape)
         self.db = self.dW[-1:].reshape(self.b.shape)
 
+    def set_param_buffers(self, params):
+        super(Recurrent, self).set_param_buffers(params)
+        # views of the gates on the new buffers
+        self.init_params(self.weight_shape)
+
     def fprop(self, inputs, inference=False):
         """
         Forward propagation of input to recurrent layer.
@@ -191,13 +200,60 @@ class Recurrent(ParameterLayer):
         # recurrent layer needs a h_prev buffer for bprop
         self.h_prev_bprop = [0] + self.h[:-1]
 
-        for (h, h_prev, xs) in zip(self.h, self.h_prev, self.xs):
-            self.be.compound_dot(self.W_input, xs, h)
+        # input projection for all time steps in a single GEMM
+        self.h_init[:] = self.h[-1]
+        self.be.compound_dot(self.W_input, self.x, self.outputs)
+
+        for (h, h_prev) in zip(self.h, [self.h_init] + self.h[:-1]):
             self.be.compound_dot(self.W_recur, h_prev, h, beta=1.0)
             h[:] = self.activation(h + self.b)
 
         return self.outputs
 
+    def init_step_state(self, ncols):
+        """
+        Allocate the state fprop_step carries from one step to the next, for
+        ncols independent sequences.
+
+        Arguments:
+            ncols (int): number of sequences
+
+        Returns:
+            list: zeroed state Tensors (output_size, ncols), the hidden state
+                  first
+        """
+        return [self.be.zeros((self.nout, ncols))]
+
+    def step_buffer(self, name, nrows, ncols):
+        """
+        Scratch buffer used by fprop_step, cached per number of columns.
+        """
+        key = (name, ncols)
+        if key not in self.step_buffers:
+            self.step_buffers[key] = self.be.empty((nrows, ncols))
+        return self.step_buffers[key]
+
+    def fprop_step(self, x, state):
+        """
+        Run a single time step on a state allocated by init_step_state, for
+        incremental use where the input of a step is only known once the
+        previous one is done.  Unlike fprop, the number of columns is not
+        tied to the batch size.
+
+        Arguments:
+            x (Tensor): input for the step (input_size, ncols)
+            state (list): state Tensors, updated in place
+
+        Returns:
+            Tensor: the new hidden state
+        """
+        h = state[0]
+        hx = self.step_buffer('h', self.nout, h.shape[1])
+        self.be.compound_dot(self.W_input, x, hx)
+        self.be.compound_dot(self.W_recur, h, hx, beta=1.0)
+        h[:] = self.activation(hx + self.b)
+        return h
+
     def bprop(self, deltas, alpha=1.0, beta=0.0):
         """
         Backward propagation of errors through recurrent layer.
@@ -352,12 +408,14 @@ class LSTM(Recurrent):
             self.h[-1][:] = 0
             self.c[-1][:] = 0
 
-        params = (self.h, self.h_prev, self.xs, self.ifog, self.ifo,
+        # input projection for all time steps in a single GEMM
+        self.be.compound_dot(self.W_input, self.x, self.ifog_buffer)
+
+        params = (self.h, self.h_prev, self.ifog, self.ifo,
                   self.i, self.f, self.o, self.g, self.c, self.c_prev, self.c_act)
 
-        for (h, h_prev, xs, ifog, ifo, i, f, o, g, c, c_prev, c_act) in zip(*params):
-            self.be.compound_dot(self.W_recur, h_prev, ifog)
-            self.be.compound_dot(self.W_input, xs, ifog, beta=1.0)
+        for (h, h_prev, ifog, ifo, i, f, o, g, c, c_prev, c_act) in zip(*params):
+            self.be.compound_dot(self.W_recur, h_prev, ifog, beta=1.0)
             ifog[:] = ifog + self.b
 
             ifo[:] = self.gate_activation(ifo)
@@ -369,6 +427,33 @@ class LSTM(Recurrent):
 
         return self.outputs
 
+    def init_step_state(self, ncols):
+        """
+        Allocate the hidden and cell states carried by fprop_step.
+        """
+        return [self.be.zeros((self.nout, ncols)), self.be.zeros((self.nout, ncols))]
+
+    def fprop_step(self, x, state):
+        """
+        Run a single time step, see Recurrent.fprop_step.
+        """
+        h, c = state
+        nout = self.nout
+        ifog = self.step_buffer('ifog', nout * 4, h.shape[1])
+        ifo, g = ifog[:nout * 3], ifog[nout * 3:]
+        i, f, o = ifog[:nout], ifog[nout:nout * 2], ifog[nout * 2:nout * 3]
+
+        self.be.compound_dot(self.W_input, x, ifog)
+        self.be.compound_dot(self.W_recur, h, ifog, beta=1.0)
+        ifog[:] = ifog + self.b
+
+        ifo[:] = self.gate_activation(ifo)
+        g[:] = self.activation(g)
+
+        c[:] = f * c + i * g
+        h[:] = o * self.activation(c)
+        return h
+
     def bprop(self, deltas, alpha=1.0, beta=0.0):
         """
         Backpropagation of errors, output delta for previous layer, and
@@ -588,12 +673,12 @@ class GRU(Recurrent):
             self.rz[-1][:] = 0
             self.hcan[-1][:] = 0
 
-        for (h, h_prev, rh_prev, xs, rz, r, z, hcan, rz_rec, hcan_rec, rzhcan) in zip(
-                self.h, self.h_prev, self.rh_prev, self.xs, self.rz, self.r,
-                self.z, self.hcan, self.rz_rec, self.hcan_rec, self.rzhcan):
+        # computes r, z, hcan from inputs for all time steps in a single GEMM
+        self.be.compound_dot(self.W_input, self.x, self.rzhcan_buffer)
 
-            # computes r, z, hcan from inputs
-            self.be.compound_dot(self.W_input, xs, rzhcan)
+        for (h, h_prev, rh_prev, rz, r, z, hcan, rz_rec, hcan_rec) in zip(
+                self.h, self.h_prev, self.rh_prev, self.rz, self.r,
+                self.z, self.hcan, self.rz_rec, self.hcan_rec):
 
             # computes r, z, hcan from recurrents
             self.be.compound_dot(self.Wrz_recur, h_prev, rz_rec)
@@ -606,6 +691,28 @@ class GRU(Recurrent):
 
         return self.outputs
 
+    def fprop_step(self, x, state):
+        """
+        Run a single time step, see Recurrent.fprop_step.
+        """
+        h = state[0]
+        nout, ncols = self.nout, h.shape[1]
+        rzhcan = self.step_buffer('rzhcan', nout * 3, ncols)
+        rz_rec = self.step_buffer('rz_rec', nout * 2, ncols)
+        rh_prev = self.step_buffer('rh_prev', nout, ncols)
+        hcan_rec = self.step_buffer('hcan_rec', nout, ncols)
+        rz, r, z, hcan = rzhcan[:nout * 2], rzhcan[:nout], rzhcan[nout:nout * 2], rzhcan[nout * 2:]
+
+        self.be.compound_dot(self.W_input, x, rzhcan)
+        self.be.compound_dot(self.Wrz_recur, h, rz_rec)
+        rz[:] = self.gate_activation(rz + rz_rec + self.b_rz)
+        rh_prev[:] = r * h
+        self.be.compound_dot(self.Whcan_recur, rh_prev, hcan_rec)
+
+        hcan[:] = self.activation(hcan_rec + hcan + self.b_hcan)
+        h[:] = (1 - z) * h + z * hcan
+        return h
+
     def bprop(self, deltas, alpha=1.0, beta=0.0):
         """
         Backpropagation of errors, output delta for previous layer, and calculate the update on
@@ -970,6 +1077,11 @@ class BiRNN(ParameterLayer):
             self.b_f.fill(0.)
             self.b_b.fill(0.)
 
+    def set_param_buffers(self, params):
+        super(BiRNN, self).set_param_buffers(params)
+        # views of the directions on the new buffers
+        self.init_params(self.weight_shape)
+
     def fprop(self, inputs, inference=False):
         """
         Forward propagation of input to bi-directional recurrent layer.
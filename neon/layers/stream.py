@@ -0,0 +1,214 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Streaming inference of recurrent models, a few time steps at a time.
+"""
+import numpy as np
+
+from neon import NervanaObject
+from neon.layers.layer import Linear, Bias, Activation, Dropout, BatchNorm, LookupTable
+from neon.layers.recurrent import Recurrent
+from neon.layers.quantized import QuantizedLayer
+
+
+class StreamRunner(NervanaObject):
+    """
+    Runs initialized layers over one or a few time steps at a time for a
+    batch of independent streams, carrying the state of the recurrent layers
+    of every stream over from one call to the next.
+
+    Unlike fprop, which always runs the sequence length and batch size the
+    model was initialized with, each call only costs the steps it is given,
+    so feeding a stream token by token has a constant latency per token.
+    The state of each stream is kept by stream id: the streams of a call can
+    be any subset of the known ones, in any order, and new ids start from a
+    zero state.
+
+    The parameters are shared with the layers, the buffers are not, so
+    streaming does not disturb the state of a model also used with fprop.
+    Supported are the Recurrent, LSTM and GRU layers and the layers that
+    apply to every step on its own: Linear, Bias, Activation, Dropout,
+    BatchNorm (with its global statistics) and LookupTable.
+
+    Arguments:
+        layers (list): initialized layers, in fprop order
+    """
+
+    def __init__(self, layers):
+        supported = (Linear, Bias, Activation, Dropout, BatchNorm, LookupTable, Recurrent)
+        for l in layers:
+            if not isinstance(l, supported) or isinstance(l, QuantizedLayer):
+                raise ValueError("Layer %s is not supported for streaming" % l.name)
+        self.layers = layers
+        self.recurrent = [l for l in layers if isinstance(l, Recurrent)]
+        self.buffers = dict()
+        # ids of the streams whose state is in self.state, one column each
+        self.streams = ()
+        self.state = None
+        # state of the other streams, by id
+        self.saved = dict()
+
+    def buffer(self, key, shape, dtype=None):
+        """
+        Buffer cached by key, the number of columns is part of the key.
+        """
+        if key not in self.buffers:
+            self.buffers[key] = self.be.empty(shape, dtype=dtype)
+        return self.buffers[key]
+
+    def fprop_layers(self, layers, x, states, nsteps=1):
+        """
+        Apply layers to a few time steps of input.
+
+        Arguments:
+            layers (list): layers to apply, from self.layers
+            x (Tensor): input (feature_size, nsteps * ncols), the columns of
+                        each step next to each other.  The input of a
+                        LookupTable is a row of word indices.
+            states (dict): state Tensors of each recurrent layer, as
+                           allocated by its init_step_state, updated in place
+            nsteps (int): number of time steps in x
+
+        Returns:
+            Tensor: output of the last layer, same column layout as x.  x
+                    itself is left unchanged.
+        """
+        x_in = x
+        for l in layers:
+            if x is x_in and isinstance(l, (Bias, Activation, Dropout, BatchNorm)):
+                # these work in place, on a copy of the input of the caller
+                out = self.buffer((l, x.shape[1]), x.shape, dtype=x.dtype)
+                out[:] = x
+                x = out
+
+            if isinstance(l, Recurrent):
+                ncols = x.shape[1]
+                out = self.buffer((l, ncols), (l.nout, ncols))
+                step = ncols // nsteps
+                for t in range(nsteps):
+                    cols = slice(t * step, (t + 1) * step)
+                    out[:, cols] = l.fprop_step(x[:, cols], states[l])
+                x = out
+            elif isinstance(l, LookupTable):
+                ncols = x.size
+                idx = self.buffer((l, 'idx', ncols), (1, ncols), dtype=np.int32)
+                out_t = self.buffer((l, 't', ncols), (ncols, l.embedding_dim))
+                out = self.buffer((l, ncols), (l.embedding_dim, ncols))
+                idx[:] = x.reshape((1, ncols))
+                out_t[:] = l.W.take(idx, axis=0)
+                out[:] = out_t.T
+                x = out
+            elif isinstance(l, Linear):
+                ncols = x.shape[1]
+                out = self.buffer((l, ncols), (l.nout, ncols))
+                self.be.compound_dot(l.W, x, out)
+                x = out
+            elif isinstance(l, Bias):
+                x[:] = x + l.W
+            elif isinstance(l, Activation):
+                x[:] = l.transform(x)
+            elif isinstance(l, Dropout):
+                if not l.caffe_mode:
+                    x[:] = x * l.keep
+            elif isinstance(l, BatchNorm):
+                y = x.reshape((l.nfm, -1))
+                y[:] = (y - l.gmean) / self.be.sqrt(l.gvar + l.eps) * l.gamma + l.beta
+            else:
+                raise ValueError("Layer %s is not supported for streaming" % l.name)
+        return x
+
+    def fprop(self, x, streams):
+        """
+        Feed the next time steps of a batch of streams.
+
+        Arguments:
+            x (Tensor): input (feature_size, nsteps * len(streams)), the
+                        streams of each step in consecutive columns in the
+                        order of streams
+            streams (list): ids of the streams, any hashable values
+
+        Returns:
+            Tensor: output of the last layer for every step, laid out as x.
+                    It is overwritten by the next call.
+        """
+        streams = tuple(streams)
+        if len(set(streams)) != len(streams):
+            raise ValueError("Stream ids of a call must be unique")
+        ncols = x.size if isinstance(self.layers[0], LookupTable) else x.shape[1]
+        if ncols % len(streams) != 0:
+            raise ValueError("Input of %d columns does not split into steps of %d streams"
+                             % (ncols, len(streams)))
+        nsteps = ncols // len(streams)
+        self.load(streams)
+        return self.fprop_layers(self.layers, x, self.state, nsteps)
+
+    def load(self, streams):
+        """
+        Make the state of streams the active one, saving the state of the
+        previously active streams.  Nothing is copied when the streams are
+        the same as in the previous call.
+        """
+        if streams == self.streams:
+            return
+        self.save()
+        nstreams = len(streams)
+        self.state = dict()
+        for l in self.recurrent:
+            key = (l, 'state', nstreams)
+            if key not in self.buffers:
+                self.buffers[key] = l.init_step_state(nstreams)
+            self.state[l] = self.buffers[key]
+
+        for j, stream in enumerate(streams):
+            saved = self.saved.get(stream)
+            for l in self.recurrent:
+                for i, s in enumerate(self.state[l]):
+                    if saved is None:
+                        s[:, j:j + 1] = 0
+                    else:
+                        s[:, j:j + 1] = saved[l][i]
+        self.streams = streams
+
+    def save(self):
+        """
+        Copy the state of the active streams to their own buffers.
+        """
+        for j, stream in enumerate(self.streams):
+            if stream not in self.saved:
+                self.saved[stream] = dict((l, [self.be.empty((s.shape[0], 1)) for s in
+                                               self.state[l]]) for l in self.recurrent)
+            for l in self.recurrent:
+                for saved, s in zip(self.saved[stream][l], self.state[l]):
+                    saved[:] = s[:, j:j + 1]
+
+    def reset(self, streams=None):
+        """
+        Forget the state of streams, they start over from a zero state.
+
+        Arguments:
+            streams (list, optional): ids of the streams to reset, defaults
+                                      to all of them
+        """
+        if streams is None:
+            self.saved = dict()
+            self.streams = ()
+            return
+        for stream in streams:
+            self.saved.pop(stream, None)
+            if stream in self.streams:
+                j = self.streams.index(stream)
+                for l in self.recurrent:
+                    for s in self.state[l]:
+                        s[:, j:j + 1] = 0
@@ -21,7 +21,8 @@ from neon.backends.backend import Block
 from neon.transforms import CrossEntropyBinary, Logistic
 from neon.util.persist import load_obj, save_obj, load_class
 from neon.util.modeldesc import ModelDescription
-from neon.layers import Sequential, Activation, Tree, SingleOutputTree
+from neon.layers import Sequential, Activation, Tree, SingleOutputTree, StreamRunner
+from neon.layers.quantized import quantize_description, quantized_layers
 import numpy as np
 
 logger = logging.getLogger(__name__)
@@ -43,9 +44,16 @@ class Model(NervanaObject):
         name (str): Model name.  Defaults to "model"
         optimizer (Optimizer): Optimizer object which defines the learning rule
                                for updating model parameters (ie DescentMomentum, AdaDelta)
+        recompute_segment (int or str): if given, the outputs of the layers are
+                                        recomputed during bprop in segments of
+                                        this many layers instead of being kept
+                                        from fprop, to save memory (see
+                                        Sequential).  Only used when layers is
+                                        a list of layers or a Sequential.
     """
 
-    def __init__(self, layers, dataset=None, weights_only=False, name="model", optimizer=None):
+    def __init__(self, layers, dataset=None, weights_only=False, name="model", optimizer=None,
+                 recompute_segment=None):
         super(Model, self).__init__(name)
         self.optimizer = optimizer
         self.params = None  # should be able to remove
@@ -53,6 +61,8 @@ class Model(NervanaObject):
         self.epoch_index = 0
         self.finished = False
         self.initialized = False
+        self.inference_only = False
+        self.stream_runner = None
         self.cost = None
         self.nbatches = 0
         self.ndata = 0
@@ -71,6 +81,8 @@ class Model(NervanaObject):
                 self.layers = layers
             else:
                 self.layers = Sequential(layers)
+            if recompute_segment is not None and type(self.layers) is Sequential:
+                self.layers.recompute_segment = recompute_segment
         self.layers.propagate_parallelism("Data")
 
     @property
@@ -91,7 +103,20 @@ class Model(NervanaObject):
             # is thrown leave transform.shortcut as is (do nothing)
             pass
 
-    def initialize(self, dataset, cost=None):
+    def initialize(self, dataset, cost=None, inference=False):
+        """
+        Configure the layers for the dataset and allocate their buffers.
+
+        Arguments:
+            dataset (iterator): dataset (or shape) providing the input
+            cost (Cost, optional): cost to initialize with the output of the
+                                   layers
+            inference (bool, optional): only allocate what fprop needs for
+                                        inference: no delta buffers are
+                                        allocated and the activations share
+                                        buffers where their lifetimes allow
+                                        it.  Such a model cannot be trained.
+        """
         if self.initialized:
             return
 
@@ -104,10 +129,81 @@ class Model(NervanaObject):
             self.cost = cost
 
         # Now allocate space
-        self.layers.allocate()
-        self.layers.allocate_deltas()
+        if inference:
+            self.layers.allocate_inference()
+        else:
+            self.layers.allocate()
+            self.layers.allocate_deltas()
+        self.inference_only = inference
         self.initialized = True
 
+    def fold_batch_norm(self):
+        """
+        Folds the batch norm layers following Linear or Convolution layers
+        (as in Affine and Conv with batch_norm=True) into the weights and a
+        bias, to speed up inference.  The model must hold trained weights,
+        loaded or learned.  If it was already initialized, its buffers are
+        allocated again for inference only.
+
+        Returns:
+            int: number of batch norm layers folded
+        """
+        nfolded = self.layers.fold_batch_norm()
+        if nfolded and self.initialized:
+            self.layers.release_outputs()
+            self.layers.allocate_inference()
+            self.inference_only = True
+            self.stream_runner = None
+        return nfolded
+
+    def quantize(self, dataset, nbatches=None, eval_set=None, metric=None):
+        """
+        Post-training quantization for inference.  Returns a copy of the model
+        in which the Linear, Convolution and LookupTable layers run with int8
+        weights, with one quantization step per output feature, and int32
+        accumulation (see neon.layers.quantized).  The step the inputs of each
+        layer are rounded to int8 with is calibrated on the largest input seen
+        over the minibatches of dataset.  The int8 weights and the steps are
+        serialized with the quantized model.
+
+        Arguments:
+            dataset (iterator): calibration data, with typical inputs
+            nbatches (int, optional): number of minibatches of dataset to
+                                      calibrate on, defaults to all of them
+            eval_set (iterator, optional): data to evaluate both models on,
+                                           their metrics and the difference
+                                           are logged
+            metric (Metric, optional): metric to evaluate eval_set with
+
+        Returns:
+            Model: quantized model, initialized for inference only
+        """
+        pdict = self.get_description(get_weights=True)
+        nquantized = quantize_description(pdict['model'])
+        qmodel = Model(pdict, weights_only=True)
+        qmodel.initialize(dataset, inference=True)
+
+        # the layers run with their float weights until quantized
+        dataset.reset()
+        for i, (x, t) in enumerate(dataset):
+            if nbatches is not None and i >= nbatches:
+                break
+            qmodel.fprop(x, inference=True)
+        for l in quantized_layers(qmodel.layers):
+            l.quantize()
+        logger.info('Quantized %d layers to int8', nquantized)
+
+        if eval_set is not None and metric is not None:
+            ref = self.eval(eval_set, metric)
+            res = qmodel.eval(eval_set, metric)
+            for name, r, q in zip(metric.metric_names, ref, res):
+                logger.info('%s: float %.4f, int8 %.4f, delta %+.4f', name, r, q, q - r)
+        return qmodel
+
+    def _check_trainable(self):
+        if self.inference_only:
+            raise ValueError("Model was initialized for inference only and cannot be trained")
+
     def __str__(self):
         """
         String representation of model's layers
@@ -133,12 +229,20 @@ class Model(NervanaObject):
             num_epochs: Number of times to iterate over the dataset.
             callbacks (Callbacks): Defines callbacks to run at the end of each mini-batch / epoch.
         """
+        if self.be.num_procs > 1:
+            # each process of a data parallel backend trains on its share of
+            # the examples, evaluation sets are left whole
+            if not hasattr(dataset, 'shard'):
+                raise ValueError("The dataset cannot be split between the processes of a data "
+                                 "parallel backend")
+            dataset.shard()
         self.nbatches = dataset.nbatches
         self.ndata = dataset.ndata
         # self.set_shortcut()  # infer if bprop shortcut can be used
         self.total_cost = self.be.empty((1, 1), dtype=np.float32)
         self.optimizer = optimizer
         self.initialize(dataset, cost)
+        self._check_trainable()
 
         callbacks.on_train_begin(num_epochs)
         while self.epoch_index < num_epochs and not self.finished:
@@ -201,6 +305,43 @@ class Model(NervanaObject):
         """
         return self.layers.fprop(x, inference)
 
+    def fprop_stream(self, x, streams=None):
+        """
+        Forward propagates the next time steps of a batch of independent
+        streams, for online inference.  The state of the recurrent layers of
+        every stream is kept from one call to the next, so a sequence can be
+        fed a step at a time at a constant cost per step.  See StreamRunner
+        for the supported layers.
+
+        Arguments:
+            x (Tensor): Input of the steps (feature_size, nsteps * nstreams),
+                        the streams of each step in consecutive columns
+            streams (list, optional): Ids of the streams in the columns of
+                                      each step, defaults to range(be.bsz)
+
+        Returns:
+            Tensor: the output of the final layer for each step and stream
+        """
+        if not self.initialized:
+            raise ValueError("Model must be initialized before streaming")
+        if self.stream_runner is None:
+            if type(self.layers) is not Sequential:
+                raise ValueError("Streaming needs a sequential model")
+            self.stream_runner = StreamRunner(self.layers.layers)
+        if streams is None:
+            streams = range(self.be.bsz)
+        return self.stream_runner.fprop(x, streams)
+
+    def reset_stream(self, streams=None):
+        """
+        Forgets the state of streams fed to fprop_stream.
+
+        Arguments:
+            streams (list, optional): Ids of the streams, defaults to all
+        """
+        if self.stream_runner is not None:
+            self.stream_runner.reset(streams)
+
     def bprop(self, delta):
         """
         Back propagates the error of a minibatch through the model.
@@ -294,7 +435,10 @@ class Model(NervanaObject):
 
     def save_params(self, param_path, keep_states=True):
         """
-        Serializes and saves model parameters to the path specified.
+        Serializes and saves model parameters to the path specified.  Paths
+        ending in .ckpt are written in the neon checkpoint format, in which the
+        weights are stored as raw arrays that load_params maps into memory
+        rather than unpickling, other paths are pickled.
 
         Arguments:
             param_path (str): File to write serialized parameter dict to.
@@ -310,7 +454,8 @@ class Model(NervanaObject):
 
         Arguments:
             param_path (str): File containing serialized python dict with layer
-                              weights and states.
+                              weights and states, either a pickle or a neon
+                              checkpoint.
             load_states (bool):  if False, then only the weights will be loaded
                                  into a model in which the layers have already been
                                  created, otherwise will (re)create the layers from
@@ -408,11 +553,13 @@ class Model(NervanaObject):
         if self.initialized:
             pdict['train_input_shape'] = self.layers.in_shape
         if fn is not None:
-            save_obj(pdict, fn)
+            # the processes of a data parallel backend hold the same weights
+            if self.be.rank == 0:
+                save_obj(pdict, fn)
             return
         return pdict
 
-    def benchmark(self, dataset, cost, optimizer, niterations=20, nskip=2):
+    def benchmark(self, dataset, cost, optimizer, niterations=20, nskip=2, profiler=None):
         """
         Measure runtime for computing fprop and bprop seperately, as well as
         full minibatch run times.
@@ -428,12 +575,17 @@ class Model(NervanaObject):
              nskip (optional, int): number of iterations at the beginning to skip
                                     when calculating the runtime statistics
 
+             profiler (optional, Profiler): if given, also profile the layers and
+                                            kernels of the iterations after the
+                                            skipped ones and print its summary
+
         Returns:
             dictionary with fprop, bprop run times
         """
         # initialize model
         self.cost = cost
         self.initialize(dataset, cost)
+        self._check_trainable()
         self.optimizer = optimizer
         self.total_cost = self.be.empty((1, 1))
         self.total_cost[:] = 0
@@ -452,6 +604,10 @@ class Model(NervanaObject):
             dataset.reset()
             for mb_idx, (x, t) in enumerate(dataset):
 
+                if profiler is not None and count == nskip:
+                    profiler.reset()
+                    profiler.attach(self)
+
                 self.be.record_mark(fprop_start)  # mark start of fprop
 
                 x = self.fprop(x)
@@ -475,6 +631,10 @@ class Model(NervanaObject):
                 if count >= niterations + nskip:
                     break
 
+        if profiler is not None:
+            profiler.detach()
+            profiler.print_summary()
+
         # print results
         header = ('Func', 'Mean', 'Median', 'Min', 'Max', 'Units')
         stats = tuple(stat.lower() for stat in header[1:-1])
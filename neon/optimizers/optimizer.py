@@ -13,6 +13,7 @@
 # limitations under the License.
 # ----------------------------------------------------------------------------
 
+from collections import OrderedDict
 from neon import NervanaObject
 from neon.util.persist import load_class
 import numpy as np
@@ -29,6 +30,104 @@ def get_param_list(layer_list):
     return plist
 
 
+class ParamArena(NervanaObject):
+
+    '''
+    The parameters, gradients and optimizer states of a list of layers moved
+    into a few contiguous buffers, so that an optimizer updates all of them
+    with one op-tree per buffer instead of one per parameter tensor.
+
+    There is one set of buffers per parameter dtype and parallelism, each
+    holding the tensors side by side in a single column.  The layers are
+    rebound to views of the buffers with their set_param_buffers method, so
+    fprop and bprop keep working on their own tensors.
+
+    Arguments:
+        layer_list (list): layers to pack, all with a set_param_buffers method
+        nstates (int): number of optimizer states per parameter.  Existing
+                       states are copied if there are as many, the others
+                       start from zero.
+        sparse (bool, optional): leave out the parameters with row sparse
+                                 gradients (see Optimizer.sparse_rows), for
+                                 optimizers updating only their seen rows
+    '''
+
+    def __init__(self, layer_list, nstates, sparse=False):
+        super(ParamArena, self).__init__()
+        self.nstates = nstates
+
+        # (layer, param entries of the layer, index of each entry's group)
+        layers = []
+        keys, sizes = [], []
+        for l in layer_list:
+            plist = l.get_params()
+            entries = plist if isinstance(plist, list) else [plist]
+            groups = []
+            for (param, grad), states in entries:
+                if sparse and hasattr(grad, 'sparse_rows'):
+                    groups.append(None)
+                    continue
+                key = (param.dtype, tuple(sorted(l.get_param_attrs().items())))
+                if key not in keys:
+                    keys.append(key)
+                    sizes.append(0)
+                groups.append(keys.index(key))
+                sizes[groups[-1]] += param.size
+            layers.append((l, plist, entries, groups))
+
+        self.param_list = []
+        for (dtype, attrs), size in zip(keys, sizes):
+            attrs = dict(attrs)
+            param = self.be.empty((size, 1), dtype=dtype, **attrs)
+            grad = self.be.zeros((size, 1), dtype=dtype, **attrs)
+            states = [self.be.zeros((size, 1), dtype=dtype, **attrs) for i in range(nstates)]
+            self.param_list.append(((param, grad), states))
+
+        # move the tensors into the buffers
+        offsets = [0] * len(keys)
+        self.tensors = []
+        for l, plist, entries, groups in layers:
+            new_entries = []
+            for ((param, grad), states), g in zip(entries, groups):
+                if g is None:
+                    self.param_list.append(((param, grad), states))
+                    self.tensors.append((param, grad, None))
+                    new_entries.append(((param, grad), states))
+                    continue
+                (arena_param, arena_grad), arena_states = self.param_list[g]
+                start, end = offsets[g], offsets[g] + param.size
+                offsets[g] = end
+
+                views = [t[start:end].reshape(param.shape)
+                         for t in [arena_param, arena_grad] + arena_states]
+                views[0][:] = param
+                views[1][:] = grad
+                if len(states) == nstates:
+                    for v, s in zip(views[2:], states):
+                        v[:] = s
+                # the state lists of the layers are updated in place
+                states[:] = views[2:]
+                self.tensors.append((views[0], views[1], tuple(states)))
+                new_entries.append(((views[0], views[1]), states))
+            l.set_param_buffers(new_entries if isinstance(plist, list) else new_entries[0])
+
+    def matches(self, param_list):
+        '''
+        Whether param_list, as returned by get_param_list, still holds the
+        tensors packed by this arena.  Loading weights or states may replace
+        them.
+        '''
+        if len(param_list) != len(self.tensors):
+            return False
+        for ((param, grad), states), (p, g, s) in zip(param_list, self.tensors):
+            if param is not p or grad is not g:
+                return False
+            if s is not None and (len(states) != len(s) or
+                                  any(a is not b for a, b in zip(states, s))):
+                return False
+        return True
+
+
 class Optimizer(NervanaObject):
 
     '''
@@ -37,6 +136,7 @@ class Optimizer(NervanaObject):
     '''
     def __init__(self, name=None):
         super(Optimizer, self).__init__(name=name)
+        self.param_arena = None
 
     @classmethod
     def gen_class(cls, pdict):
@@ -50,6 +150,33 @@ class Optimizer(NervanaObject):
     def optimize(self, layer_list, epoch):
         raise NotImplementedError()
 
+    def get_packed_params(self, layer_list, nstates, sparse=False):
+        """
+        Return the param list of layer_list with the parameters, gradients and
+        states packed into a ParamArena, so the update loop of an optimizer
+        runs over a few buffers.  The arena is rebuilt when the tensors of the
+        layers change.  Layers that cannot be rebound to the arena are handled
+        one tensor at a time, as returned by get_param_list.
+
+        With a backend training on several processes, the gradients are
+        averaged over the processes (see Backend.allreduce).
+
+        Arguments:
+            layer_list (list): a list of Layer objects to optimize
+            nstates (int): number of states the optimizer keeps per parameter
+            sparse (bool, optional): whether the optimizer updates the seen
+                                     rows of row sparse gradients only
+        """
+        if not all(hasattr(l, 'set_param_buffers') for l in layer_list):
+            param_list = get_param_list(layer_list)
+        else:
+            if (self.param_arena is None or
+                    not self.param_arena.matches(get_param_list(layer_list))):
+                self.param_arena = ParamArena(layer_list, nstates, sparse)
+            param_list = self.param_arena.param_list
+        self.be.allreduce([grad for (param, grad), states in param_list])
+        return param_list
+
     def clip_gradient_norm(self, param_list, clip_norm):
         """
         Scale the magnitude of the network's gradients
@@ -68,6 +195,41 @@ class Optimizer(NervanaObject):
             scale_factor = clip_norm / max(float(grad_norm.get()), float(clip_norm))
         return scale_factor
 
+    def sparse_rows(self, grad):
+        """
+        Return the rows of a row sparse gradient, or None for a dense one.
+
+        Layers such as LookupTable set the sparse_rows attribute of their
+        gradient to the rows written in the last bprop, all other rows of the
+        gradient are zero.
+
+        Arguments:
+            grad (Tensor): gradient of a parameter
+        """
+        return getattr(grad, 'sparse_rows', None)
+
+    def gather_rows(self, rows, tensors):
+        """
+        Return copies of the given rows of each tensor.
+
+        Arguments:
+            rows (numpy array): row indices
+            tensors (list): tensors sharing the first dimension
+        """
+        return [t.take(rows, axis=0) for t in tensors]
+
+    def scatter_rows(self, rows, tensors, row_tensors):
+        """
+        Write back rows obtained from gather_rows.
+
+        Arguments:
+            rows (numpy array): row indices
+            tensors (list): tensors to write into
+            row_tensors (list): the updated rows of each tensor
+        """
+        for t, r in zip(tensors, row_tensors):
+            t[rows] = r
+
     def clip_gradient_value(self, grad, clip_value):
         """
         Element-wise clip a list of gradients.
@@ -177,7 +339,7 @@ class GradientDescentMomentum(Optimizer):
 
     def __init__(self, learning_rate, momentum_coef, stochastic_round=False,
                  wdecay=0.0, gradient_clip_norm=None, gradient_clip_value=None,
-                 name=None, schedule=Schedule()):
+                 name=None, schedule=Schedule(), sparse_updates=False):
         """
         Arguments:
             learning_rate (float): the multiplicative coefficient of updates
@@ -200,6 +362,11 @@ class GradientDescentMomentum(Optimizer):
                                   Defaults to "gdm".
             schedule (neon.optimizers.optimizer.Schedule, optional): Learning
                 rate schedule.  Defaults to a constant learning rate.
+            sparse_updates (bool, optional): For row sparse gradients (e.g.
+                LookupTable weights), only update the rows seen in the
+                minibatch, so the velocity of the other rows is not decayed.
+                Without momentum and weight decay this is always done as the
+                result is the same.  Defaults to False.
         """
         super(GradientDescentMomentum, self).__init__(name=name)
         self.learning_rate, self.momentum_coef = (learning_rate, momentum_coef)
@@ -208,6 +375,7 @@ class GradientDescentMomentum(Optimizer):
         self.wdecay = wdecay
         self.schedule = schedule
         self.stochastic_round = stochastic_round
+        self.sparse_updates = sparse_updates
 
     def optimize(self, layer_list, epoch):
         """
@@ -218,7 +386,8 @@ class GradientDescentMomentum(Optimizer):
             epoch (int): the current epoch, needed for the Schedule object.
         """
         lrate = self.schedule.get_learning_rate(self.learning_rate, epoch)
-        param_list = get_param_list(layer_list)
+        sparse = self.sparse_updates or (self.momentum_coef == 0 and self.wdecay == 0)
+        param_list = self.get_packed_params(layer_list, 1, sparse)
 
         scale_factor = self.clip_gradient_norm(param_list, self.gradient_clip_norm)
 
@@ -226,14 +395,24 @@ class GradientDescentMomentum(Optimizer):
             param.rounding = self.stochastic_round
             if len(states) == 0:
                 states.append(self.be.zeros_like(grad))
+
+            rows = self.sparse_rows(grad) if sparse else None
+            if rows is not None:
+                dense = [param, states[0]]
+                param, grad, velocity = self.gather_rows(rows, [param, grad, states[0]])
+            else:
+                velocity = states[0]
+
             grad = grad / self.be.bsz
             grad = self.clip_gradient_value(grad, self.gradient_clip_value)
 
-            velocity = states[0]
             velocity[:] = velocity * self.momentum_coef \
                 - lrate * (scale_factor * grad + self.wdecay * param)
             param[:] = param + velocity
 
+            if rows is not None:
+                self.scatter_rows(rows, dense, [param, velocity])
+
 
 class RMSProp(Optimizer):
 
@@ -243,7 +422,7 @@ class RMSProp(Optimizer):
 
     def __init__(self, stochastic_round=False, decay_rate=0.95, learning_rate=2e-3, epsilon=1e-6,
                  gradient_clip_norm=None, gradient_clip_value=None, name=None,
-                 schedule=Schedule()):
+                 schedule=Schedule(), sparse_updates=False):
         """
         Arguments:
             stochastic_round (bool): Set this to True for stochastic rounding.
@@ -261,6 +440,10 @@ class RMSProp(Optimizer):
                                                    Defaults to None.
             schedule (neon.optimizers.optimizer.Schedule, optional): Learning rate schedule.
                                                                      Defaults to a constant.
+            sparse_updates (bool, optional): For row sparse gradients, only
+                                             update the rows seen in the
+                                             minibatch, so the state of the
+                                             other rows is not decayed.
         Notes:
             Only constant learning rate is supported currently.
         """
@@ -274,6 +457,7 @@ class RMSProp(Optimizer):
         self.gradient_clip_norm = gradient_clip_norm
         self.gradient_clip_value = gradient_clip_value
         self.stochastic_round = stochastic_round
+        self.sparse_updates = sparse_updates
 
     def optimize(self, layer_list, epoch):
         """
@@ -285,7 +469,7 @@ class RMSProp(Optimizer):
         """
         lrate = self.schedule.get_learning_rate(self.learning_rate, epoch)
         epsilon, decay = (self.epsilon, self.decay_rate)
-        param_list = get_param_list(layer_list)
+        param_list = self.get_packed_params(layer_list, 1, self.sparse_updates)
 
         scale_factor = self.clip_gradient_norm(param_list, self.gradient_clip_norm)
 
@@ -295,16 +479,25 @@ class RMSProp(Optimizer):
             if len(states) == 0:
                 states.append(self.be.zeros_like(grad))
 
+            rows = self.sparse_rows(grad) if self.sparse_updates else None
+            if rows is not None:
+                dense = [param, states[0]]
+                param, grad, state = self.gather_rows(rows, [param, grad, states[0]])
+            else:
+                state = states[0]
+
             grad = grad / self.be.bsz
             grad = self.clip_gradient_value(grad, self.gradient_clip_value)
 
             # update state
-            state = states[0]
             state[:] = decay * state + self.be.square(grad) * (1.0 - decay)
 
             param[:] = param \
                 - (scale_factor * grad * lrate) / (self.be.sqrt(state + epsilon) + epsilon)
 
+            if rows is not None:
+                self.scatter_rows(rows, dense, [param, state])
+
 
 class Adagrad(Optimizer):
 
@@ -348,7 +541,7 @@ class Adagrad(Optimizer):
             epoch (int): the current epoch, needed for the Schedule object.
         """
         lrate, epsilon = (self.learning_rate, self.epsilon)
-        param_list = get_param_list(layer_list)
+        param_list = self.get_packed_params(layer_list, 1, sparse=True)
 
         scale_factor = self.clip_gradient_norm(param_list, self.gradient_clip_norm)
 
@@ -358,14 +551,25 @@ class Adagrad(Optimizer):
             if len(states) == 0:
                 states.append(self.be.zeros_like(grad))
 
+            # rows with a zero gradient are left unchanged, so row sparse
+            # gradients only need their rows updated
+            rows = self.sparse_rows(grad)
+            if rows is not None:
+                dense = [param, states[0]]
+                param, grad, state = self.gather_rows(rows, [param, grad, states[0]])
+            else:
+                state = states[0]
+
             grad = grad / self.be.bsz
             grad = self.clip_gradient_value(grad, self.gradient_clip_value)
 
             # update state
-            state = states[0]
             state[:] = state + self.be.square(grad)
             param[:] = param - (scale_factor * grad * lrate) / (self.be.sqrt(state + epsilon))
 
+            if rows is not None:
+                self.scatter_rows(rows, dense, [param, state])
+
 
 class Adadelta(Optimizer):
 
@@ -401,7 +605,7 @@ class Adadelta(Optimizer):
         """
         epsilon, decay = (self.epsilon, self.decay)
 
-        param_list = get_param_list(layer_list)
+        param_list = self.get_packed_params(layer_list, 3)
 
         for (param, grad), states in param_list:
             param.rounding = self.stochastic_round
@@ -425,7 +629,7 @@ class Adam(Optimizer):
     """
 
     def __init__(self, stochastic_round=False, learning_rate=0.001, beta_1=0.9, beta_2=0.999,
-                 epsilon=1e-8, name="adam"):
+                 epsilon=1e-8, name="adam", sparse_updates=False):
         """
         Args:
             stochastic_round (bool): Set this to True for stochastic rounding.
@@ -436,6 +640,10 @@ class Adam(Optimizer):
             beta_1 (float): Adam parameter beta1
             beta_2 (float): Adam parameter beta2
             epsilon (float): numerical stability parameter
+            sparse_updates (bool): For row sparse gradients, only update the
+                                   rows seen in the minibatch (lazy Adam), so
+                                   the moments of the other rows are not
+                                   decayed.
         """
         super(Adam, self).__init__(name=name)
         self.beta_1 = beta_1
@@ -443,6 +651,7 @@ class Adam(Optimizer):
         self.epsilon = epsilon
         self.learning_rate = learning_rate
         self.stochastic_round = stochastic_round
+        self.sparse_updates = sparse_updates
 
     def optimize(self, layer_list, epoch):
         """
@@ -456,7 +665,7 @@ class Adam(Optimizer):
         t = epoch + 1
         l = self.learning_rate * self.be.sqrt(1 - self.beta_2 ** t) / (1 - self.beta_1 ** t)
 
-        param_list = get_param_list(layer_list)
+        param_list = self.get_packed_params(layer_list, 2, self.sparse_updates)
 
         for (param, grad), states in param_list:
             param.rounding = self.stochastic_round
@@ -464,13 +673,22 @@ class Adam(Optimizer):
                 # running_1st_mom, running_2nd_mom
                 states.extend([self.be.zeros_like(grad) for i in range(2)])
 
+            rows = self.sparse_rows(grad) if self.sparse_updates else None
+            if rows is not None:
+                dense = [param] + states
+                param, grad, m, v = self.gather_rows(rows, [param, grad] + states)
+            else:
+                m, v = states
+
             grad = grad / self.be.bsz
-            m, v = states
             m[:] = m * self.beta_1 + (1. - self.beta_1) * grad
             v[:] = v * self.beta_2 + (1. - self.beta_2) * grad * grad
 
             param[:] = param - l * m / (self.be.sqrt(v) + self.epsilon)
 
+            if rows is not None:
+                self.scatter_rows(rows, dense, [param, m, v])
+
 
 class MultiOptimizer(Optimizer):
 
@@ -520,9 +738,12 @@ class MultiOptimizer(Optimizer):
 
     def map_optimizers(self, layer_list):
         """
-        maps the optimizers to their corresponding layers
+        maps the optimizers to their corresponding layers, in the order of
+        their first layer in layer_list, so that the optimizers run (and the
+        processes of a data parallel backend reduce their gradients) in the
+        same order every time
         """
-        map_list = dict()
+        map_list = OrderedDict()
         for layer in layer_list:
             classname = layer.__class__.__name__
             name = layer.name
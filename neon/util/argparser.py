@@ -125,7 +125,7 @@ class NeonArgparser(configargparse.ArgumentParser):
                             help='number of checkpoint files to retain')
 
         be_grp = self.add_argument_group('backend')
-        be_grp.add_argument('-b', '--backend', choices=['cpu', 'gpu', 'mgpu', 'argon'],
+        be_grp.add_argument('-b', '--backend', choices=['cpu', 'mcpu', 'gpu', 'mgpu', 'argon'],
                             default='gpu' if get_compute_capability() >= 3.0
                                     else 'cpu',
                             help='backend type. Multi-GPU support is a premium '
@@ -136,6 +136,10 @@ class NeonArgparser(configargparse.ArgumentParser):
                             help='gpu device id (only used with GPU backend)')
         be_grp.add_argument('-m', '--max_devices', type=int, default=get_device_count(),
                             help='max number of GPUs (only used with mgpu backend')
+        be_grp.add_argument('--num_threads', type=int, default=None,
+                            help='number of worker threads (only used with cpu backend)')
+        be_grp.add_argument('--num_procs', type=int, default=2,
+                            help='number of processes (only used with mcpu backend)')
 
         be_grp.add_argument('-r', '--rng_seed', type=int,
                             default=None, metavar='SEED',
@@ -322,7 +326,9 @@ class NeonArgparser(configargparse.ArgumentParser):
                         datatype=args.datatype,
                         max_devices=args.max_devices,
                         compat_mode=args.compat_mode,
-                        deterministic=args.deterministic)
+                        deterministic=args.deterministic,
+                        num_threads=args.num_threads,
+                        num_procs=args.num_procs)
 
         # display what command line / config options were set (and from where)
         logger.info(self.format_values())
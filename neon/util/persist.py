@@ -16,12 +16,24 @@ import importlib
 import logging
 import os
 import pkgutil
+import struct
 import sys
 
+import numpy as np
+
 from neon.util.compat import pickle
 
 logger = logging.getLogger(__name__)
 
+# native checkpoint format: a short header, the raw array data (each array
+# aligned so it can be mapped in place) and a pickled manifest of the object
+# with the arrays replaced by references, followed by a trailer holding the
+# offset of the manifest
+CHECKPOINT_EXT = '.ckpt'
+CHECKPOINT_MAGIC = b'NEONCKPT'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_ALIGN = 64
+
 
 def ensure_dirs_exist(path):
     """
@@ -48,6 +60,7 @@ def save_obj(obj, save_path):
     extension in brackets):
 
         * python pickle (.pkl)
+        * neon checkpoint (.ckpt), see :py:func:`save_checkpoint`
 
     Arguments:
         obj (object): the python object to be saved.
@@ -60,6 +73,9 @@ def save_obj(obj, save_path):
     if save_path is None or len(save_path) == 0:
         return
     save_path = os.path.expandvars(os.path.expanduser(save_path))
+    if save_path.endswith(CHECKPOINT_EXT):
+        save_checkpoint(obj, save_path)
+        return
     logger.debug("serializing object to: %s", save_path)
     ensure_dirs_exist(save_path)
 
@@ -72,6 +88,8 @@ def load_obj(load_path):
     currently support the following file formats:
 
         * python pickle (.pkl)
+        * gzipped python pickle (.gz)
+        * neon checkpoint (any extension), see :py:func:`load_checkpoint`
 
     Arguments:
         load_path (str): where to the load the serialized object (full path
@@ -80,6 +98,8 @@ def load_obj(load_path):
     """
     if isinstance(load_path, str):
         load_path = os.path.expandvars(os.path.expanduser(load_path))
+        if is_checkpoint(load_path):
+            return load_checkpoint(load_path)
         if load_path.endswith('.gz'):
             import gzip
             load_path = gzip.open(load_path)
@@ -98,6 +118,132 @@ def load_obj(load_path):
         raise AttributeError(msg)
 
 
+class _ArrayRef(object):
+    """
+    Stands in for an array in the manifest of a checkpoint.
+    """
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _align(f):
+    pad = -f.tell() % CHECKPOINT_ALIGN
+    if pad:
+        f.write(b'\0' * pad)
+
+
+def _write_arrays(obj, f):
+    """
+    Write the arrays in obj to f, returning obj with the arrays replaced by
+    references to the written data.
+    """
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        _align(f)
+        ref = _ArrayRef(f.tell(), obj.shape, obj.dtype.str)
+        if obj.size > 0:
+            f.write(np.ascontiguousarray(obj).data)
+        return ref
+    if isinstance(obj, dict):
+        return obj.__class__((k, _write_arrays(v, f)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)) and obj.__class__ in (list, tuple):
+        return obj.__class__(_write_arrays(v, f) for v in obj)
+    return obj
+
+
+def _read_arrays(obj, f, data):
+    """
+    Replace the array references in a checkpoint manifest by the arrays,
+    either views of the memory mapped file data or read from f.
+    """
+    if isinstance(obj, _ArrayRef):
+        dtype = np.dtype(obj.dtype)
+        count = int(np.prod(obj.shape))
+        if data is not None:
+            return data[obj.offset:obj.offset + count * dtype.itemsize].view(dtype).reshape(
+                obj.shape)
+        f.seek(obj.offset)
+        return np.fromfile(f, dtype, count).reshape(obj.shape)
+    if isinstance(obj, dict):
+        return obj.__class__((k, _read_arrays(v, f, data)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)) and obj.__class__ in (list, tuple):
+        return obj.__class__(_read_arrays(v, f, data) for v in obj)
+    return obj
+
+
+def save_checkpoint(obj, save_path):
+    """
+    Save a python data structure (typically the dict from Model.serialize) in
+    the neon checkpoint format.  The numpy arrays it contains (at any depth of
+    dicts, lists and tuples) are written one by one as raw, aligned data
+    instead of being pickled, so they can be memory mapped by load_checkpoint.
+
+    Arguments:
+        obj (object): the python object to be saved.
+        save_path (str): where to write the checkpoint (full path and file
+                         name)
+    """
+    save_path = os.path.expandvars(os.path.expanduser(save_path))
+    logger.debug("writing checkpoint to: %s", save_path)
+    ensure_dirs_exist(save_path)
+
+    with open(save_path, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC + struct.pack('<Q', CHECKPOINT_VERSION))
+        manifest = _write_arrays(obj, f)
+        _align(f)
+        manifest_offset = f.tell()
+        pickle.dump(manifest, f, -1)
+        f.write(struct.pack('<Q', manifest_offset) + CHECKPOINT_MAGIC)
+
+
+def is_checkpoint(load_path):
+    """
+    Returns:
+        bool: whether load_path is a file in the neon checkpoint format
+    """
+    try:
+        with open(load_path, 'rb') as f:
+            return f.read(len(CHECKPOINT_MAGIC)) == CHECKPOINT_MAGIC
+    except IOError:
+        return False
+
+
+def load_checkpoint(load_path, mmap_mode='r'):
+    """
+    Load a file written by save_checkpoint.
+
+    Arguments:
+        load_path (str): where to the load the checkpoint from (full path
+                         and file name)
+        mmap_mode (str, optional): if not None, the arrays are returned as
+                                   views of the file mapped into memory with
+                                   this mode (see numpy.memmap), and only read
+                                   from disk when they are accessed.  If None
+                                   the arrays are read into memory.
+
+    Returns:
+        object: the saved python data structure
+    """
+    load_path = os.path.expandvars(os.path.expanduser(load_path))
+    logger.debug("reading checkpoint from: %s", load_path)
+
+    with open(load_path, 'rb') as f:
+        magic = len(CHECKPOINT_MAGIC)
+        header = f.read(magic + 8)
+        version = struct.unpack('<Q', header[magic:])[0]
+        if header[:magic] != CHECKPOINT_MAGIC or version > CHECKPOINT_VERSION:
+            raise ValueError("%s is not a supported neon checkpoint" % load_path)
+        f.seek(-(magic + 8), os.SEEK_END)
+        manifest_offset = struct.unpack('<Q', f.read(8))[0]
+        f.seek(manifest_offset)
+        manifest = pickle.load(f)
+        data = None
+        if mmap_mode is not None:
+            data = np.memmap(f, dtype=np.uint8, mode=mmap_mode, shape=(manifest_offset,))
+        return _read_arrays(manifest, f, data)
+
+
 def load_class(ctype):
     """
     Helper function to take a string with the neon module and
@@ -0,0 +1,212 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Layer and kernel level profiling of a model.
+"""
+from collections import OrderedDict
+import json
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _dot_flops(A, B, C, *args, **kwargs):
+    return 2.0 * A.shape[0] * A.shape[1] * B.shape[1]
+
+
+def _conv_flops(layer, *args, **kwargs):
+    flops = getattr(layer, 'flops', None)
+    if flops is None:
+        flops = 2.0 * np.prod(layer.dimO) * np.prod(layer.dimF[:-1])
+    return flops
+
+
+# backend kernels that are timed, with their FLOP counts where known
+kernel_flops = OrderedDict([
+    ('compound_dot', _dot_flops),
+    ('batched_dot', None),
+    ('fprop_conv', _conv_flops),
+    ('bprop_conv', _conv_flops),
+    ('update_conv', _conv_flops),
+    ('fprop_pool', None),
+    ('bprop_pool', None),
+    ('fprop_lrn', None),
+    ('bprop_lrn', None),
+    ('compound_fprop_bn', None),
+    ('compound_bprop_bn', None),
+    ('compound_bprop_lut', None),
+    ('execute', None),
+])
+
+
+class Profiler(object):
+    """
+    Times the fprop and bprop of every layer of a model (containers and the
+    layers inside them), the optimizer updates and the backend kernels.
+
+    The timed methods are wrapped on the objects themselves by attach and
+    restored by detach.  Each call is timed with the backend's timing marks,
+    synchronizing after every call, so the profiled run is slower than a
+    normal one.  FLOPs of the kernels are also credited to the layers they
+    run in.
+
+    Arguments:
+        be (Backend): backend the model runs on
+        kernels (bool): also time the backend kernels
+        trace (bool): keep every call for save_trace
+    """
+    def __init__(self, be, kernels=True, trace=True):
+        self.be = be
+        self.kernels = kernels
+        self.trace = trace
+        self.wrapped = []
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the collected statistics and trace.
+        """
+        self.stats = OrderedDict()
+        self.events = []
+        self.stack = []
+        self.t0 = time.time()
+
+    def attach(self, model):
+        """
+        Start profiling a model.
+
+        Arguments:
+            model (Model): initialized model, its optimizer is profiled too
+        """
+        self.detach()
+
+        def walk(layer):
+            yield layer
+            for l in getattr(layer, 'layers', []):
+                for sub in walk(l):
+                    yield sub
+
+        for layer in walk(model.layers):
+            category = 'container' if hasattr(layer, 'layers') else 'layer'
+            for attr in ('fprop', 'bprop'):
+                self._wrap(layer, attr, '%s.%s' % (layer.name, attr), category)
+
+        if getattr(model, 'optimizer', None) is not None:
+            optimizer = model.optimizer
+            self._wrap(optimizer, 'optimize', '%s.optimize' % optimizer.name, 'optimizer')
+
+        if self.kernels:
+            for attr, flops in kernel_flops.items():
+                if hasattr(self.be, attr):
+                    self._wrap(self.be, attr, attr, 'kernel', flops)
+
+    def detach(self):
+        """
+        Stop profiling, restoring the wrapped methods.
+        """
+        for obj, attr in reversed(self.wrapped):
+            delattr(obj, attr)
+        self.wrapped = []
+
+    def _wrap(self, obj, attr, name, category, flops=None):
+        if any(o is obj and a == attr for o, a in self.wrapped):
+            return
+        func = getattr(obj, attr)
+
+        def timed(*args, **kwargs):
+            self._begin(name, category)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._end(flops(*args, **kwargs) if flops is not None else 0)
+
+        setattr(obj, attr, timed)
+        self.wrapped.append((obj, attr))
+
+    def _begin(self, name, category):
+        start = self.be.init_mark()
+        frame = dict(name=name, cat=category, ts=(time.time() - self.t0) * 1e6,
+                     start=start, flops=0.0)
+        self.stack.append(frame)
+        self.be.record_mark(start)
+
+    def _end(self, flops):
+        end = self.be.init_mark()
+        self.be.record_mark(end)
+        self.be.synchronize_mark(end)
+        frame = self.stack.pop()
+        elapsed = self.be.get_time(frame['start'], end)
+        frame['flops'] += flops
+        if self.stack:
+            self.stack[-1]['flops'] += frame['flops']
+
+        stat = self.stats.get(frame['name'])
+        if stat is None:
+            stat = self.stats[frame['name']] = dict(category=frame['cat'], calls=0,
+                                                    time_ms=0.0, flops=0.0)
+        stat['calls'] += 1
+        stat['time_ms'] += elapsed
+        stat['flops'] += frame['flops']
+
+        if self.trace:
+            self.events.append(dict(name=frame['name'], cat=frame['cat'], ph='X',
+                                    ts=frame['ts'], dur=elapsed * 1e3, pid=0, tid=0,
+                                    args=dict(flops=frame['flops'])))
+
+    def summary(self):
+        """
+        Returns:
+            OrderedDict: calls, total time (ms), FLOPs and GFLOP/s for every
+                         timed function, in order of first call
+        """
+        summary = OrderedDict()
+        for name, stat in self.stats.items():
+            summary[name] = dict(stat)
+            summary[name]['gflops'] = (stat['flops'] / (stat['time_ms'] * 1e6)
+                                       if stat['time_ms'] > 0 else 0.0)
+        return summary
+
+    def print_summary(self):
+        """
+        Print the summary as a table.
+        """
+        header = ('Func', 'Calls', 'Time (ms)', 'GFLOPs', 'GFLOP/s')
+        width = max([len(name) for name in self.stats] + [4])
+        fmt_titles = '| {:<%d} ' % width + '| {:^11} ' * (len(header) - 1) + '|'
+        fmt_nums = '| {:<%d} | {:>11d} | {:>11.5g} | {:>11.5g} | {:>11.5g} |' % width
+        head_str = fmt_titles.format(*header)
+        sep = '-' * len(head_str)
+        print(sep + '\n' + head_str + '\n' + sep)
+        for name, stat in self.summary().items():
+            print(fmt_nums.format(name, stat['calls'], stat['time_ms'], stat['flops'] / 1e9,
+                                  stat['gflops']))
+        print(sep)
+
+    def save_summary(self, path):
+        """
+        Write the summary as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def save_trace(self, path):
+        """
+        Write the calls in the Chrome trace event format (chrome://tracing).
+        """
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=self.events, displayTimeUnit='ms'), f)
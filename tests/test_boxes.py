@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of the vectorized bounding box operations against per box loops.
+"""
+import numpy as np
+
+from neon.data.boxes import (bbox_overlaps, bbox_transform, bbox_regression_labels,
+                             normalize_bbox_targets, sample_fg_bg)
+
+
+def random_boxes(rng, n, size=50):
+    xy = rng.randint(0, size, size=(n, 2))
+    wh = rng.randint(0, size // 2, size=(n, 2))
+    return np.hstack((xy, xy + wh)).astype(np.float64)
+
+
+def overlaps_ref(rp, gt):
+    overlaps = np.zeros((rp.shape[0], gt.shape[0]), dtype=np.float32)
+    for g in range(gt.shape[0]):
+        gt_area = (gt[g, 2] - gt[g, 0] + 1) * (gt[g, 3] - gt[g, 1] + 1)
+        for r in range(rp.shape[0]):
+            iw = min(rp[r, 2], gt[g, 2]) - max(rp[r, 0], gt[g, 0]) + 1
+            ih = min(rp[r, 3], gt[g, 3]) - max(rp[r, 1], gt[g, 1]) + 1
+            if iw > 0 and ih > 0:
+                rp_area = (rp[r, 2] - rp[r, 0] + 1) * (rp[r, 3] - rp[r, 1] + 1)
+                overlaps[r, g] = iw * ih / float(rp_area + gt_area - iw * ih)
+    return overlaps
+
+
+def test_bbox_overlaps():
+    rng = np.random.RandomState(0)
+    rp, gt = random_boxes(rng, 40), random_boxes(rng, 7)
+    overlaps = bbox_overlaps(rp, gt)
+    assert overlaps.shape == (40, 7)
+    assert np.allclose(overlaps, overlaps_ref(rp, gt), rtol=0, atol=1e-6)
+    assert np.allclose(bbox_overlaps(gt, gt).diagonal(), 1)
+    assert bbox_overlaps(rp, gt[:0]).shape == (40, 0)
+
+
+def test_bbox_transform():
+    rng = np.random.RandomState(1)
+    rp = random_boxes(rng, 20)
+    assert np.allclose(bbox_transform(rp, rp), 0)
+
+    gt = rp.copy()
+    gt[:, (0, 2)] += 3
+    w = rp[:, 2] - rp[:, 0] + 1e-14
+    assert np.allclose(bbox_transform(rp, gt)[:, 0], 3 / w)
+
+
+def test_bbox_regression_labels():
+    num_classes = 5
+    targets = np.array([[0, 1, 2, 3, 4], [3, 5, 6, 7, 8], [1, -1, -2, -3, -4]])
+    bbox_targets, weights = bbox_regression_labels(targets, num_classes)
+    assert bbox_targets.shape == weights.shape == (3, 4 * num_classes)
+    assert not bbox_targets[0].any() and not weights[0].any()
+    assert np.array_equal(bbox_targets[1, 12:16], [5, 6, 7, 8])
+    assert np.array_equal(bbox_targets[2, 4:8], [-1, -2, -3, -4])
+    assert weights.sum() == 8 and weights[1, 12:16].all() and weights[2, 4:8].all()
+
+
+def test_normalize_bbox_targets():
+    rng = np.random.RandomState(2)
+    num_classes = 4
+    targets = [np.hstack((rng.randint(num_classes, size=(n, 1)), rng.randn(n, 4)))
+               for n in (10, 25, 3)]
+    orig = np.vstack(targets)
+    normalize_bbox_targets(targets, num_classes)
+    normed = np.vstack(targets)
+
+    assert np.array_equal(normed[orig[:, 0] == 0], orig[orig[:, 0] == 0])
+    for cls in range(1, num_classes):
+        rows = orig[:, 0] == cls
+        expected = (orig[rows, 1:] - orig[rows, 1:].mean(axis=0)) / orig[rows, 1:].std(axis=0)
+        assert np.allclose(normed[rows, 1:], expected, rtol=0, atol=1e-6)
+
+
+def test_sample_fg_bg():
+    rng = np.random.RandomState(3)
+    overlaps = rng.rand(200, 1)
+    for randomness in (True, False):
+        keep, num_fg = sample_fg_bg(overlaps, 0.5, 0.1, 0.5, 16, 64, randomness)
+        assert num_fg == 16 and keep.size == 64
+        assert len(set(keep)) == keep.size
+        assert (overlaps[keep[:num_fg]] >= 0.5).all()
+        bg = overlaps[keep[num_fg:]]
+        assert ((bg >= 0.1) & (bg < 0.5)).all()
+
+    keep, num_fg = sample_fg_bg(overlaps, 0.5, 0.1, 0.5, 16, 64, False)
+    assert np.array_equal(keep[:num_fg], np.where(overlaps.ravel() >= 0.5)[0][:16])
+
+    # fewer foreground boxes than asked for
+    keep, num_fg = sample_fg_bg(np.array([0.9, 0.2, 0.3]), 0.5, 0.1, 0.5, 16, 64)
+    assert num_fg == 1 and keep[0] == 0 and sorted(keep[1:]) == [1, 2]
@@ -0,0 +1,110 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of the minibatches of sequences bucketed by length, and of the models
+switching between the lengths of the buckets.
+"""
+import numpy as np
+
+from neon.backends import gen_backend
+from neon.callbacks.callbacks import Callbacks
+from neon.data import ArrayIterator, BucketIterator
+from neon.data.text_preprocessing import pad_sentences
+from neon.initializers import Gaussian, Constant
+from neon.layers import LookupTable, LSTM, RecurrentSum, Affine, GeneralizedCost
+from neon.models import Model
+from neon.optimizers import GradientDescentMomentum
+from neon.transforms import Tanh, Logistic, Softmax, CrossEntropyMulti, Misclassification
+
+
+def random_sentences(rng, n, vocab_size, max_len):
+    return [list(rng.randint(1, vocab_size, size=rng.randint(2, max_len + 1)))
+            for i in range(n)]
+
+
+def test_bucket_iterator():
+    be = gen_backend(backend='cpu', batch_size=8, rng_seed=0)
+    rng = np.random.RandomState(0)
+    sentences = random_sentences(rng, 45, 20, 30)
+    y = rng.randint(0, 2, len(sentences))
+
+    data = BucketIterator(sentences, y, nclass=2, buckets=3)
+    assert len(data.buckets) <= 3 and data.buckets[-1] == max(len(s) for s in sentences)
+    assert data.shape == data.buckets[-1]
+
+    batches, steps = data.batch_order()
+    assert batches.shape == (data.nbatches, be.bsz)
+    # every sequence once, the last minibatch wraps around
+    assert sorted(batches.ravel()[:data.ndata]) == range(data.ndata)
+    assert np.all(np.diff(steps) >= 0)
+
+    nbatches = 0
+    for (x, t), idx, nsteps in zip(data, batches, steps):
+        assert x.shape == (nsteps, be.bsz)
+        for row, i in zip(x.get().T, idx):
+            n = len(sentences[i])
+            assert n <= nsteps
+            assert np.array_equal(row[-n:], sentences[i]) and not row[:-n].any()
+        assert np.array_equal(t.get().argmax(axis=0), y[idx])
+        nbatches += 1
+    assert nbatches == data.nbatches
+
+    data = BucketIterator(sentences, y, nclass=2, buckets=[5, 10, 50], sentence_length=20,
+                          shuffle=True)
+    assert list(data.buckets) == [5, 10, 20]
+    batches, steps = data.batch_order()
+    assert sorted(batches.ravel()[:data.ndata]) == range(data.ndata)
+    for idx, nsteps in zip(batches, steps):
+        assert all(min(len(sentences[i]), 20) <= nsteps for i in idx)
+
+
+def test_bucketed_model():
+    gen_backend(backend='cpu', batch_size=8, rng_seed=0)
+    rng = np.random.RandomState(1)
+    vocab_size = 20
+    sentences = random_sentences(rng, 45, vocab_size, 30)
+    y = rng.randint(0, 2, len(sentences))
+    train_set = BucketIterator(sentences, y, nclass=2, buckets=3, shuffle=True)
+
+    init = Gaussian(scale=0.1)
+    layers = [LookupTable(vocab_size=vocab_size, embedding_dim=6, init=init),
+              LSTM(8, init, activation=Tanh(), gate_activation=Logistic(), reset_cells=True),
+              RecurrentSum(),
+              Affine(2, init, bias=Constant(0), activation=Softmax())]
+    model = Model(layers=layers)
+    model.fit(train_set, optimizer=GradientDescentMomentum(0.1, 0.9), num_epochs=2,
+              cost=GeneralizedCost(costfunc=CrossEntropyMulti()),
+              callbacks=Callbacks(model, progress_bar=False))
+    assert sorted(model.layers.step_states) == list(train_set.buckets)
+
+    # each minibatch gives the outputs of a model configured for its length
+    test_set = BucketIterator(sentences, y, nclass=2, buckets=3)
+    batches, steps = test_set.batch_order()
+    for (x, t), idx, nsteps in zip(test_set, batches, steps):
+        outputs = model.fprop(x, inference=True).get().copy()
+
+        ref = Model(model.serialize(keep_states=False), weights_only=True)
+        X = pad_sentences([sentences[i] for i in idx], sentence_length=nsteps)
+        ref.initialize(ArrayIterator(X, y[idx], nclass=2))
+        assert np.allclose(outputs, ref.fprop(x, inference=True).get(), rtol=0, atol=1e-6)
+
+    # the completed last minibatch stays last when shuffling, so evaluation
+    # counts every sequence once
+    shuffled_set = BucketIterator(sentences, y, nclass=2, buckets=3, shuffle=True)
+    batches, steps = shuffled_set.batch_order()
+    extra = batches.size - shuffled_set.ndata
+    assert extra > 0 and np.array_equal(batches[-1, -extra:], shuffled_set.example_order[:extra])
+    metric = Misclassification()
+    assert np.allclose(model.eval(shuffled_set, metric), model.eval(test_set, metric))
@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of the step by step caption generation against running the whole
+captioning model over the sentence generated so far.
+"""
+import numpy as np
+
+from neon.data.imagecaption import CaptionDecoder
+from neon.initializers import Uniform, Constant
+from neon.layers import LSTM, Affine, Dropout, Sequential, MergeMultistream
+from neon.models import Model
+from neon.transforms import Logistic, Tanh, Softmax
+
+image_size, vocab_size, hidden_size, max_length = 12, 9, 16, 7
+
+
+def make_model():
+    init = Uniform(low=-0.5, high=0.5)
+    image_path = Sequential([Affine(hidden_size, init, bias=Constant(val=0.1))])
+    sent_path = Sequential([Affine(hidden_size, init, name='sent')])
+    layers = [MergeMultistream(layers=[image_path, sent_path], merge="recurrent"),
+              Dropout(keep=0.5),
+              LSTM(hidden_size, init, activation=Logistic(), gate_activation=Tanh(),
+                   reset_cells=True),
+              Affine(vocab_size, init, bias=init, activation=Softmax())]
+    model = Model(layers=layers)
+    model.initialize([image_size, (vocab_size, max_length)])
+    return model
+
+
+def sentence_logprob(model, image, indices):
+    """
+    Log probabilities of the sentences, up to their first end token (index 0)
+    after the first word, computed with the full model.
+    """
+    be = model.be
+    y = np.zeros((vocab_size, max_length, be.bsz))
+    for step in range(len(indices)):
+        y[indices[step], step, np.arange(be.bsz)] = 1
+    prob = model.fprop((image, be.array(y.reshape(vocab_size, -1))), inference=True).get()
+    prob = prob.reshape(vocab_size, max_length + 1, be.bsz)
+
+    logprob = np.zeros(be.bsz)
+    for s in range(be.bsz):
+        for step in range(len(indices)):
+            logprob[s] += np.log(prob[indices[step, s], step, s])
+            if step > 0 and indices[step, s] == 0:
+                break
+    return logprob
+
+
+def test_caption_decoder(backend_default):
+    be = backend_default
+    model = make_model()
+    image = be.array(np.random.rand(image_size, be.bsz))
+
+    # reference: rerun the model over the whole sentence for every new word
+    y = be.zeros((vocab_size, max_length * be.bsz))
+    for step in range(1, max_length + 1):
+        prob = model.fprop((image, y), inference=True).get()[:, :-be.bsz].copy()
+        pred = np.argmax(prob, axis=0)
+        prob.fill(0)
+        for i in range(step * be.bsz):
+            prob[pred[i], i] = 1
+        y[:] = prob
+    expected = np.argmax(y.get(), axis=0).reshape((max_length, be.bsz))
+
+    decoder = CaptionDecoder(model, be.bsz)
+    indices = decoder.greedy(image, max_length)
+    assert np.array_equal(indices, expected)
+    # the decoder state is reset for every batch
+    assert np.array_equal(decoder.greedy(image, max_length), expected)
+
+    # the beam search finds sentences at least as likely as the greedy ones
+    beam = CaptionDecoder(model, be.bsz, beam_width=3).beam_search(image, max_length, 0)
+    greedy_logprob = sentence_logprob(model, image, indices)
+    beam_logprob = sentence_logprob(model, image, beam)
+    assert np.all(beam_logprob >= greedy_logprob - 1e-4)
@@ -18,7 +18,7 @@ import numpy as np
 import os
 
 from neon import NervanaObject
-from neon.data import ArrayIterator, load_mnist
+from neon.data import ArrayIterator, MemmapIterator, PrefetchIterator, load_mnist
 from neon.data.text import Text
 
 logging.basicConfig(level=20)
@@ -37,6 +37,111 @@ def test_dataset(backend_default, data):
         train_set.index = 0
 
 
+def test_prefetch(backend_default):
+    be = NervanaObject.be
+    be.bsz = 16
+    X = np.random.rand(be.bsz * 5 + 3, 10)
+    y = np.random.randint(0, 4, X.shape[0])
+
+    for depth in [1, 3]:
+        # the uneven last minibatch makes consecutive epochs differ
+        ref_set = ArrayIterator(X, y, nclass=4)
+        nbatches = ref_set.nbatches
+        ref = [[(x.get().copy(), t.get().copy()) for x, t in ref_set] for epoch in range(3)]
+
+        train_set = PrefetchIterator(ArrayIterator(X, y, nclass=4), depth=depth)
+        assert train_set.nbatches == nbatches
+        assert train_set.shape == ref_set.shape
+        for epoch in range(3):
+            batches = [(x.get().copy(), t.get().copy()) for x, t in train_set]
+            assert len(batches) == len(ref[epoch])
+            for (x, t), (x_ref, t_ref) in zip(batches, ref[epoch]):
+                assert np.all(x == x_ref) and np.all(t == t_ref)
+
+    # autoencoder targets stay the same buffer as the inputs
+    ae_set = PrefetchIterator(ArrayIterator(X))
+    for x, t in ae_set:
+        assert x is t
+
+    # leaving an epoch early stops the worker
+    for i, batch in enumerate(ae_set):
+        if i == 1:
+            break
+    assert len(list(ae_set)) > 0
+
+
+def test_sampling(backend_default):
+    be = NervanaObject.be
+    be.bsz = 16
+    X = np.arange(be.bsz * 8 * 3, dtype=np.float32).reshape((-1, 3))
+    y = (np.arange(X.shape[0]) % 8 == 0).astype(np.int32)  # 1 in 8 is class 1
+
+    # every epoch is a different permutation of the examples
+    train_set = ArrayIterator(X, y, nclass=2, shuffle=True)
+    epochs = []
+    for epoch in range(2):
+        batches = [(x.get().copy(), t.get().copy()) for x, t in train_set]
+        ids = np.concatenate([x[0] / 3 for x, t in batches]).astype(np.int32)
+        assert np.all(np.sort(ids) == np.arange(X.shape[0]))
+        for x, t in batches:
+            assert np.all(np.argmax(t, axis=0) == y[(x[0] / 3).astype(np.int32)])
+        epochs.append(ids)
+    assert np.any(epochs[0] != epochs[1])
+
+    # each minibatch has the class proportions of the dataset
+    train_set = ArrayIterator(X, y, nclass=2, shuffle=True, stratify=True)
+    for x, t in train_set:
+        assert t.get()[1].sum() == 2
+
+    # balanced weights draw both classes about equally often
+    train_set = ArrayIterator(X, y, nclass=2, sample_weights='balanced')
+    counts = np.zeros(2)
+    for epoch in range(10):
+        for x, t in train_set:
+            counts += t.get().sum(axis=1)
+    assert abs(counts[1] / counts.sum() - 0.5) < 0.1
+
+    # the two ways of drawing an epoch do not combine
+    try:
+        ArrayIterator(X, y, nclass=2, stratify=True, sample_weights='balanced')
+        assert False, "stratify with sample_weights should raise"
+    except ValueError:
+        pass
+
+
+def test_memmap_iterator(backend_default, tmpdir):
+    be = NervanaObject.be
+    be.bsz = 16
+    X = np.random.rand(be.bsz * 7 + 5, 12).astype(np.float32)
+    y = np.random.randint(0, 5, X.shape[0])
+
+    # shards of X and y split at different places
+    paths = []
+    for i, (lo, hi) in enumerate([(0, 30), (30, 31), (31, X.shape[0])]):
+        paths.append(str(tmpdir.join('x%d.npy' % i)))
+        np.save(paths[-1], X[lo:hi])
+    ypath = str(tmpdir.join('y.npy'))
+    np.save(ypath, y)
+
+    ref_set = ArrayIterator(X, y, nclass=5)
+    ref = [[(x.get().copy(), t.get().copy()) for x, t in ref_set] for epoch in range(3)]
+
+    train_set = MemmapIterator(paths, [np.load(ypath, mmap_mode='r')], nclass=5,
+                               block_batches=2)
+    for epoch in range(3):
+        batches = [(x.get().copy(), t.get().copy()) for x, t in train_set]
+        assert len(batches) == len(ref[epoch])
+        for (x, t), (x_ref, t_ref) in zip(batches, ref[epoch]):
+            assert np.allclose(x, x_ref) and np.all(t == t_ref)
+
+    # shuffled blocks visit every example once per epoch
+    X = X[:be.bsz * 6]
+    train_set = MemmapIterator(X, block_batches=2, shuffle_blocks=True)
+    for epoch in range(2):
+        seen = np.vstack([x.get().T.copy() for x, t in train_set])
+        assert np.allclose(np.sort(seen, axis=0), np.sort(X, axis=0))
+
+
 def test_text(backend_default):
     text_data = (
         'Lorem ipsum dolor sit amet, consectetur adipisicing elit, '
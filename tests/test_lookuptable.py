@@ -153,6 +153,34 @@ def test_lookuptable_rand_error(backend_default, basic_linargs):
     return
 
 
+def test_lookuptable_sparse_rows(backend_cpu64):
+    nin, nout, batch_size, vocab_size = 4, 6, 16, 100
+    NervanaObject.be.bsz = batch_size
+
+    layer = LookupTable(
+        vocab_size=vocab_size, embedding_dim=nout, init=GlorotUniform(), pad_idx=0)
+    layer.configure(nin)
+    layer.allocate()
+    layer.prev_layer = True  # Hack to force delta buffer allocation
+    layer.set_deltas([layer.be.iobuf(nin)])
+
+    for step in range(2):
+        inp = np.random.random_integers(0, vocab_size / 2 - 1, size=nin*batch_size)
+        inp += step * vocab_size / 2
+        layer.fprop(layer.be.array(inp.reshape((nin, batch_size))))
+        err = np.random.random((nout, nin * batch_size))
+        layer.bprop(layer.be.array(err))
+
+        # only the word ids of this minibatch (without padding) have gradients
+        rows = np.setdiff1d(np.unique(inp), [0])
+        assert np.all(layer.dW.sparse_rows == rows)
+
+        dw_exp = np.zeros((vocab_size, nout))
+        np.add.at(dw_exp, inp, err.T)
+        dw_exp[0] = 0
+        assert np.allclose(layer.dW.get(), dw_exp, rtol=0, atol=1e-10)
+
+
 if __name__ == '__main__':
 
     fargs = [1, 128, 1, 1]
@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test that training with the data parallel mcpu backend matches training on a
+single process, that its processes start from the same weights and that only
+one of them writes the checkpoints.  The mcpu runs fork, so they run in a
+separate interpreter.
+"""
+import os
+import subprocess
+import sys
+import numpy as np
+
+from neon.backends import gen_backend
+from neon.callbacks.callbacks import Callbacks
+from neon.data import ArrayIterator, MemmapIterator
+from neon.initializers import Gaussian, Constant
+from neon.layers import Affine, GeneralizedCost
+from neon.models import Model
+from neon.optimizers import GradientDescentMomentum
+from neon.transforms import Rectlin, Softmax, CrossEntropyMulti, Misclassification
+from neon.util.persist import load_obj, save_obj
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(32 * 4 + 3, 20)
+    y = rng.randint(0, 4, X.shape[0])
+    return X, y
+
+
+def make_model():
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    return Model(layers=[Affine(nout=16, init=init_norm, bias=Constant(0), activation=Rectlin()),
+                         Affine(nout=4, init=init_norm, activation=Softmax())])
+
+
+def train(backend, path, num_procs=2, rng_seed=0, num_epochs=2, save_dir=None,
+          rank_paths=False):
+    """
+    Train a small model and save its parameters to path, or to path % rank
+    in every process if rank_paths is set.  With save_dir the model is also
+    checkpointed there, with history and the best state.
+    """
+    be = gen_backend(backend=backend, batch_size=32, rng_seed=rng_seed, num_procs=num_procs)
+    X, y = make_data()
+    if backend == 'cpu':
+        # the example left over by the two mcpu processes
+        X, y = X[:-1], y[:-1]
+    train_set = ArrayIterator(X, y, nclass=4)
+
+    mlp = make_model()
+    if save_dir is None:
+        callbacks = Callbacks(mlp, progress_bar=False)
+    else:
+        eval_set = ArrayIterator(X, y, nclass=4)
+        callbacks = Callbacks(mlp, progress_bar=False, eval_set=eval_set, eval_freq=1,
+                              save_path=os.path.join(save_dir, 'model.pkl'), serialize=1,
+                              history=2)
+        callbacks.add_save_best_state_callback(os.path.join(save_dir, 'best.pkl'))
+    mlp.fit(train_set, cost=GeneralizedCost(costfunc=CrossEntropyMulti()),
+            optimizer=GradientDescentMomentum(0.1, 0.9), num_epochs=num_epochs,
+            callbacks=callbacks)
+    if rank_paths:
+        save_obj(mlp.serialize(keep_states=False), path % be.rank)
+    else:
+        mlp.save_params(path, keep_states=False)
+
+
+def train_mcpu(path, **kwargs):
+    args = ''.join(', %s=%r' % item for item in kwargs.items())
+    code = 'from tests.test_mcpu import train; train("mcpu", %r%s)' % (path, args)
+    subprocess.check_call([sys.executable, '-c', code], cwd=root)
+
+
+def infer(backend, path):
+    """
+    Save the outputs and the misclassification of an untrained model on the
+    whole dataset to path % rank, and whether fit refused an iterator that
+    cannot split its data.
+    """
+    be = gen_backend(backend=backend, batch_size=32, rng_seed=0, num_procs=2)
+    X, y = make_data()
+    data = ArrayIterator(X, y, nclass=4)
+    mlp = make_model()
+    result = {'outputs': mlp.get_outputs(data),
+              'misclass': mlp.eval(data, Misclassification()),
+              'refused': False}
+    try:
+        mlp.fit(MemmapIterator(X, y, nclass=4), cost=GeneralizedCost(costfunc=CrossEntropyMulti()),
+                optimizer=GradientDescentMomentum(0.1, 0.9), num_epochs=1,
+                callbacks=Callbacks(mlp, progress_bar=False))
+    except ValueError:
+        result['refused'] = True
+    save_obj(result, path % be.rank)
+
+
+def reduce_mismatched(path):
+    """
+    Reduce tensors of different sizes in the two processes, which should
+    raise in both, and write path % rank in each process that raised.
+    """
+    be = gen_backend(backend='mcpu', batch_size=32, num_procs=2)
+    try:
+        be.allreduce([be.zeros((be.rank + 1, 4))])
+    except RuntimeError:
+        open(path % be.rank, 'w').close()
+
+
+def layer_weights(pdict):
+    return [l['params']['W'] for l in pdict['model']['config']['layers'] if 'params' in l]
+
+
+def test_mcpu_matches_cpu(tmpdir):
+    path_cpu = str(tmpdir.join('cpu.pkl'))
+    path_mcpu = str(tmpdir.join('mcpu.pkl'))
+    train('cpu', path_cpu)
+    train_mcpu(path_mcpu)
+
+    params = [Model(path).layers.layers for path in (path_cpu, path_mcpu)]
+    ntrained = 0
+    for l_cpu, l_mcpu in zip(*params):
+        if l_cpu.has_params:
+            assert np.allclose(l_cpu.W.get(), l_mcpu.W.get(), rtol=0, atol=1e-5)
+            ntrained += 1
+    assert ntrained == 3
+
+
+def test_mcpu_unseeded(tmpdir):
+    # without a seed the processes still start from the same weights
+    path = str(tmpdir.join('rank%d.pkl'))
+    train_mcpu(path, rng_seed=None, rank_paths=True)
+    weights = [layer_weights(load_obj(path % rank)) for rank in range(2)]
+    assert len(weights[0]) == 3
+    for W0, W1 in zip(*weights):
+        assert np.array_equal(W0, W1)
+
+
+def test_mcpu_serialize(tmpdir):
+    # only the first process writes the checkpoints
+    save_dir = str(tmpdir.mkdir('checkpoints'))
+    path = str(tmpdir.join('mcpu.pkl'))
+    train_mcpu(path, num_epochs=4, save_dir=save_dir)
+
+    # the last three checkpoints are kept
+    assert sorted(os.listdir(save_dir)) == ['best.pkl', 'model.pkl', 'model_1.pkl',
+                                            'model_2.pkl', 'model_3.pkl']
+    assert os.readlink(os.path.join(save_dir, 'model.pkl')) == 'model_3.pkl'
+    final = layer_weights(load_obj(path))
+    for W, W_ckpt in zip(final, layer_weights(load_obj(os.path.join(save_dir, 'model.pkl')))):
+        assert np.array_equal(W, W_ckpt)
+
+
+def test_mcpu_reduce_mismatched(tmpdir):
+    path = str(tmpdir.join('raised%d'))
+    code = 'from tests.test_mcpu import reduce_mismatched; reduce_mismatched(%r)' % path
+    subprocess.check_call([sys.executable, '-c', code], cwd=root)
+    assert all(os.path.exists(path % rank) for rank in range(2))
+
+
+def test_mcpu_inference(tmpdir):
+    # evaluation and inference sets are not split between the processes, and
+    # training on an iterator that cannot split its data raises
+    path = str(tmpdir.join('%s%%d.pkl'))
+    infer('cpu', path % 'cpu')
+    code = 'from tests.test_mcpu import infer; infer("mcpu", %r)' % (path % 'mcpu')
+    subprocess.check_call([sys.executable, '-c', code], cwd=root)
+
+    expected = load_obj(path % 'cpu' % 0)
+    assert expected['outputs'].shape == (32 * 4 + 3, 4)
+    assert not expected['refused']
+    for rank in range(2):
+        result = load_obj(path % 'mcpu' % rank)
+        assert np.allclose(result['outputs'], expected['outputs'], rtol=0, atol=1e-6)
+        assert np.allclose(result['misclass'], expected['misclass'])
+        assert result['refused']
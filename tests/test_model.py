@@ -19,11 +19,16 @@ from neon.backends import gen_backend
 from neon.data import ArrayIterator, load_mnist, Text
 from neon.data.dataloaders import load_ptb_test
 from neon.initializers import Gaussian, Constant
-from neon.layers import GeneralizedCost, Affine
+from neon.layers import GeneralizedCost, Affine, BatchNorm, Bias
 from neon.layers import Dropout, Conv, Pooling, Sequential, MergeMultistream, Recurrent
+from neon.layers import BranchNode, MergeBroadcast, SingleOutputTree, Tree
+from neon.layers.container import ActivationPlan
+from neon.callbacks.callbacks import Callbacks, SerializeModelCallback, LossCallback, Callback
+from neon.callbacks.callbacks import latest_train_cost
 from neon.models import Model
 from neon.optimizers import GradientDescentMomentum
-from neon.transforms import Rectlin, Logistic, CrossEntropyBinary
+from neon.transforms import Rectlin, Logistic, CrossEntropyBinary, Misclassification
+from neon.util.persist import load_obj, load_checkpoint
 
 
 def test_model_get_outputs_rnn(backend_default, data):
@@ -158,6 +163,333 @@ def test_model_serialize(backend_default, data):
 
     os.remove(tmp_save)
 
+
+def test_model_checkpoint(backend_default, tmpdir):
+    be = backend_default
+    X = np.random.rand(be.bsz * 2, 2 * 6 * 6)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10, lshape=(2, 6, 6))
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    layers = [Conv((3, 3, 4), init=init_norm, bias=Constant(0), activation=Rectlin()),
+              Affine(nout=20, init=init_norm, batch_norm=True, activation=Rectlin()),
+              Affine(nout=10, init=init_norm, activation=Logistic(shortcut=True))]
+    mlp = Model(layers=layers)
+    mlp.optimizer = GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9)
+    mlp.cost = GeneralizedCost(costfunc=CrossEntropyBinary())
+    mlp.initialize(train_set, cost=mlp.cost)
+    for x, t in train_set:
+        x = mlp.fprop(x)
+        mlp.bprop(mlp.cost.get_errors(x, t))
+        mlp.optimizer.optimize(mlp.layers_to_optimize, epoch=0)
+
+    ckpt_path = str(tmpdir.join('model.ckpt'))
+    pkl_path = str(tmpdir.join('model.pkl'))
+    mlp.save_params(ckpt_path)
+    mlp.save_params(pkl_path)
+
+    # the weights are mapped from the file instead of being read
+    pdict = load_obj(ckpt_path)
+    W = pdict['model']['config']['layers'][0]['params']['W']
+    assert isinstance(W, np.memmap)
+    assert W.ctypes.data % 64 == 0
+    assert np.array_equal(W, mlp.layers.layers[0].W.get())
+
+    def check_equal(a, b):
+        if isinstance(a, dict):
+            assert sorted(a.keys()) == sorted(b.keys())
+            for k in a:
+                check_equal(a[k], b[k])
+        elif isinstance(a, (list, tuple)):
+            assert len(a) == len(b)
+            for _a, _b in zip(a, b):
+                check_equal(_a, _b)
+        elif isinstance(a, np.ndarray):
+            assert a.dtype == b.dtype and np.array_equal(a, b)
+        else:
+            assert a == b
+    check_equal(load_checkpoint(ckpt_path, mmap_mode=None), load_obj(pkl_path))
+
+    outputs_exp = [mlp.fprop(xb, inference=True).get().copy() for xb, tb in train_set]
+    for path in (ckpt_path, pkl_path):
+        mlp_new = Model(path)
+        mlp_new.initialize(train_set)
+        for i, (x, t) in enumerate(train_set):
+            assert np.allclose(mlp_new.fprop(x, inference=True).get(), outputs_exp[i])
+
+    # load into the tensors of an existing model
+    mlp.layers.layers[0].W[:] = 0
+    mlp.load_params(ckpt_path, load_states=False)
+    for i, (x, t) in enumerate(train_set):
+        assert np.allclose(mlp.fprop(x, inference=True).get(), outputs_exp[i])
+
+
+def test_model_inference_only(backend_default):
+    be = backend_default
+    X = np.random.rand(be.bsz * 2, 2 * 6 * 6)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10, lshape=(2, 6, 6))
+
+    def make_model(suffix, container=Tree):
+        init_norm = Gaussian(loc=0.0, scale=0.1)
+        common = dict(init=init_norm, bias=Constant(0), activation=Rectlin())
+        bnode = BranchNode(name='bnode_%s_%s' % (container.__name__, suffix))
+        merge = MergeBroadcast([[Conv((1, 1, 4), **common)],
+                                [Conv((3, 3, 4), padding=1, **common),
+                                 Conv((3, 3, 2), padding=1, **common)]], merge='depth')
+        trunk = [Conv((3, 3, 8), padding=1, **common), bnode, merge,
+                 Dropout(keep=0.5), Affine(nout=20, **common),
+                 Affine(nout=10, init=init_norm, activation=Logistic())]
+        branch = [bnode, Affine(nout=30, **common), Affine(nout=5, **common)]
+        return Model(layers=container([trunk, branch]))
+
+    for container in (Tree, SingleOutputTree):
+        be.rng_reset()
+        mlp = make_model('train', container)
+        mlp.initialize(train_set)
+        outputs_exp = []
+        for x, t in train_set:
+            out = mlp.fprop(x, inference=True)
+            outputs_exp.append([o.get().copy() for o in (out if isinstance(out, list) else [out])])
+
+        be.rng_reset()
+        mlp_inf = make_model('inference', container)
+        mlp_inf.initialize(train_set, inference=True)
+        for i, (x, t) in enumerate(train_set):
+            out = mlp_inf.fprop(x, inference=True)
+            out = out if isinstance(out, list) else [out]
+            assert len(out) == len(outputs_exp[i])
+            for o, o_exp in zip(out, outputs_exp[i]):
+                assert np.allclose(o.get(), o_exp, rtol=0, atol=1e-5)
+
+        # no deltas, and the activations are packed into fewer buffers
+        trunk = mlp_inf.layers.layers[0]
+        assert all(l.deltas is None for l in trunk.layers)
+        plan = ActivationPlan(mlp_inf.layers)
+        assert len(plan.buffer_sizes) < len(plan.activations)
+
+        try:
+            mlp_inf.fit(train_set, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+                        optimizer=GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9),
+                        num_epochs=1, callbacks=Callbacks(mlp_inf, progress_bar=False))
+            assert False, "an inference only model should not be trainable"
+        except ValueError:
+            pass
+
+
+def test_model_fold_batch_norm(backend_default, tmpdir):
+    be = backend_default
+    X = np.random.rand(be.bsz * 2, 2 * 6 * 6)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10, lshape=(2, 6, 6))
+
+    be.rng_reset()
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    common = dict(init=init_norm, batch_norm=True, activation=Rectlin())
+    merge = MergeBroadcast([[Conv((1, 1, 4), **common)],
+                            [Conv((3, 3, 4), padding=1, **common)]], merge='depth')
+    layers = [Conv((3, 3, 8), padding=1, **common), merge,
+              Affine(nout=20, **common),
+              Affine(nout=10, init=init_norm, activation=Logistic())]
+    mlp = Model(layers=layers)
+    mlp.fit(train_set, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+            optimizer=GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9),
+            num_epochs=2, callbacks=Callbacks(mlp, progress_bar=False))
+    outputs_exp = [mlp.fprop(x, inference=True).get().copy() for x, t in train_set]
+    param_path = str(tmpdir.join('model.pkl'))
+    mlp.save_params(param_path)
+
+    def check_folded(model):
+        for x, out_exp in zip((x for x, t in train_set), outputs_exp):
+            assert np.allclose(model.fprop(x, inference=True).get(), out_exp,
+                               rtol=0, atol=1e-4)
+
+        def layers(l):
+            return sum([layers(c) for c in l.layers], []) if hasattr(l, 'layers') else [l]
+        model_layers = layers(model.layers)
+        assert not any(isinstance(l, BatchNorm) for l in model_layers)
+        assert sum(1 for l in model_layers if type(l) is Bias) == 4
+
+    # folded once trained
+    assert mlp.fold_batch_norm() == 4
+    assert mlp.inference_only
+    check_folded(mlp)
+
+    # folded once loaded, before being initialized
+    mlp_inf = Model(param_path)
+    assert mlp_inf.fold_batch_norm() == 4
+    mlp_inf.initialize(train_set, inference=True)
+    check_folded(mlp_inf)
+
+
+def test_model_recompute(backend_default):
+    be = backend_default
+    X = np.random.rand(be.bsz * 2, 2 * 8 * 8)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10, lshape=(2, 8, 8))
+
+    def train(recompute_segment):
+        be.rng_reset()
+        init_norm = Gaussian(loc=0.0, scale=0.1)
+        common = dict(init=init_norm, bias=Constant(0), activation=Rectlin())
+        layers = [Conv((3, 3, 4), padding=1, **common),
+                  Conv((3, 3, 4), padding=1, **common),
+                  Pooling(2),
+                  Conv((3, 3, 8), padding=1, **common),
+                  Conv((3, 3, 8), padding=1, **common),
+                  Affine(nout=20, **common),
+                  Dropout(keep=0.5),
+                  Affine(nout=20, init=init_norm, batch_norm=True, activation=Rectlin()),
+                  Affine(nout=20, **common),
+                  Affine(nout=10, init=init_norm, activation=Logistic())]
+        mlp = Model(layers=layers, recompute_segment=recompute_segment)
+        optimizer = GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9)
+        mlp.fit(train_set, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+                optimizer=optimizer, num_epochs=2,
+                callbacks=Callbacks(mlp, progress_bar=False))
+        return mlp
+
+    mlp = train(None)
+    for segment in (1, 2, 'auto'):
+        mlp_rc = train(segment)
+        assert mlp_rc.layers.segments
+        for l, l_rc in zip(mlp.layers_to_optimize, mlp_rc.layers_to_optimize):
+            if hasattr(l, 'W'):
+                assert np.allclose(l.W.get(), l_rc.W.get(), rtol=0, atol=1e-5)
+        for x, t in train_set:
+            assert np.allclose(mlp.fprop(x, inference=True).get(),
+                               mlp_rc.fprop(x, inference=True).get(), rtol=0, atol=1e-5)
+
+    # the recomputed layers share the scratch buffers
+    assert [len(seg) for seg in mlp_rc.layers.segments] == [3, 1, 1]
+    scratch = mlp_rc.layers.scratch[0]
+    for seg in mlp_rc.layers.segments:
+        outputs = seg[0][0].outputs
+        assert outputs is scratch or outputs.base is scratch
+
+
+def test_serialize_callback_async(backend_default, tmpdir):
+    be = backend_default
+    X = np.random.rand(be.bsz * 3, 20)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10)
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    mlp = Model(layers=[Affine(nout=20, init=init_norm, bias=init_norm, activation=Rectlin()),
+                        Affine(nout=10, init=init_norm, activation=Logistic(shortcut=True))])
+    save_path = str(tmpdir.join('model.ckpt'))
+    callbacks = Callbacks(mlp, progress_bar=False)
+    callbacks.add_callback(SerializeModelCallback(save_path, history=2, async_save=True,
+                                                  minibatch_freq=2))
+    mlp.fit(train_set, optimizer=GradientDescentMomentum(0.1, momentum_coef=0.9),
+            num_epochs=2, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+            callbacks=callbacks)
+
+    # the mid epoch and end of epoch checkpoints, the last three are kept
+    assert sorted(os.listdir(str(tmpdir))) == ['model.ckpt', 'model_0.ckpt',
+                                               'model_1.ckpt', 'model_1_1.ckpt']
+    assert os.readlink(save_path) == 'model_1.ckpt'
+
+    # the snapshot of the last minibatch matches the final weights
+    pdict = load_obj(save_path)
+    W = pdict['model']['config']['layers'][0]['params']['W']
+    assert np.array_equal(W, mlp.layers.layers[0].W.get())
+    assert pdict['epoch_index'] == 2
+
+
+def test_eval_callbacks_single_pass(backend_default):
+    be = backend_default
+    X = np.random.rand(be.bsz * 3 - 5, 20)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10)
+    eval_set = ArrayIterator(X[::-1].copy(), y[::-1].copy(), nclass=10)
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    mlp = Model(layers=[Affine(nout=20, init=init_norm, bias=init_norm, activation=Rectlin()),
+                        Affine(nout=10, init=init_norm, activation=Logistic(shortcut=True))])
+    callbacks = Callbacks(mlp, eval_set=eval_set, eval_freq=1, metric=Misclassification(),
+                          progress_bar=False)
+
+    # count the inference minibatches
+    fprop = mlp.fprop
+    counts = []
+
+    def counted_fprop(x, inference=False):
+        if inference:
+            counts[-1] += 1
+        return fprop(x, inference)
+    mlp.fprop = counted_fprop
+
+    class Check(LossCallback):
+        def on_train_begin(self, callback_data, model, epochs):
+            pass
+
+        def on_epoch_begin(self, callback_data, model, epoch):
+            counts.append(0)
+
+        def eval_end(self, callback_data, model, epoch):
+            # loss and metric computed separately match the shared pass
+            assert counts[-1] == eval_set.nbatches
+            assert np.allclose(callback_data['cost/loss'][epoch],
+                               float(self.loss.get()) / eval_set.ndata)
+            assert np.allclose(callback_data['metrics/Top1Misclass'][epoch],
+                               model.eval(eval_set, Misclassification()))
+
+    callbacks.add_callback(Check(eval_set, 1))
+    mlp.fit(train_set, optimizer=GradientDescentMomentum(0.1, momentum_coef=0.9),
+            num_epochs=2, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+            callbacks=callbacks)
+
+
+def test_buffered_callback_data(backend_default):
+    be = backend_default
+    X = np.random.rand(be.bsz * 5, 20)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10)
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    mlp = Model(layers=[Affine(nout=20, init=init_norm, bias=init_norm, activation=Rectlin()),
+                        Affine(nout=10, init=init_norm, activation=Logistic(shortcut=True))])
+    callbacks = Callbacks(mlp, progress_bar=False)
+    callbacks.callbacks[0].chunk_size = 3
+    callbacks.add_hist_callback(plot_per_mini=True)
+    callbacks.callbacks[-1].chunk_size = 4
+
+    class Check(Callback):
+        costs = []
+        latest = []
+
+        def on_minibatch_end(self, callback_data, model, epoch, minibatch):
+            self.costs.append(float(model.cost.cost.get()))
+            # reading the latest cost for display does not write out the chunk
+            buf_len = callbacks.callbacks[0].buf_len
+            self.latest.append(latest_train_cost(callback_data, len(self.costs) - 1))
+            assert callbacks.callbacks[0].buf_len == buf_len
+
+        def on_train_end(self, callback_data, model):
+            # the running average of the cost of the last 10 minibatches
+            costs = self.costs
+            assert len(costs) == 10
+            mean_costs = [np.mean(costs[max(0, i - 9):i + 1]) for i in range(len(costs))]
+            assert np.allclose(callback_data['cost/train'][:], mean_costs)
+            assert np.allclose(self.latest, mean_costs)
+
+            # a histogram of the weights at every minibatch
+            for l_i, l in enumerate(model.layers.layers):
+                if hasattr(l, 'W'):
+                    hist = callback_data['hist/%s_%d_W' % (l.name, l_i)][:]
+                    assert hist.shape == (be.hist_bins, 10)
+                    assert (hist.sum(axis=0) == l.W.size).all()
+            self.checked = True
+
+    check = Check()
+    callbacks.add_callback(check)
+    mlp.fit(train_set, optimizer=GradientDescentMomentum(0.1, momentum_coef=0.9),
+            num_epochs=2, cost=GeneralizedCost(costfunc=CrossEntropyBinary()),
+            callbacks=callbacks)
+    assert check.checked
+
+
 if __name__ == '__main__':
     be = gen_backend(backend='gpu', batch_size=50)
     test_model_get_outputs_rnn(be, '~/nervana/data')
@@ -26,6 +26,7 @@ from neon.optimizers import GradientDescentMomentum, RMSProp, Adadelta, Adam, Ad
 from neon.optimizers import MultiOptimizer
 from neon.layers import Conv, Affine, LSTM, GRU
 from neon.initializers import Gaussian, Constant
+from neon.models import Model
 from neon.transforms import Rectlin, Logistic, Tanh
 
 
@@ -142,6 +143,54 @@ def test_adam(backend_default):
     compare_tensors(adam, param_list, param2, tol=1e-7, epoch=epoch)
 
 
+def sparse_param_list(rows, nstates=1):
+    param = np.random.rand(200, 16)
+    grad = np.zeros((200, 16))
+    grad[rows] = 0.01 * np.random.rand(len(rows), 16)
+    states = [0.01 * np.random.rand(200, 16) for i in range(nstates)]
+    return param, grad, states
+
+
+def run_sparse(opt, param, grad, states, rows):
+    param_list = [((wrap(param), wrap(grad)), [wrap(s) for s in states])]
+    if rows is not None:
+        param_list[0][0][1].sparse_rows = rows
+    opt.optimize([DummyLayer(param_list)], epoch=1)
+    (param, grad), states = param_list[0]
+    return param.get(), [s.get() for s in states]
+
+
+def test_sparse_exact(backend_cpu64):
+    # without decaying state the row sparse update matches the dense one
+    rows = np.array([3, 17, 42, 150])
+    for opt in [Adagrad(), GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.0)]:
+        param, grad, states = sparse_param_list(rows)
+        dense = run_sparse(opt, param, grad, states, None)
+        sparse = run_sparse(opt, param, grad, states, rows)
+        assert np.allclose(dense[0], sparse[0], rtol=0, atol=1e-7)
+        assert np.allclose(dense[1][0][rows], sparse[1][0][rows], rtol=0, atol=1e-7)
+
+
+def test_sparse_lazy(backend_cpu64):
+    # lazy updates match the dense update on the given rows and leave the
+    # other rows and their states untouched
+    rows = np.array([0, 5, 6, 199])
+    others = np.setdiff1d(np.arange(200), rows)
+    opts = [(GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9, wdecay=0.005,
+                                     sparse_updates=True), 1),
+            (RMSProp(sparse_updates=True), 1),
+            (Adam(sparse_updates=True), 2)]
+    for opt, nstates in opts:
+        param, grad, states = sparse_param_list(rows, nstates)
+        dense = run_sparse(opt, param, grad, states, None)
+        sparse = run_sparse(opt, param, grad, states, rows)
+        assert np.allclose(dense[0][rows], sparse[0][rows], rtol=0, atol=1e-7)
+        assert np.all(sparse[0][others] == np.float32(param[others]))
+        for s, s_dense, s_sparse in zip(states, dense[1], sparse[1]):
+            assert np.allclose(s_dense[rows], s_sparse[rows], rtol=0, atol=1e-7)
+            assert np.all(s_sparse[others] == np.float32(s[others]))
+
+
 def test_multi_optimizer(backend_default):
     opt_gdm = GradientDescentMomentum(
         learning_rate=0.001, momentum_coef=0.9, wdecay=0.005)
@@ -179,6 +228,46 @@ def test_multi_optimizer(backend_default):
     assert map_list[opt_gdm][0].__class__.__name__ == 'Activation'
     assert map_list[opt_rms_1][0].__class__.__name__ == 'LSTM'
     assert map_list[opt_rms_1][1].__class__.__name__ == 'GRU'
+    # the optimizers run in the order of their first layer
+    assert list(map_list) == [opt_adam, opt_ada, opt_gdm, opt_rms, opt_rms_1]
+
+
+def test_param_arena(backend_default):
+    be = backend_default
+    init = Gaussian(scale=0.1)
+    model = Model([Affine(nout=16, init=init, bias=init),
+                   LSTM(16, init, activation=Tanh(), gate_activation=Logistic())])
+    model.initialize((8, 4))
+    layers = model.layers_to_optimize
+    lrate, mom = 0.1, 0.9
+    gdm = GradientDescentMomentum(learning_rate=lrate, momentum_coef=mom)
+
+    def step(grads):
+        for l, g in zip(layers, grads):
+            l.get_params()[0][1].set(g)
+        gdm.optimize(layers, epoch=0)
+
+    params = [l.get_params()[0][0].get() for l in layers]
+    grads = [np.random.rand(*p.shape) for p in params]
+    step(grads)
+    # a single buffer holds all the parameters
+    assert len(gdm.param_arena.param_list) == 1
+    velocity = [-lrate * g / be.bsz for g in grads]
+    params = [p + v for p, v in zip(params, velocity)]
+    for l, p in zip(layers, params):
+        assert np.allclose(l.get_params()[0][0].get(), p, rtol=0, atol=1e-6)
+
+    # the views of the layers still write into the arena
+    lstm = layers[-1]
+    lstm.dW_input[:] = 1
+    grads = [np.random.rand(*p.shape) for p in params[:-1]] + [lstm.dW.get()]
+    step(grads[:-1])
+    for l, p, v, g in zip(layers, params, velocity, grads):
+        assert np.allclose(l.get_params()[0][0].get(), p + mom * v - lrate * g / be.bsz,
+                           rtol=0, atol=1e-6)
+    nin = lstm.weight_shape[1]
+    assert np.allclose(lstm.W_input.get(), lstm.W.get()[:nin].reshape(lstm.W_input.shape))
+
 
 if __name__ == '__main__':
     be = gen_backend(backend='gpu', batch_size=50)
@@ -0,0 +1,121 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of the minibatches of PASCALVOC loaded on worker processes against those
+loaded on the training thread, on a small synthetic ROI database.
+"""
+import multiprocessing
+import os
+import numpy as np
+from PIL import Image
+
+from neon.backends import gen_backend
+from neon.data import PASCALVOC
+from neon.data.pascal_voc import FRCN_IOU_THRE, FRCN_ROI_DB_VERSION
+from neon.util.persist import save_obj
+
+nimages, nrois = 4, 12
+
+
+def make_voc(path):
+    """
+    Lay out a VOC 2007 trainval directory holding a few small JPEGs and a
+    cached ROI database, with the archives in place so nothing is fetched.
+    """
+    rng = np.random.RandomState(0)
+    voc_root = os.path.join(path, 'VOCdevkit', 'VOC2007')
+    os.makedirs(os.path.join(voc_root, 'ImageSets', 'Main'))
+    os.makedirs(os.path.join(voc_root, 'JPEGImages'))
+    for archive in ('VOCtrainval_06-Nov-2007.tar', 'selective_search_data_pkl.tar.gz'):
+        open(os.path.join(path, archive), 'w').close()
+
+    image_ids = ['%06d' % i for i in range(nimages)]
+    with open(os.path.join(voc_root, 'ImageSets', 'Main', 'trainval.txt'), 'w') as f:
+        f.write('\n'.join(image_ids) + '\n')
+
+    roi_db = []
+    for i, image_id in enumerate(image_ids):
+        height, width = 30 + 2 * i, 40
+        img_file = os.path.join(voc_root, 'JPEGImages', image_id + '.jpg')
+        pixels = rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+        Image.fromarray(pixels).save(img_file)
+
+        xy = rng.randint(0, 20, size=(nrois, 2))
+        wh = rng.randint(1, 10, size=(nrois, 2))
+        # foreground, background and ignored ROIs
+        overlaps = rng.choice([0.05, 0.3, 0.7, 1.0], size=(nrois, 1))
+        classes = rng.randint(1, 21, size=(nrois, 1)) * (overlaps >= FRCN_IOU_THRE)
+        bb_targets = np.hstack((classes, rng.randn(nrois, 4)))
+        roi_db.append({'bb': np.hstack((xy, xy + wh)).astype(np.float32),
+                       'max_overlap_area': overlaps,
+                       'max_overlap_class': classes.astype(np.float64),
+                       'bb_targets': bb_targets,
+                       'img_id': image_id,
+                       'img_file': img_file,
+                       'flipped': i % 2 == 1})
+
+    cache_file = 'voc_2007_trainval_flip_False_ovlp_{}_v{}.pkl'.format(FRCN_IOU_THRE,
+                                                                       FRCN_ROI_DB_VERSION)
+    save_obj(roi_db, os.path.join(voc_root, cache_file))
+
+
+def minibatches(path, num_workers, rois_random_sample, seed=0):
+    gen_backend(backend='cpu', batch_size=2, rng_seed=0)
+    np.random.seed(seed)
+    data = PASCALVOC('trainval', '2007', path=path, img_per_batch=2, rois_per_img=8,
+                     rois_random_sample=rois_random_sample, num_workers=num_workers)
+    blobs = []
+    for X, Y in data:
+        blobs.append([data.img_np.copy(), data.dev_X_rois.get(),
+                      data.dev_y_labels_flat.get(), data.dev_y_bbtargets.get(),
+                      data.dev_y_bbmask.get()])
+    assert len(blobs) == nimages // 2
+    return blobs
+
+
+def assert_same(blobs, ref):
+    for mb, mb_ref in zip(blobs, ref):
+        for blob, blob_ref in zip(mb, mb_ref):
+            assert np.array_equal(blob, blob_ref)
+
+
+def test_pascal_voc_workers(tmpdir):
+    path = str(tmpdir)
+    make_voc(path)
+
+    # without random sampling, the workers give the minibatches of the
+    # training thread
+    ref = minibatches(path, 0, False)
+    assert ref[0][0].any() and ref[0][2].any()
+    assert_same(minibatches(path, 2, False), ref)
+
+    # the ROIs sampled by the workers only depend on the seed of np.random
+    sampled = minibatches(path, 2, True)
+    assert_same(minibatches(path, 2, True), sampled)
+
+
+def test_pascal_voc_close(tmpdir):
+    path = str(tmpdir)
+    make_voc(path)
+    gen_backend(backend='cpu', batch_size=2, rng_seed=0)
+    data = PASCALVOC('trainval', '2007', path=path, img_per_batch=2, rois_per_img=8,
+                     num_workers=2)
+
+    # leaving the epoch early terminates the worker processes
+    epoch = iter(data)
+    next(epoch)
+    assert len(multiprocessing.active_children()) >= 2
+    epoch.close()
+    assert len(multiprocessing.active_children()) == 0
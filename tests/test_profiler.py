@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+'''
+Test of the layer and kernel profiler
+'''
+import json
+import numpy as np
+
+from neon import NervanaObject
+from neon.callbacks.callbacks import Callbacks, ProfilerCallback
+from neon.data import ArrayIterator
+from neon.initializers import Gaussian
+from neon.layers import GeneralizedCost, Affine, Conv, Pooling
+from neon.models import Model
+from neon.optimizers import GradientDescentMomentum
+from neon.transforms import Rectlin, Softmax, CrossEntropyMulti
+from neon.util.profiler import Profiler
+
+
+def make_model():
+    init = Gaussian(scale=0.1)
+    layers = [Conv((3, 3, 4), init=init, activation=Rectlin(), name='conv'),
+              Pooling(2, name='pool'),
+              Affine(nout=3, init=init, activation=Softmax(), name='fc')]
+    return Model(layers=layers)
+
+
+def test_profiler_callback(backend_default, tmpdir):
+    be = NervanaObject.be
+    be.bsz = 8
+    X = np.random.rand(be.bsz * 2, 2 * 8 * 8)
+    y = np.random.randint(0, 3, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=3, lshape=(2, 8, 8))
+
+    model = make_model()
+    cost = GeneralizedCost(costfunc=CrossEntropyMulti())
+    optimizer = GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9, name='gdm')
+    callbacks = Callbacks(model, progress_bar=False)
+    prefix = str(tmpdir.join('profile'))
+    callbacks.add_callback(ProfilerCallback(prefix))
+    model.fit(train_set, cost=cost, optimizer=optimizer, num_epochs=2, callbacks=callbacks)
+
+    for epoch in range(2):
+        with open('%s_%d.summary.json' % (prefix, epoch)) as f:
+            summary = json.load(f)
+        for name in ['conv.fprop', 'conv.bprop', 'pool.fprop', 'fc.fprop', 'gdm.optimize',
+                     'fprop_conv', 'compound_dot', 'execute']:
+            assert summary[name]['calls'] > 0
+        assert summary['conv.fprop']['calls'] == 2
+        assert summary['conv.fprop']['category'] == 'layer'
+        # the FLOPs of the convolution kernels are credited to the layer
+        assert summary['conv.fprop']['flops'] == 2 * 2 * 3 * 3 * 4 * 6 * 6 * be.bsz * 2
+        assert summary['conv.fprop']['flops'] == summary['fprop_conv']['flops']
+
+        with open('%s_%d.trace.json' % (prefix, epoch)) as f:
+            trace = json.load(f)
+        assert len(trace['traceEvents']) == sum(s['calls'] for s in summary.values())
+
+    # the wrapped methods are restored after training
+    assert 'fprop' not in model.layers.layers[0].__dict__
+    assert 'execute' not in be.__dict__
+
+
+def test_profiler_benchmark(backend_default):
+    be = NervanaObject.be
+    be.bsz = 8
+    X = np.random.rand(be.bsz * 2, 2 * 8 * 8)
+    y = np.random.randint(0, 3, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=3, lshape=(2, 8, 8))
+
+    model = make_model()
+    profiler = Profiler(be, trace=False)
+    model.benchmark(train_set, cost=GeneralizedCost(costfunc=CrossEntropyMulti()),
+                    optimizer=GradientDescentMomentum(learning_rate=0.1, momentum_coef=0.9),
+                    niterations=3, nskip=1, profiler=profiler)
+    summary = profiler.summary()
+    assert summary['fc.fprop']['calls'] == 3
+    assert summary['compound_dot']['gflops'] > 0
+    assert len(profiler.events) == 0
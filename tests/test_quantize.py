@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of the int8 quantized inference path, on the CPU backend.
+"""
+import numpy as np
+
+from neon.backends import gen_backend
+from neon.data import ArrayIterator
+from neon.initializers import Gaussian, Constant
+from neon.layers import Affine, Conv, Pooling, LookupTable, QuantizedLinear, QuantizedConvolution
+from neon.models import Model
+from neon.transforms import Rectlin, Softmax, Misclassification
+
+
+def quantize_ref(x, step):
+    return np.clip(np.rint(x / step), -127, 127)
+
+
+def test_compound_dot_int8():
+    be = gen_backend(backend='cpu', datatype=np.float32, batch_size=32, rng_seed=0)
+    rng = np.random.RandomState(0)
+    # long enough for the products to be summed over several blocks
+    A = rng.randint(-127, 128, size=(16, 2500)).astype(np.int8)
+    B = rng.randn(2500, 32).astype(np.float32)
+    w_scale = rng.rand(16, 1).astype(np.float32)
+    x_scale = 0.02
+
+    acc = np.dot(A.astype(np.int64), quantize_ref(B, x_scale).astype(np.int64))
+    expected = acc * w_scale * x_scale
+
+    C = be.empty((16, 32))
+    be.compound_dot_int8(be.array(A, dtype=np.int8), be.array(B), C, be.array(w_scale), x_scale)
+    assert np.allclose(C.get(), expected, rtol=1e-6, atol=0)
+
+    C_prev = C.get().copy()
+    be.compound_dot_int8(be.array(A, dtype=np.int8), be.array(B), C, be.array(w_scale), x_scale,
+                         beta=1.0)
+    assert np.allclose(C.get(), expected + C_prev, rtol=1e-6, atol=0)
+
+
+def test_quantize_model(tmpdir):
+    be = gen_backend(backend='cpu', datatype=np.float32, batch_size=32, rng_seed=0)
+    X = np.random.rand(be.bsz * 3, 2 * 8 * 8)
+    y = np.random.randint(0, 10, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=10, lshape=(2, 8, 8))
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    common = dict(init=init_norm, bias=Constant(0.1), activation=Rectlin())
+    layers = [Conv((3, 3, 8), padding=1, **common),
+              Pooling(2),
+              Conv((3, 3, 8), padding=1, **common),
+              Affine(nout=20, **common),
+              Affine(nout=10, init=init_norm, activation=Softmax())]
+    mlp = Model(layers=layers)
+    mlp.initialize(train_set)
+    outputs_exp = [mlp.fprop(x, inference=True).get().copy() for x, t in train_set]
+
+    qmodel = mlp.quantize(train_set, nbatches=2, eval_set=train_set, metric=Misclassification())
+    qlayers = [l for l in qmodel.layers.layers if isinstance(l, (QuantizedLinear,
+                                                                 QuantizedConvolution))]
+    assert len(qlayers) == 4
+    assert all(l.W.dtype == np.int8 and l.x_scale > 0 for l in qlayers)
+    assert qmodel.inference_only
+
+    outputs = [qmodel.fprop(x, inference=True).get().copy() for x, t in train_set]
+    for out, out_exp in zip(outputs, outputs_exp):
+        assert np.allclose(out, out_exp, rtol=0, atol=2e-2)
+
+    # the int8 weights and the steps are serialized
+    path = str(tmpdir.join('quantized.pkl'))
+    qmodel.save_params(path, keep_states=False)
+    qmodel_new = Model(path)
+    qmodel_new.initialize(train_set, inference=True)
+    for (x, t), out in zip(train_set, outputs):
+        assert np.allclose(qmodel_new.fprop(x, inference=True).get(), out, rtol=0, atol=1e-6)
+
+
+def test_quantize_lookuptable():
+    be = gen_backend(backend='cpu', datatype=np.float32, batch_size=32, rng_seed=0)
+    vocab_size, nin = 50, 6
+    X = np.random.randint(0, vocab_size, size=(be.bsz * 2, nin)).astype(np.float32)
+    y = np.random.randint(0, 4, X.shape[0])
+    train_set = ArrayIterator(X, y, nclass=4)
+
+    init_norm = Gaussian(loc=0.0, scale=0.1)
+    mlp = Model(layers=[LookupTable(vocab_size=vocab_size, embedding_dim=8, init=init_norm),
+                        Affine(nout=4, init=init_norm, bias=Constant(0))])
+    mlp.initialize(train_set)
+    outputs_exp = [mlp.fprop(x, inference=True).get().copy() for x, t in train_set]
+    lut = mlp.layers.layers[0]
+    W = lut.W.get().copy()
+
+    qmodel = mlp.quantize(train_set)
+    qlut = qmodel.layers.layers[0]
+    assert qlut.W.dtype == np.int8 and qlut.w_scale.shape == (vocab_size, 1)
+    # each embedding is off by at most half a step
+    step = np.abs(W).max(axis=1, keepdims=True) / 127.
+    assert np.all(np.abs(qlut.W.get() * qlut.w_scale.get() - W) <= step / 2 + 1e-7)
+
+    for (x, t), out_exp in zip(train_set, outputs_exp):
+        assert np.allclose(qmodel.fprop(x, inference=True).get(), out_exp, rtol=0, atol=1e-2)
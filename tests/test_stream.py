@@ -0,0 +1,112 @@
+# ----------------------------------------------------------------------------
+# Copyright 2015 Nervana Systems Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+"""
+Test of streaming inference against the unrolled fprop of recurrent models.
+"""
+import numpy as np
+
+from neon.initializers import Uniform
+from neon.layers import LSTM, GRU, Recurrent, Affine, Dropout, LookupTable
+from neon.models import Model
+from neon.transforms import Logistic, Tanh, Softmax
+
+vocab_size, nin, hidden_size, seq_len = 11, 6, 8, 5
+
+
+def check_stream(model, x, nsteps_list):
+    """
+    Feed x (feature_size, seq_len * bsz) to fprop_stream in chunks of
+    nsteps_list steps and compare with the full fprop.
+    """
+    be = model.be
+    expected = model.fprop(x, inference=True).get()
+    model.reset_stream()
+    start = 0
+    for nsteps in nsteps_list:
+        cols = slice(start * be.bsz, (start + nsteps) * be.bsz)
+        out = model.fprop_stream(x[:, cols])
+        assert np.allclose(out.get(), expected[:, cols], rtol=0, atol=1e-5)
+        start += nsteps
+
+
+def test_stream(backend_default):
+    be = backend_default
+    init = Uniform(low=-0.5, high=0.5)
+    for rnn in (Recurrent(hidden_size, init, activation=Tanh(), reset_cells=True),
+                LSTM(hidden_size, init, activation=Tanh(), gate_activation=Logistic(),
+                     reset_cells=True),
+                GRU(hidden_size, init, activation=Tanh(), gate_activation=Logistic(),
+                    reset_cells=True)):
+        model = Model([Affine(hidden_size, init, bias=init, activation=Tanh()), Dropout(0.8),
+                       rnn, Affine(vocab_size, init, bias=init, activation=Softmax())])
+        model.initialize((nin, seq_len))
+        x = be.array(np.random.rand(nin, seq_len * be.bsz))
+        check_stream(model, x, [1] * seq_len)
+        check_stream(model, x, [2, 1, 2])
+
+
+def test_stream_input_unchanged(backend_default):
+    # a first layer working in place does not overwrite the input of the caller
+    be = backend_default
+    init = Uniform(low=-0.5, high=0.5)
+    model = Model([Dropout(0.8),
+                   LSTM(hidden_size, init, activation=Tanh(), gate_activation=Logistic(),
+                        reset_cells=True),
+                   Affine(vocab_size, init, bias=init, activation=Softmax())])
+    model.initialize((nin, seq_len))
+    x = be.array(np.random.rand(nin, seq_len * be.bsz))
+    before = x.get()
+    expected = model.fprop(be.array(before), inference=True).get()
+    model.reset_stream()
+    out = model.fprop_stream(x)
+    assert np.array_equal(x.get(), before)
+    assert np.allclose(out.get(), expected, rtol=0, atol=1e-5)
+
+
+def test_stream_ids(backend_default):
+    be = backend_default
+    init = Uniform(low=-0.5, high=0.5)
+    model = Model([LookupTable(vocab_size, hidden_size, init),
+                   LSTM(hidden_size, init, activation=Tanh(), gate_activation=Logistic(),
+                        reset_cells=True),
+                   Affine(vocab_size, init, bias=init, activation=Softmax())])
+    model.initialize((seq_len, 1))
+    words = np.random.randint(vocab_size, size=(seq_len, be.bsz))
+    expected = model.fprop(be.array(words), inference=True).get()
+    expected = expected.reshape((vocab_size, seq_len, be.bsz))
+
+    # feed the streams one word at a time, each call a different subset of
+    # them in a different order
+    pos = np.zeros(be.bsz, dtype=np.int32)
+    rng = np.random.RandomState(0)
+    while pos.min() < seq_len:
+        live = np.nonzero(pos < seq_len)[0]
+        streams = rng.permutation(live)[:rng.randint(1, len(live) + 1)]
+        x = be.array(words[pos[streams], streams].reshape((1, -1)))
+        out = model.fprop_stream(x, streams).get()
+        assert np.allclose(out, expected[:, pos[streams], streams], rtol=0, atol=1e-5)
+        pos[streams] += 1
+
+    # a reset stream starts over
+    model.reset_stream([0])
+    out = model.fprop_stream(be.array(words[:1, :1]), [0]).get()
+    assert np.allclose(out[:, 0], expected[:, 0, 0], rtol=0, atol=1e-5)
+
+    # the columns must split evenly between the streams
+    try:
+        model.fprop_stream(be.array(words[:1, :3]), [1, 2])
+        assert False, "an uneven number of columns per stream should raise"
+    except ValueError:
+        pass